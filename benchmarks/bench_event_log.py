@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+# Benchmark: the per-line event log attribute parser Chassis used to
+# have (one uncompiled re.search, a dict of strings, six int() calls and
+# a datetime per line) against EventLogParser.parseMany(), on a
+# synthetic AMM event log.
+#
+# Usage: bench_event_log [lines]
+
+import os, sys, re, time, datetime, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'site-packages'))
+
+from nmc_probe.event_log import EventLogParser
+
+CHASSIS_DOC_ID = 'chassis-012'
+
+def legacy_parse(line, serialNumberToDocId, chassisDocId = CHASSIS_DOC_ID):
+    '''Chassis.parseEventLogAttribute() before EventLogParser'''
+    dict = {'rawAttribute': line, 'chassisDocId': chassisDocId}
+
+    match = re.search('^Severity:(\S+)\s+Source:(\S+)\s+Serviceable Flag:\s+(\S+)\s+EventID:(\S+)\s+Name:(\S*)\s+Date:([0-9]+)\/([0-9]+)/([0-9]+)\s+Time:([0-9]+):([0-9]+):([0-9]+)$', line)
+
+    if match:
+        datetimeKeys = ['month', 'day', 'year', 'hour', 'minute', 'second']
+        keys = ['severity', 'source', 'serviceableFlag', 'eventID', 'name']
+        keys.extend(datetimeKeys)
+        idx = 1
+        for key in keys:
+            dict[key] = match.group(idx)
+            idx = idx + 1
+
+        month  = int(dict.get('month',  1))
+        day    = int(dict.get('day',    1))
+        year   = int(dict.get('year',   1970))
+        hour   = int(dict.get('hour',   0))
+        minute = int(dict.get('minute', 0))
+        second = int(dict.get('second', 0))
+
+        if year < 1970:
+            year = year + 2000
+
+        dt = datetime.datetime(year, month, day, hour, minute, second, 0)
+
+        dict['timestamp'] = dt.isoformat()
+
+        for key in datetimeKeys:
+            del dict[key]
+
+        match = re.search('Blade_([0-9]+)', dict['source'])
+        if match:
+            dict['slotDocId'] = '%s:slot-%02d' % (chassisDocId, int(match.group(1)))
+
+        if serialNumberToDocId.has_key(dict['name']):
+            dict['bladeDocId'] = serialNumberToDocId[dict['name']]
+
+    return dict
+
+def synthetic_log(num_lines):
+    '''A year of entries from 14 blades and the AMM itself, newest first'''
+    rng = random.Random(42)
+    sources = ['Blade_%02d' % slot for slot in range(1, 15)] + ['Audit', 'SERVPROC', 'Power_01']
+    severities = ['INFO', 'INFO', 'INFO', 'WARN', 'ERR']
+    start = datetime.datetime(2015, 7, 15, 22, 4, 8)
+
+    lines = []
+    for i in xrange(num_lines):
+        when = start - datetime.timedelta(seconds = i * 315)
+        source = rng.choice(sources)
+        name = ''
+        if source.startswith('Blade_'):
+            name = 'SN#YK13A082B%03d' % int(source[6:])
+        lines.append('Severity:%s  Source:%s  Serviceable Flag: %s  EventID:0x%08x  Name:%s  Date:%s  Time:%s' %
+                     (rng.choice(severities), source, rng.choice('UNY'), rng.randint(0, 0x1fffffff), name,
+                      when.strftime('%m/%d/%y'), when.strftime('%H:%M:%S')))
+
+    # Lines that don't parse are kept as they are
+    lines[::997] = ['Severity:INFO  Source:Audit  unparseable'] * len(lines[::997])
+    return lines
+
+def main():
+    num_lines = 100000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    lines = synthetic_log(num_lines)
+    serialNumberToDocId = dict([('SN#YK13A082B%03d' % slot, '00:1a:64:00:00:%02x' % slot)
+                                for slot in range(1, 15)])
+
+    start = time.time()
+    legacy = [legacy_parse(line, serialNumberToDocId) for line in lines]
+    legacy_time = time.time() - start
+
+    start = time.time()
+    records = list(EventLogParser(CHASSIS_DOC_ID, serialNumberToDocId).parseMany(lines))
+    batch_time = time.time() - start
+
+    for (old, record) in zip(legacy, records):
+        if old != record.asDict():
+            print 'Results differ:'
+            print ' legacy:         %s' % old
+            print ' EventLogParser: %s' % record.asDict()
+            sys.exit(1)
+
+    print '%d lines' % num_lines
+    print 'legacy parse:             %8.1f ms, %5.2f us/line' % (legacy_time * 1e3, legacy_time / num_lines * 1e6)
+    print 'EventLogParser.parseMany: %8.1f ms, %5.2f us/line' % (batch_time * 1e3, batch_time / num_lines * 1e6)
+    print 'speedup:                  %8.1fx' % (legacy_time / batch_time)
+
+if __name__ == '__main__':
+    main()
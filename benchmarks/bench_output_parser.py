@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+#
+# Microbenchmark: Command.extract_attrs (one re.match per pattern per line)
+# against the compiled OutputParser, on synthetic smartctl -a output.
+# Timed twice: with every attribute in the header, where OutputParser
+# stops early, and with some missing, where it scans every line.
+#
+# Usage: bench_output_parser [iterations]
+
+import os, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'site-packages'))
+
+from nmc_probe.command import Command
+from nmc_probe.smart import Smart
+
+HEADER = '''smartctl 6.2 2013-07-26 r3841 [x86_64-linux-3.10.0-229.el7.x86_64] (local build)
+Copyright (C) 2002-13, Bruce Allen, Christian Franke, www.smartmontools.org
+
+=== START OF INFORMATION SECTION ===
+Model Family:     Western Digital RE4
+Device Model:     WDC WD2003FYYS-02W0B1
+Serial Number:    WD-WCAY00000000
+LU WWN Device Id: 5 0014ee 0000000000
+Firmware Version: 01.01D02
+User Capacity:    2,000,398,934,016 bytes [2.00 TB]
+Sector Size:      512 bytes logical/physical
+Device is:        In smartctl database [for details use: -P show]
+ATA Version is:   ATA8-ACS (minor revision not indicated)
+SATA Version is:  SATA 2.6, 3.0 Gb/s
+Local Time is:    Wed Jul 15 22:04:08 2015 MDT
+SMART support is: Available - device has SMART capability.
+SMART support is: Enabled
+
+=== START OF READ SMART DATA SECTION ===
+SMART overall-health self-assessment test result: PASSED
+'''
+
+# Header lines some drives don't print, e.g. SAS drives have no WWN line
+MISSING = ('LU WWN Device Id:', 'Local Time is:')
+
+def smartctl_output(num_lines = 300, missing = ()):
+    '''Pad the header with attribute table and log lines to num_lines,
+    leaving out header lines that start with one of missing'''
+    lines = [line for line in HEADER.split('\n') if not line.startswith(missing)]
+    row = '%3d Raw_Read_Error_Rate     0x002f   200   200   051    Pre-fail  Always       -       0'
+    idx = 0
+    while len(lines) < num_lines:
+        lines.append(row % (idx % 255))
+        idx = idx + 1
+    return lines
+
+def bench(name, lines, legacy_patterns, iterations):
+    '''Check both parsers agree on lines, then time them'''
+    legacy = Command.extract_attrs(lines, legacy_patterns)
+    compiled = Smart.info_parser.parse(lines)
+
+    if legacy != compiled:
+        print 'Results differ:'
+        print ' extract_attrs: %s' % legacy
+        print ' OutputParser:  %s' % compiled
+        sys.exit(1)
+
+    legacy_time = timeit.timeit(lambda: Command.extract_attrs(lines, legacy_patterns), number=iterations)
+    compiled_time = timeit.timeit(lambda: Smart.info_parser.parse(lines), number=iterations)
+
+    print '%s: %d lines x %d patterns, %d iterations' % (name, len(lines), len(legacy_patterns), iterations)
+    print 'Command.extract_attrs: %8.1f us/parse' % (legacy_time / iterations * 1e6)
+    print 'OutputParser.parse:    %8.1f us/parse' % (compiled_time / iterations * 1e6)
+    print 'speedup:               %8.1fx' % (legacy_time / compiled_time)
+
+def main():
+    iterations = 2000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    # The legacy pattern => attribute dictionary for the same attributes
+    legacy_patterns = {}
+    for (attr, pattern, convert) in Smart.info_parser.spec:
+        legacy_patterns[pattern] = attr
+
+    bench('All attributes', smartctl_output(), legacy_patterns, iterations)
+    print
+    bench('Missing %s' % ', '.join([prefix.rstrip(':') for prefix in MISSING]),
+          smartctl_output(missing = MISSING), legacy_patterns, iterations)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# Microbenchmark: latency of Command.execute(['/bin/true']) when forking
+# the caller against going through the fork server, with the caller
+# holding 50 MB and then 500 MB of resident memory.
+#
+# Usage: bench_spawn [iterations]
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'site-packages'))
+
+from nmc_probe.command import Command
+
+PAGE = 4096
+
+def grow(ballast, mb):
+    '''Grow the ballast to mb megabytes, touching every page so it is resident'''
+    need = mb * 1024 * 1024 - sum([len(chunk) for chunk in ballast])
+    if need > 0:
+        chunk = bytearray(need)
+        for offset in xrange(0, need, PAGE):
+            chunk[offset] = 1
+        ballast.append(chunk)
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+def spawn_latency(iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        Command.execute(['/bin/true'])
+    return (time.time() - start) / iterations
+
+def main():
+    iterations = 500
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    ballast = []
+    print '%d spawns of /bin/true per measurement' % iterations
+    print '%8s %14s %14s' % ('RSS', 'fork', 'fork server')
+
+    for mb in (50, 500):
+        grow(ballast, mb)
+
+        Command.enableForkServer(False)
+        forked = spawn_latency(iterations)
+
+        Command.enableForkServer()
+        served = spawn_latency(iterations)
+
+        print '%5d MB %11.1f us %11.1f us' % (rss_mb(), forked * 1e6, served * 1e6)
+
+if __name__ == '__main__':
+    main()
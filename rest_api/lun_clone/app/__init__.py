@@ -37,11 +37,19 @@
 from nmc_probe_rest.lun_clone import LUNClone, LUNCloneStatus, LUNCloneTest
 from nmc_probe_rest.lun_clone import LUNCloneRepeat
 from nmc_probe.lun_clone_job import db
+from nmc_probe.command import Command
+from nmc_probe.forkserver import ForkServer
 from flask import Flask
 from flask.ext.restful import Api, Resource, reqparse
 from flask_sqlalchemy import SQLAlchemy
 import os
 
+# Start zfs and udevadm from a small helper process rather than forking
+# the workers. The helper starts here, in the uwsgi master, and is shared
+# by every worker forked from it
+Command.enableForkServer()
+ForkServer.shared()
+
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = \
     'sqlite:///%s' % os.environ['SQLITE_DB']
@@ -0,0 +1,371 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+#
+# Basic Encoding Rules for the subset of ASN.1 that SNMPv1 and SNMPv2c use
+
+# Universal types
+INTEGER      = 0x02
+OCTET_STRING = 0x04
+NULL         = 0x05
+OID          = 0x06
+SEQUENCE     = 0x30
+
+# SNMP application types
+IP_ADDRESS   = 0x40
+COUNTER32    = 0x41
+GAUGE32      = 0x42
+TIMETICKS    = 0x43
+OPAQUE       = 0x44
+COUNTER64    = 0x46
+
+# SNMPv2 exceptions, in place of a value
+NO_SUCH_OBJECT   = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW  = 0x82
+
+# PDU types
+GET_REQUEST      = 0xa0
+GET_NEXT_REQUEST = 0xa1
+GET_RESPONSE     = 0xa2
+SET_REQUEST      = 0xa3
+TRAP             = 0xa4
+GET_BULK_REQUEST = 0xa5
+INFORM_REQUEST   = 0xa6
+SNMPV2_TRAP      = 0xa7
+REPORT           = 0xa8
+
+# Message versions
+VERSION_1  = 0
+VERSION_2C = 1
+
+# Types whose value is an unsigned integer
+UNSIGNED_TYPES = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+class BERError(Exception):
+    """
+    Raised when a packet cannot be decoded
+    """
+    pass
+
+class Message:
+    """
+    A decoded SNMP message
+
+    Attributes
+    ----------
+    version     : int
+                  VERSION_1 or VERSION_2C
+    community   : string
+    pduType     : int
+                  One of the PDU type constants
+    requestId   : int
+    errorStatus : int
+                  Non-repeaters in a GETBULK request
+    errorIndex  : int
+                  Max repetitions in a GETBULK request
+    varbinds    : array
+                  (oid, type, value) tuples. oid is a tuple of ints, value
+                  is an int, a string, an oid tuple or None, see decodeValue()
+    trap        : V1Trap
+                  The header of an SNMPv1 trap, None for other PDUs, which
+                  have no requestId, errorStatus or errorIndex
+    """
+    def __init__(self, version, community, pduType, requestId,
+                 errorStatus = 0, errorIndex = 0, varbinds = None, trap = None):
+        self.version = version
+        self.community = community
+        self.pduType = pduType
+        self.requestId = requestId
+        self.errorStatus = errorStatus
+        self.errorIndex = errorIndex
+        self.varbinds = varbinds or []
+        self.trap = trap
+
+    def encode(self):
+        """
+        Returns
+        -------
+        The message as a packet
+        """
+        varbinds = ''.join([encodeTLV(SEQUENCE, encodeOid(oid) + encodeValue(type, value))
+                            for (oid, type, value) in self.varbinds])
+
+        if self.pduType == TRAP:
+            header = (encodeOid(self.trap.enterprise) +
+                      encodeValue(IP_ADDRESS, self.trap.agentAddress) +
+                      encodeInteger(self.trap.genericTrap) +
+                      encodeInteger(self.trap.specificTrap) +
+                      encodeInteger(self.trap.timestamp, TIMETICKS))
+        else:
+            header = (encodeInteger(self.requestId) +
+                      encodeInteger(self.errorStatus) +
+                      encodeInteger(self.errorIndex))
+
+        pdu = encodeTLV(self.pduType, header + encodeTLV(SEQUENCE, varbinds))
+
+        return encodeTLV(SEQUENCE,
+                         encodeInteger(self.version) +
+                         encodeTLV(OCTET_STRING, self.community) +
+                         pdu)
+
+    @classmethod
+    def decode(cls, packet):
+        """
+        Returns
+        -------
+        The Message in a packet. Raises BERError if the packet is malformed
+        """
+        try:
+            (tag, message, end) = decodeTLV(packet, 0)
+            if tag != SEQUENCE:
+                raise BERError('Not an SNMP message')
+
+            (tag, version, offset) = decodeTLV(message, 0)
+            (tag, community, offset) = decodeTLV(message, offset)
+            (pduType, pdu, offset) = decodeTLV(message, offset)
+
+            trap = None
+            if pduType == TRAP:
+                (tag, enterprise, offset) = decodeTLV(pdu, 0)
+                (tag, agentAddress, offset) = decodeTLV(pdu, offset)
+                (tag, genericTrap, offset) = decodeTLV(pdu, offset)
+                (tag, specificTrap, offset) = decodeTLV(pdu, offset)
+                (tag, timestamp, offset) = decodeTLV(pdu, offset)
+                trap = V1Trap(decodeOid(enterprise), decodeValue(IP_ADDRESS, agentAddress),
+                              decodeInteger(genericTrap), decodeInteger(specificTrap),
+                              decodeInteger(timestamp, signed=False))
+                (requestId, errorStatus, errorIndex) = (0, 0, 0)
+            else:
+                (tag, requestId, offset) = decodeTLV(pdu, 0)
+                (tag, errorStatus, offset) = decodeTLV(pdu, offset)
+                (tag, errorIndex, offset) = decodeTLV(pdu, offset)
+                requestId = decodeInteger(requestId)
+                errorStatus = decodeInteger(errorStatus)
+                errorIndex = decodeInteger(errorIndex)
+            (tag, varbindList, offset) = decodeTLV(pdu, offset)
+
+            varbinds = []
+            offset = 0
+            while offset < len(varbindList):
+                (tag, varbind, offset) = decodeTLV(varbindList, offset)
+                (tag, oid, next) = decodeTLV(varbind, 0)
+                (type, value, next) = decodeTLV(varbind, next)
+                varbinds.append((decodeOid(oid), type, decodeValue(type, value)))
+
+            return cls(decodeInteger(version), community, pduType,
+                       requestId, errorStatus, errorIndex, varbinds, trap)
+        except (IndexError, ValueError) as e:
+            raise BERError('Malformed SNMP message: %s' % e)
+
+class V1Trap:
+    """
+    The header of an SNMPv1 Trap-PDU
+
+    Attributes
+    ----------
+    enterprise   : tuple
+                   The OID of the object that sent the trap
+    agentAddress : string
+                   The dotted IP address of the agent
+    genericTrap  : int
+                   coldStart(0) through enterpriseSpecific(6)
+    specificTrap : int
+                   The enterprise's trap number, for enterpriseSpecific
+    timestamp    : int
+                   The agent's sysUpTime, in TimeTicks
+    """
+    def __init__(self, enterprise, agentAddress, genericTrap, specificTrap, timestamp):
+        self.enterprise = enterprise
+        self.agentAddress = agentAddress
+        self.genericTrap = genericTrap
+        self.specificTrap = specificTrap
+        self.timestamp = timestamp
+
+def encodeLength(length):
+    if length < 0x80:
+        return chr(length)
+
+    octets = ''
+    while length:
+        octets = chr(length & 0xff) + octets
+        length = length >> 8
+    return chr(0x80 | len(octets)) + octets
+
+def encodeTLV(tag, payload):
+    return chr(tag) + encodeLength(len(payload)) + payload
+
+def encodeInteger(value, tag = INTEGER):
+    """
+    Encode an integer in the fewest two's complement octets. Unsigned
+    types get a leading zero octet when their top bit is set
+    """
+    octets = []
+    while True:
+        octets.insert(0, value & 0xff)
+        value = value >> 8
+        if (value == 0 and not octets[0] & 0x80) or (value == -1 and octets[0] & 0x80):
+            break
+    return encodeTLV(tag, ''.join([chr(octet) for octet in octets]))
+
+def encodeOid(oid):
+    """
+    Params
+    ------
+    oid : tuple
+          The sub-identifiers, e.g. (1, 3, 6, 1, 2, 1, 1, 3, 0)
+    """
+    if len(oid) < 2:
+        raise ValueError('OID %s is too short' % (oid,))
+
+    octets = [chr(oid[0] * 40 + oid[1])]
+    for subid in oid[2:]:
+        chunk = [chr(subid & 0x7f)]
+        subid = subid >> 7
+        while subid:
+            chunk.insert(0, chr(0x80 | (subid & 0x7f)))
+            subid = subid >> 7
+        octets.extend(chunk)
+    return encodeTLV(OID, ''.join(octets))
+
+def encodeValue(type, value):
+    """
+    Encode a varbind value
+
+    Params
+    ------
+    type  : int
+            The type tag
+    value : int, string, tuple or None
+            As returned by decodeValue()
+    """
+    if type == INTEGER or type in UNSIGNED_TYPES:
+        return encodeInteger(value, type)
+    if type == OID:
+        return encodeOid(value)
+    if type == IP_ADDRESS:
+        return encodeTLV(type, ''.join([chr(int(part)) for part in value.split('.')]))
+    if type in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return encodeTLV(type, '')
+    return encodeTLV(type, value)
+
+def decodeTLV(data, offset):
+    """
+    Returns
+    -------
+    A tuple (tag, payload, offset of the next TLV)
+    """
+    tag = ord(data[offset])
+    length = ord(data[offset + 1])
+    offset = offset + 2
+
+    if length & 0x80:
+        count = length & 0x7f
+        length = 0
+        for octet in data[offset:offset + count]:
+            length = (length << 8) | ord(octet)
+        offset = offset + count
+
+    if offset + length > len(data):
+        raise BERError('Truncated value, tag 0x%02x' % tag)
+
+    return (tag, data[offset:offset + length], offset + length)
+
+def decodeInteger(payload, signed = True):
+    value = 0
+    for octet in payload:
+        value = (value << 8) | ord(octet)
+    if signed and payload and ord(payload[0]) & 0x80:
+        value = value - (1 << (8 * len(payload)))
+    return value
+
+def decodeOid(payload):
+    """
+    Returns
+    -------
+    The sub-identifiers as a tuple of ints
+    """
+    if not payload:
+        return ()
+
+    first = ord(payload[0])
+    oid = [min(first / 40, 2), first - 40 * min(first / 40, 2)]
+
+    subid = 0
+    for octet in payload[1:]:
+        octet = ord(octet)
+        subid = (subid << 7) | (octet & 0x7f)
+        if not octet & 0x80:
+            oid.append(subid)
+            subid = 0
+
+    return tuple(oid)
+
+def decodeValue(type, payload):
+    """
+    Returns
+    -------
+    A varbind value: an int for integer types, a dotted string for
+    IpAddress, a tuple for OIDs, None for NULL and the SNMPv2 exceptions,
+    and the raw octets for everything else
+    """
+    if type == INTEGER:
+        return decodeInteger(payload)
+    if type in UNSIGNED_TYPES:
+        return decodeInteger(payload, signed=False)
+    if type == OID:
+        return decodeOid(payload)
+    if type == IP_ADDRESS:
+        return '.'.join([str(ord(octet)) for octet in payload])
+    if type in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return None
+    return payload
+
+def parseOid(oid):
+    """
+    Returns
+    -------
+    A dotted numeric OID, like .1.3.6.1.2.1.1.3.0, as a tuple of ints
+    """
+    return tuple([int(part) for part in oid.strip('.').split('.')])
+
+def formatOid(oid):
+    """
+    Returns
+    -------
+    A tuple of ints as a dotted numeric OID with a leading dot, the way
+    net-snmp prints numeric OIDs
+    """
+    return '.' + '.'.join([str(subid) for subid in oid])
@@ -0,0 +1,351 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import time, heapq, threading
+from nmc_probe.log import Log
+from nmc_probe.nanek import Blade, Chassis
+from nmc_probe.scheduler import HostJob
+from nmc_probe.bladeutilsconfig import BladeUtilsConfig
+
+class PollGroup:
+    """
+    A set of OIDs polled together on their own interval. The group
+    itself GETs scalars, like installed blades and the system health
+    summary, and stores them on the Chassis document. Subclasses
+    override poll() to fetch tables
+
+    Attributes
+    ----------
+    name     : string
+               The group's name, also its option in the [poller] section
+    interval : float
+               Seconds between polls of one chassis
+    oids     : dictionary
+               Attribute => OID, None for the chassis' chassisOidDict
+    """
+    def __init__(self, name, interval, oids = None):
+        self.name = name
+        self.interval = interval
+        self.oids = oids
+
+    def poll(self, chassis, state):
+        """
+        Fetch the group's values from a chassis, the scalars in one GET
+
+        Params
+        ------
+        chassis : Chassis
+        state   : ChassisState
+                  What earlier polls learned about the chassis
+
+        Returns
+        -------
+        A dictionary of docId => dictionary of attributes, including type,
+        None if the chassis did not answer
+        """
+        oids = self.oids or chassis.chassisOidDict
+        values = chassis.snmp.scalars(oids.values())
+        if values is None:
+            return None
+
+        params = dict([(attr, values[oid]) for (attr, oid) in oids.items() if values.has_key(oid)])
+        params['type'] = 'chassis'
+        return {chassis.docId: params}
+
+class BladeGroup(PollGroup):
+    """
+    Columns of the blade tables, stored on the Blade documents. Rows are
+    matched to blades by the MAC address the vpd group last saw in the slot
+    """
+    def __init__(self, name, interval, oids):
+        """
+        Params
+        ------
+        oids : dictionary
+               Blade attribute => column OID
+        """
+        PollGroup.__init__(self, name, interval, oids)
+
+    def poll(self, chassis, state):
+        rows = chassis.snmp.table(self.oids.values())
+        if rows is None:
+            return None
+
+        docs = {}
+        for (slot, row) in rows.items():
+            params = dict([(attr, row[oid]) for (attr, oid) in self.oids.items() if row.has_key(oid)])
+            self.slotValues(chassis, state, slot, params, docs)
+
+            bladeDocId = state.blades.get(slot, None)
+            if bladeDocId and params:
+                params['type'] = 'blade'
+                docs.setdefault(bladeDocId, {}).update(params)
+
+        return docs
+
+    def slotValues(self, chassis, state, slot, params, docs):
+        """
+        Move values that belong to the Slot document out of params
+        """
+        pass
+
+class BladeVPDGroup(BladeGroup):
+    """
+    The vital product data of each blade, which only changes when a
+    blade is swapped. Also records which blade is in which slot
+    """
+    def slotValues(self, chassis, state, slot, params, docs):
+        mac0 = params.get('mac0', None)
+        if not mac0 or not Blade.isValidMac(mac0):
+            state.blades.pop(slot, None)
+            return
+
+        # Stored lower case, the way Blade stores them
+        blade = Blade({'mac0': mac0})
+        params['mac0'] = blade.mac0
+        if params.has_key('mac1'):
+            params['mac1'] = params['mac1'].lower()
+
+        state.blades[slot] = blade.docId
+        docs[slotDocId(chassis, slot)] = {'type': 'slot', 'bladeDocId': blade.docId}
+
+class BladeHealthGroup(BladeGroup):
+    """
+    Blade health and power state
+    """
+    def slotValues(self, chassis, state, slot, params, docs):
+        if params.has_key('powerState'):
+            docs[slotDocId(chassis, slot)] = {'type': 'slot', 'powerState': params.pop('powerState')}
+
+class FanPackGroup(PollGroup):
+    """
+    The fan pack table, stored on the Chassis document as one list per
+    column, the way Chassis.collectFanPackInfo() stores it
+    """
+    def poll(self, chassis, state):
+        values = chassis.snmp.walk('BLADE-MIB::fanPack')
+        if values is None:
+            return None
+
+        params = {'type': 'chassis'}
+        for (oid, value) in values:
+            (mibName, attr, lastOctet) = chassis.snmp.extractOidParts(oid)
+            if attr != 'fanPackIndex':
+                params.setdefault(attr, []).append(value)
+
+        return {chassis.docId: params}
+
+def slotDocId(chassis, slot):
+    return '%s:slot-%02d' % (chassis.docId, int(slot))
+
+class ChassisState:
+    """
+    What the poller knows about one chassis
+
+    Attributes
+    ----------
+    blades : dictionary
+             slot => docId of the Blade in it
+    due    : dictionary
+             group name => time.time() the group is next due
+    """
+    def __init__(self):
+        self.blades = {}
+        self.due = {}
+
+class ChassisPoller:
+    """
+    A long running collector. Each PollGroup is polled on its own
+    interval, the last value of every attribute is kept in memory, and
+    CouchDB is only written when a value changes.
+
+    Example
+    -------
+    poller = ChassisPoller(chassisList, couch, ChassisPoller.defaultGroups())
+    poller.run()
+    """
+    # Default seconds between polls, overridden by the [poller] config section
+    intervals = {
+        'vpd':     3600,
+        'chassis': 60,
+        'health':  30,
+        'fans':    30,
+    }
+
+    def __init__(self, chassisList, couch, groups, limit = 16):
+        """
+        Constructor
+
+        Params
+        ------
+        chassisList : array
+                      Chassis objects to poll
+        couch       : CouchDB
+        groups      : array
+                      PollGroups, polled in this order when due together
+        limit       : int
+                      Chassis to poll at the same time
+        """
+        self.chassisList = chassisList
+        self.couch = couch
+        self.groups = groups
+        self.limit = limit
+        self.states = dict([(chassis.docId, ChassisState()) for chassis in chassisList])
+        # docId => {attribute: last value written}
+        self.last = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.polls = 0
+        self.writes = 0
+
+    @classmethod
+    def defaultGroups(cls, file = None):
+        """
+        Returns
+        -------
+        The standard PollGroups, with intervals from the [poller] section
+        of the config file
+        """
+        config = None
+        if file:
+            config = BladeUtilsConfig(file)
+        else:
+            config = BladeUtilsConfig()
+
+        options = config.options.get('poller', {})
+        intervals = dict([(name, float(options.get(name, interval)))
+                          for (name, interval) in cls.intervals.items()])
+
+        return [BladeVPDGroup('vpd', intervals['vpd'], {
+                    'mac0':         'BLADE-MIB::bladeMACAddress1Vpd',
+                    'mac1':         'BLADE-MIB::bladeMACAddress2Vpd',
+                    'biosVersion':  'BLADE-MIB::bladeBiosVpdRevision',
+                    'bmcVersion':   'BLADE-MIB::bladeSysMgmtProcVpdRevision',
+                    'diagVersion':  'BLADE-MIB::bladeDiagsVpdRevision',
+                    'serialNumber': 'BLADE-MIB::bladeBiosVpdName',
+                }),
+                PollGroup('chassis', intervals['chassis']),
+                BladeHealthGroup('health', intervals['health'], {
+                    'healthState':              'BLADE-MIB::bladeHealthState',
+                    'healthSummarySeverity':    'BLADE-MIB::bladeHealthSummarySeverity',
+                    'healthSummaryDescription': 'BLADE-MIB::bladeHealthSummaryDescription',
+                    'powerState':               'BLADE-MIB::remoteControlBladePowerState',
+                }),
+                FanPackGroup('fans', intervals['fans'])]
+
+    def run(self):
+        """
+        Poll until stop() is called. Each chassis is polled by its own
+        thread on its own schedule, so a chassis that is slow to answer
+        only delays itself. At most limit chassis are polled at a time
+        """
+        self.running = threading.Semaphore(self.limit)
+
+        workers = [threading.Thread(target=self.pollChassis, args=(chassis,))
+                   for chassis in self.chassisList]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        for worker in workers:
+            # A timeout keeps the main thread interruptible by ^C
+            while worker.is_alive():
+                worker.join(1.0)
+
+    def pollChassis(self, chassis):
+        """
+        Poll the groups of one chassis as they come due, until stop() is called
+        """
+        # (due time, order, group), everything is due at the start
+        now = time.time()
+        heap = [(now, order, group) for (order, group) in enumerate(self.groups)]
+        heapq.heapify(heap)
+
+        while not self.stopped and heap:
+            wait = heap[0][0] - time.time()
+            if wait > 0:
+                time.sleep(min(wait, 1.0))
+                continue
+
+            (when, order, group) = heapq.heappop(heap)
+            job = HostJob(chassis.host, '%s %s' % (chassis.name, group.name), self.poll, (chassis, group))
+            with self.running:
+                job.run()
+
+            if job.failed:
+                Log.error('%s failed after %.1fs\n%s' % (job.name, job.elapsed, job.error))
+
+            # Keep the interval steady, but don't try to catch up
+            heapq.heappush(heap, (max(when + group.interval, time.time()), order, group))
+
+    def stop(self):
+        self.stopped = True
+
+    def poll(self, chassis, group):
+        """
+        Poll one group from one chassis and write whatever changed
+        """
+        docs = group.poll(chassis, self.states[chassis.docId])
+        with self.lock:
+            self.polls = self.polls + 1
+
+        if docs is None:
+            Log.debug(5, '%s did not answer %s' % (chassis.name, group.name))
+            return
+
+        for (docId, params) in docs.items():
+            changed = self.changes(docId, params)
+            if changed:
+                Log.debug(10, '%s %s changed: %s' % (chassis.name, docId, changed.keys()))
+                if not self.couch.saveDocument(docId, dict(changed, type=params['type'])):
+                    # Not remembered, so the write is retried next poll
+                    continue
+
+                with self.lock:
+                    self.writes = self.writes + 1
+                    self.last.setdefault(docId, {}).update(changed)
+
+    def changes(self, docId, params):
+        """
+        Returns
+        -------
+        A dictionary of the attributes of a document whose values differ
+        from the last ones written, empty if nothing changed
+        """
+        with self.lock:
+            last = self.last.get(docId, {})
+            return dict([(attr, value) for (attr, value) in params.items()
+                         if attr != 'type' and (not last.has_key(attr) or last[attr] != value)])
@@ -34,10 +34,70 @@
 #
 # }}}
 
-import os,subprocess,log,sys,re
+import os,subprocess,log,sys,re,math
 from subprocess import PIPE,Popen
-import threading, time, Queue
+import threading, select, signal, errno, time, atexit, collections, Queue
 from nmc_probe.log import Log
+from nmc_probe.fixture import Fixture
+from nmc_probe.stats import CommandStats
+from nmc_probe.forkserver import ForkServer
+
+def pollWithRetry(poller, timeout = None):
+    """
+    Call poller.poll(), retrying if a signal handler interrupts the call
+
+    Params
+    ------
+    poller  : object
+              A select.poll object
+    timeout : int
+              Milliseconds to wait, None to wait forever
+    """
+    while True:
+        try:
+            return poller.poll(timeout)
+        except (select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+class CommandResult:
+    """
+    The outcome of running a command
+
+    Attributes
+    ----------
+    args     : array
+               The command and its arguments
+    exitcode : int
+               The exit code, None if the command could not be started
+    stdout   : string
+               Everything the command wrote to standard output
+    stderr   : string
+               Everything the command wrote to standard error
+    timedOut : bool
+               True if the command was killed for running too long
+    elapsed  : float
+               Wall clock seconds spent running the command
+    """
+    def __init__(self, args):
+        self.args = args
+        self.exitcode = None
+        self.stdout = None
+        self.stderr = None
+        self.timedOut = False
+        self.elapsed = 0.0
+
+    @property
+    def lines(self):
+        """
+        Returns
+        -------
+        Standard output split into an array of lines, the same shape
+        Command.run() returns. None if the command could not be started
+        """
+        if self.stdout is None:
+            return None
+        return self.stdout.split('\n')
 
 class Command:
     """                                                                         
@@ -48,25 +108,224 @@ class Command:
     -------
     A tuple: (all output, exit code)
     """
+    # Optional CommandCache, see enableCache()
+    cache = None
+
+    # Fixture directories, see enableRecording() and enableReplay()
+    recordDir = os.environ.get('NMC_PROBE_RECORD')
+    replayDir = os.environ.get('NMC_PROBE_REPLAY')
+
+    # Start commands through the ForkServer, see enableForkServer()
+    useForkServer = bool(os.environ.get('NMC_PROBE_FORKSERVER'))
+
+    # Fake executable that serves fixtures in replay mode
+    replayScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay.py')
+
+    @classmethod
+    def enableCache(cls, cache):
+        """
+        Memoize read-only commands. Every command run through this module
+        checks the cache first, so a fresh cached query does not fork
+
+        Params
+        ------
+        cache : object
+                A CommandCache, or None to turn caching off
+        """
+        Command.cache = cache
+
+    @classmethod
+    def enableForkServer(cls, enable = True):
+        """
+        Start commands from a small helper process instead of forking
+        this one, so the cost of starting a command does not grow with
+        this process's memory footprint. Also enabled by setting
+        NMC_PROBE_FORKSERVER
+
+        Params
+        ------
+        enable : bool
+                 False to go back to forking this process
+        """
+        Command.useForkServer = enable
+
+    @classmethod
+    def spawn(cls, args, group = False):
+        """
+        Start a command with standard output and error piped back
+
+        Params
+        ------
+        args  : array
+                The command and its arguments
+        group : bool
+                Start the command in its own process group
+
+        Returns
+        -------
+        A Popen, or a ForkServerProcess when the fork server is enabled.
+        Raises OSError if the command could not be started
+        """
+        args = Command.spawnArgs(args)
+
+        if Command.useForkServer:
+            return ForkServer.shared().spawn(args, group)
+
+        preexec = None
+        if group:
+            preexec = os.setpgrp
+
+        return Popen(args, stdout=PIPE, stderr=PIPE, close_fds=True,
+                     preexec_fn=preexec)
+
+    @classmethod
+    def enableRecording(cls, directory):
+        """
+        Save the arguments, output and exit code of every command that
+        runs into a fixture file. Also enabled by setting NMC_PROBE_RECORD
+
+        Params
+        ------
+        directory : string
+                    Where to write fixtures, or None to stop recording
+        """
+        Command.recordDir = directory
+
+    @classmethod
+    def enableReplay(cls, directory):
+        """
+        Serve every command from previously recorded fixtures instead of
+        running the real tool. The fixtures are served by a separate
+        process, so timings still include the cost of starting a command.
+        Also enabled by setting NMC_PROBE_REPLAY
+
+        Params
+        ------
+        directory : string
+                    Where to read fixtures, or None to run real commands
+        """
+        Command.replayDir = directory
+
+    @classmethod
+    def spawnArgs(cls, args):
+        """
+        Returns
+        -------
+        The argument list to hand to Popen for a command, which is the
+        replay script standing in for the tool when replaying
+        """
+        if Command.replayDir is None:
+            return args
+        return [sys.executable, Command.replayScript, 'serve', Command.replayDir, '--'] + list(args)
+
+    @classmethod
+    def requireTool(cls, path):
+        """
+        Raise OSError if a tool is not installed. When replaying, tools
+        are served from fixtures and need not be installed
+        """
+        if Command.replayDir is None:
+            os.stat(path)
+
+    @classmethod
+    def recording(cls):
+        """
+        Returns
+        -------
+        True if commands that run are saved as fixtures. Replayed
+        commands are never recorded
+        """
+        return Command.recordDir is not None and Command.replayDir is None
+
+    @classmethod
+    def record(cls, args, exitcode, stdout, stderr):
+        """
+        Save a fixture for a command that has finished, if recording
+        """
+        if not Command.recording():
+            return
+
+        try:
+            Fixture(args, exitcode, stdout, stderr).save(Command.recordDir)
+        except (IOError, OSError, ValueError) as e:
+            # Recording must never break the run being recorded
+            Log.error('Unable to record %s: %s' % (args[0], e))
+
     @classmethod
-    def run(cls, args):
+    def run(cls, args, timeout = None):
         output = None
         exitCode = 0
-        try:
-            Log.debug(100, ' '.join(args))
-            proc = Popen(args, stdout=PIPE)
-            output = proc.communicate()[0].split('\n')
-            exitCode = proc.returncode
-        except (OSError) as e:
-            Log.error(str(e))
+
+        result = Command.execute(args, timeout)
+
+        if result.stdout is not None:
+            output = result.lines
+            exitCode = result.exitcode
 
         return (output, exitCode)
 
+    @classmethod
+    def execute(cls, args, timeout = None):
+        """
+        Run a command to completion, capturing standard output and
+        standard error. The command is started in its own process group,
+        so if it runs longer than the timeout the whole group, including
+        any children it started, is killed.
+
+        This is a thin wrapper that runs the command on this thread's
+        CommandLoop. Commands submitted to the loop by the caller keep
+        running while this one does.
+
+        Params
+        ------
+        args    : array
+                  The command and its arguments
+        timeout : float
+                  Wall clock seconds the command may run. None for no limit
+
+        Returns
+        -------
+        A CommandResult
+        """
+        loop = CommandLoop.current()
+        task = loop.submit(args, timeout)
+        loop.runUntil(task)
+        return task.result
+
+    @classmethod
+    def killGroup(cls, proc):
+        """
+        Kill a process started by execute() along with everything
+        else in its process group
+        """
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (OSError) as e:
+            # The group is already gone
+            if e.errno != errno.ESRCH:
+                raise
+
     @classmethod
     def run_and_extract_attrs(cls, args, attr_patterns):
         (output, exitcode) = Command.run(args)
+        return Command.extract_attrs(output, attr_patterns)
+
+    @classmethod
+    def extract_attrs(cls, output, attr_patterns):
+        """
+        Match each line of output against a dictionary of
+        regex pattern => attribute name
+
+        Returns
+        -------
+        A dictionary of attribute name => first match group, or True
+        if the pattern has no groups
+        """
         attr_list = {}
 
+        if output is None:
+            return attr_list
+
         for line in output:
             for (pattern, attr) in attr_patterns.iteritems():
                 match = re.match(pattern, line)
@@ -81,75 +340,660 @@ class Command:
 
         return attr_list
 
-class AsynchronousFileReader(threading.Thread):
-    '''
-    Helper class to implement asynchronous reading of a file
-    in a separate thread. Pushes read lines on a queue to
-    be consumed in another thread.
-
-    http://stefaanlippens.net/python-asynchronous-subprocess-pipe-reading
-    '''
- 
-    def __init__(self, fd, queue):
-        assert isinstance(queue, Queue.Queue)
-        assert callable(fd.readline)
-        threading.Thread.__init__(self)
-        self._fd = fd
-        self._queue = queue
- 
-    def run(self):
-        '''The body of the tread: read lines and put them on the queue.'''
-        for line in iter(self._fd.readline, ''):
-            self._queue.put(line)
- 
-    def eof(self):
-        '''Check whether there is no more content to expect.'''
-        return not self.is_alive() and self._queue.empty()
-
-class AsyncCommand(threading.Thread):
-    def __init__(self, command):
-        self.command = command
-        self.queue = Queue.Queue()
-        threading.Thread.__init__(self)
-        self.start()
-
-    def run(self):
-        # Launch the command as subprocess.
-        process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
- 
-        # Launch the asynchronous readers of the process' stdout and stderr.
-        stdoutQueue = Queue.Queue()
-        stdoutReader = AsynchronousFileReader(process.stdout, stdoutQueue)
-        stdoutReader.start()
-        stderrQueue = Queue.Queue()
-        stderrReader = AsynchronousFileReader(process.stderr, stderrQueue)
-        stderrReader.start()
-
-        # Check the queues if we received some output (until there is nothing more to get).
-        while not stdoutReader.eof() or not stderrReader.eof():
-            # Show what we received from standard output.
-            while not stdoutQueue.empty():
-                line = stdoutQueue.get()
-                self.queue.put(line.rstrip())
- 
-            # Show what we received from standard error.
-            while not stderrQueue.empty():
-                line = stderrQueue.get()
-                print 'Received line on standard error: ' + repr(line)
- 
-            # Sleep a bit before asking the readers again.
-            time.sleep(.1)
- 
-        # Let's be tidy and join the threads we've started.
-        stdoutReader.join()
-        stderrReader.join()
- 
-        # Close subprocess' file descriptors.
-        process.stdout.close()
-        process.stderr.close()
+class CommandTask:
+    """
+    A command submitted to a CommandLoop
 
+    Attributes
+    ----------
+    args      : array
+                The command and its arguments
+    result    : CommandResult
+                Filled in as the command runs, complete once done() is true
+    cancelled : bool
+                True if cancel() was called before the command finished
+    """
+    def __init__(self, args, timeout = None, group = True, onLine = None, onDone = None):
+        """
+        Constructor
+
+        Params
+        ------
+        args    : array
+                  The command and its arguments
+        timeout : float
+                  Wall clock seconds the command may run. None for no limit
+        group   : bool
+                  Start the command in its own process group, so a
+                  timeout or cancel() also kills anything it started
+        onLine  : function
+                  Called with each line of standard output, trailing
+                  whitespace removed, as soon as the line is complete
+        onDone  : function
+                  Called with this task once the command has finished
+        """
+        self.args = args
+        self.timeout = timeout
+        self.group = group
+        self.onLine = onLine
+        self.onDone = onDone
+        self.result = CommandResult(args)
+        self.cancelled = False
+        self.proc = None
+        self.start = None
+        self.deadline = None
+        self.finished = False
+        self.cached = False
+        self.chunks = {}
+        self.stdoutFd = None
+        self.stderrFd = None
+        self.partial = ''
+        self.openFds = 0
+        self.reapDelay = CommandLoop.reapInterval
+        self.spun = False
+
+    def done(self):
+        """
+        Returns
+        -------
+        True if the command has finished
+        """
+        return self.finished
+
+    def cancel(self):
+        """
+        Kill the command. The task finishes once the loop has reaped it
+        """
+        if self.finished or self.cancelled:
+            return
+
+        self.cancelled = True
+        if self.proc is not None:
+            self.kill()
+
+    def kill(self):
+        if self.group:
+            Command.killGroup(self.proc)
+        else:
+            try:
+                self.proc.kill()
+            except (OSError) as e:
+                if e.errno != errno.ESRCH:
+                    raise
 
     @property
-    def eof(self):
-        '''Check whether there is no more content to expect.'''
-        return not self.is_alive() and self.queue.empty()
+    def stderrLines(self):
+        """
+        Returns
+        -------
+        Standard error as an array of lines, trailing whitespace removed
+        """
+        if not self.result.stderr:
+            return []
+        return [line.rstrip() for line in self.result.stderr.rstrip('\n').split('\n')]
+
+    def launch(self):
+        """
+        Start the command, or answer it from the command cache
+
+        Returns
+        -------
+        True if a process was started
+        """
+        self.start = time.time()
+        if self.timeout is not None:
+            self.deadline = self.start + self.timeout
+
+        cache = Command.cache
+        if cache is not None:
+            cached = cache.lookup(self.args)
+            if cached is not None:
+                (self.result.stdout, self.result.exitcode) = cached
+                self.result.stderr = ''
+                self.cached = True
+                CommandStats.recordCached(self.args)
+
+                if self.onLine is not None:
+                    lines = self.result.stdout.split('\n')
+                    if lines[-1] == '':
+                        lines.pop()
+                    for line in lines:
+                        self.onLine(line.rstrip())
+
+                self.finish()
+                return False
+
+        try:
+            Log.debug(100, ' '.join(self.args))
+            self.proc = Command.spawn(self.args, self.group)
+        except (OSError) as e:
+            Log.error(str(e))
+            CommandStats.record(self.args, time.time() - self.start, None)
+            self.finish()
+            return False
+
+        self.stdoutFd = self.proc.stdout.fileno()
+        self.stderrFd = self.proc.stderr.fileno()
+        self.chunks = {self.stdoutFd: [], self.stderrFd: []}
+        self.openFds = 2
+        return True
+
+    def read(self, fd):
+        """
+        Read what is available from one of the command's pipes
+
+        Returns
+        -------
+        False once the pipe reaches end of file
+        """
+        data = os.read(fd, 65536)
+
+        if not data:
+            self.openFds = self.openFds - 1
+            if fd == self.stdoutFd and self.partial:
+                self.deliver([self.partial])
+                self.partial = ''
+            return False
+
+        self.chunks[fd].append(data)
+
+        if self.onLine is not None and fd == self.stdoutFd:
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            self.deliver(lines)
+
+        return True
+
+    def deliver(self, lines):
+        if self.cancelled or self.onLine is None:
+            return
+        for line in lines:
+            self.onLine(line.rstrip())
+
+    def exited(self):
+        """
+        Returns
+        -------
+        True once the command has exited. A command that has closed both
+        pipes nearly always exits within a fraction of a millisecond, so
+        the first check waits that long rather than leaving the loop to
+        check again a whole poll() interval later
+        """
+        if self.proc.poll() is None and not self.spun:
+            self.spun = True
+            deadline = time.time() + 0.001
+            while self.proc.poll() is None and time.time() < deadline:
+                time.sleep(0.00005)
+        return self.proc.returncode is not None
+
+    def finish(self):
+        """
+        Called by the loop once the command has exited and both pipes
+        are closed: fill in the result, log, record and cache it
+        """
+        result = self.result
+        self.finished = True
+
+        if self.proc is not None:
+            self.proc.stdout.close()
+            self.proc.stderr.close()
+
+            result.exitcode = self.proc.returncode
+            result.stdout = ''.join(self.chunks[self.stdoutFd])
+            result.stderr = ''.join(self.chunks[self.stderrFd])
+            result.elapsed = time.time() - self.start
+            self.chunks = {}
+
+            CommandStats.record(self.args, result.elapsed, result.exitcode, result.stdout)
+
+            if result.timedOut:
+                Log.error('%s killed after %s seconds' % (' '.join(self.args), self.timeout))
+
+            # Surface diagnostics from failed commands, they are no longer
+            # written straight to the terminal
+            for line in self.stderrLines:
+                if result.exitcode != 0 and not self.cancelled:
+                    Log.error('%s: %s' % (self.args[0], line))
+                else:
+                    Log.debug(100, '%s: %s' % (self.args[0], line))
+
+            if not result.timedOut and not self.cancelled:
+                Command.record(self.args, result.exitcode, result.stdout, result.stderr)
+
+                if Command.cache is not None:
+                    Command.cache.store(self.args, result.stdout, result.exitcode)
+
+        if self.onDone is not None:
+            self.onDone(self)
+
+class CommandLoop:
+    """
+    Runs many commands at once from a single thread. Every command's
+    pipes are multiplexed with one poll(), so fanning out to hundreds of
+    disks or chassis costs no threads, and a concurrency limit keeps the
+    number of live processes bounded.
+
+    Command.execute(), StreamingCommand and CommandPool are all thin
+    wrappers around a CommandLoop, so collectors can move to it
+    piece by piece.
+
+    Example
+    -------
+    loop = CommandLoop(16)
+    tasks = [loop.submit([smartctl_cmd, '-a', dev], timeout=60) for dev in devs]
+    loop.run()
+    results = [task.result for task in tasks]
+    """
+    # Seconds between checks for children that closed their pipes but
+    # have not exited yet. Most exit within a millisecond, so start
+    # small and back off for the ones that linger
+    reapInterval = 0.001
+    maxReapInterval = 0.05
+
+    _local = threading.local()
+
+    def __init__(self, limit = None):
+        """
+        Constructor
+
+        Params
+        ------
+        limit : int
+                Maximum number of commands running at once, None for no limit
+        """
+        self.limit = limit
+        self.poller = select.poll()
+        self.fds = {}
+        self.watchers = {}
+        self.running = []
+        self.pending = collections.deque()
+        self.depth = 0
+        self.stopped = False
+
+    @classmethod
+    def current(cls):
+        """
+        Returns
+        -------
+        This thread's loop, created on first use. A callback that runs
+        a command while the loop is already running gets a fresh loop
+        """
+        loop = getattr(cls._local, 'loop', None)
+        if loop is None:
+            loop = cls._local.loop = cls()
+        if loop.depth > 0:
+            return cls()
+        return loop
+
+    def submit(self, args, timeout = None, group = True, onLine = None, onDone = None):
+        """
+        Queue a command to run the next time the loop runs. See
+        CommandTask for the parameters
+
+        Returns
+        -------
+        A CommandTask
+        """
+        task = CommandTask(args, timeout, group, onLine, onDone)
+        self.pending.append(task)
+        return task
+
+    def map(self, argsList, timeout = None):
+        """
+        Run a batch of commands and wait for all of them
+
+        Returns
+        -------
+        An array of CommandResult, in the same order as argsList
+        """
+        tasks = [self.submit(args, timeout) for args in argsList]
+        for task in tasks:
+            self.runUntil(task)
+        return [task.result for task in tasks]
+
+    def watch(self, fd, callback):
+        """
+        Call callback() from the loop whenever fd is readable
+        """
+        self.watchers[fd] = callback
+        self.poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def unwatch(self, fd):
+        del self.watchers[fd]
+        self.poller.unregister(fd)
+
+    def busy(self):
+        """
+        Returns
+        -------
+        True if any submitted command has not finished
+        """
+        return len(self.running) > 0 or len(self.pending) > 0
+
+    def stop(self):
+        """
+        Make run(forever=True) return once running commands finish
+        """
+        self.stopped = True
+
+    def run(self, forever = False):
+        """
+        Run until every submitted command has finished
+
+        Params
+        ------
+        forever : bool
+                  Keep waiting for more commands, from watch() callbacks,
+                  until stop() is called
+        """
+        while self.busy() or (forever and not self.stopped):
+            self.runOnce()
+
+    def runUntil(self, task):
+        """
+        Run until one command has finished. Other commands keep running
+        """
+        while not task.done():
+            self.runOnce()
+
+    def runOnce(self):
+        """
+        Start pending commands, wait for output, a timeout or a child
+        to exit, and handle whatever happened
+        """
+        self.depth = self.depth + 1
+        try:
+            self.launchPending()
+
+            now = time.time()
+            wait = None
+            for task in self.running:
+                if task.openFds == 0:
+                    wait = task.reapDelay
+                    task.reapDelay = min(task.reapDelay * 2, self.maxReapInterval)
+                elif task.deadline is not None:
+                    remaining = max(0.0, task.deadline - now)
+                    if wait is None or remaining < wait:
+                        wait = remaining
+
+            if wait is not None:
+                wait = int(math.ceil(wait * 1000))
+            elif not self.running and not self.watchers:
+                return
+
+            for (fd, event) in pollWithRetry(self.poller, wait):
+                watcher = self.watchers.get(fd, None)
+                if watcher is not None:
+                    watcher()
+                    continue
+
+                task = self.fds.get(fd, None)
+                if task is not None and not task.read(fd):
+                    self.poller.unregister(fd)
+                    del self.fds[fd]
+
+            now = time.time()
+            for task in list(self.running):
+                if task.deadline is not None and now >= task.deadline and not task.result.timedOut:
+                    task.result.timedOut = True
+                    task.kill()
+
+                if task.openFds == 0 and task.exited():
+                    self.running.remove(task)
+                    task.finish()
+        finally:
+            self.depth = self.depth - 1
+
+    def launchPending(self):
+        while self.pending and (self.limit is None or len(self.running) < self.limit):
+            task = self.pending.popleft()
+            if task.cancelled:
+                task.finish()
+                continue
+            if task.launch():
+                self.running.append(task)
+                for fd in task.chunks:
+                    self.fds[fd] = task
+                    self.poller.register(fd, select.POLLIN | select.POLLPRI)
+
+class StreamingCommand:
+    """
+    Run a command and read its standard output one line at a time.
+    The command runs on this thread's CommandLoop, so no reader threads
+    are started and no time is spent sleeping or spinning while the
+    command is quiet.
+
+    Example
+    -------
+    cmd = StreamingCommand(['/usr/local/bin/sas2ircu', 'list'])
+    for line in cmd:
+        print line
+
+    Attributes
+    ----------
+    args     : array
+               The command and its arguments
+    stderr   : array
+               Lines the command wrote to standard error
+    exitcode : int
+               The exit code, set once standard output has been consumed
+    """
+    def __init__(self, args):
+        self.args = args
+        self.stderr = []
+        self.exitcode = None
+
+    def __iter__(self):
+        return self.lines()
+
+    def lines(self):
+        """
+        Generator that yields each line of standard output, with trailing
+        whitespace removed, as soon as it is available. If the caller stops
+        iterating early, the command is killed, unless it is being
+        recorded or the command cache is enabled.
+        """
+        lines = collections.deque()
+        loop = CommandLoop.current()
+        task = loop.submit(self.args, group=False, onLine=lines.append)
+
+        try:
+            while True:
+                while lines:
+                    yield lines.popleft()
+                if task.done():
+                    break
+                loop.runOnce()
+        finally:
+            if not task.done():
+                if Command.recording() or Command.cache is not None:
+                    # The consumer stopped reading early, but a fixture or
+                    # cache entry needs the complete output, so let the
+                    # command finish
+                    task.onLine = None
+                else:
+                    # The consumer stopped reading early, don't leave
+                    # the child behind
+                    task.cancel()
+                loop.runUntil(task)
+
+            self.exitcode = task.result.exitcode
+            self.stderr = task.stderrLines
+
+class CommandFuture:
+    """
+    A command submitted to a CommandPool that may not have finished yet
+    """
+    def __init__(self, args, timeout):
+        self.args = args
+        self.timeout = timeout
+        self._result = None
+        self._done = threading.Event()
+
+    def done(self):
+        """
+        Returns
+        -------
+        True if the command has finished
+        """
+        return self._done.is_set()
+
+    def result(self, timeout = None):
+        """
+        Wait for the command to finish
+
+        Params
+        ------
+        timeout : float
+                  Seconds to wait. None to wait until the command finishes
+
+        Returns
+        -------
+        A CommandResult, or None if the command is still running
+        """
+        self._done.wait(timeout)
+        return self._result
+
+    def setResult(self, result):
+        """
+        Called by the pool when the command has finished
+        """
+        self._result = result
+        self._done.set()
+
+class CommandPool:
+    """
+    Runs up to a fixed number of commands at the same time. Each command
+    is limited to a wall clock timeout, after which its process group is
+    killed, so one hung tool cannot stall a whole collection run.
+
+    The commands run on a CommandLoop in a single background thread,
+    so any thread may submit to the pool and wait on the futures.
+
+    Example
+    -------
+    pool = CommandPool(8, timeout=60)
+    futures = [pool.submit([smartctl_cmd, '-a', dev]) for dev in devs]
+    results = [future.result() for future in futures]
+    """
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, size = 8, timeout = None):
+        """
+        Constructor
+
+        Params
+        ------
+        size    : int
+                  Maximum number of commands running at once
+        timeout : float
+                  Default wall clock timeout in seconds for each command
+        """
+        self.size = size
+        self.timeout = timeout
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.wakeup = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns
+        -------
+        The process wide pool, created on first use
+        """
+        with cls._sharedLock:
+            if cls._shared is None:
+                cls._shared = cls()
+                # Python 2 tears down modules under running daemon
+                # threads, so stop the loop before that happens
+                atexit.register(cls._shared.shutdown)
+        return cls._shared
+
+    def submit(self, args, timeout = None):
+        """
+        Queue a command to run
+
+        Params
+        ------
+        args    : array
+                  The command and its arguments
+        timeout : float
+                  Wall clock timeout in seconds, defaults to the pool's timeout
+
+        Returns
+        -------
+        A CommandFuture
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        future = CommandFuture(args, timeout)
+        self.startLoop()
+        self.queue.put(future)
+        os.write(self.wakeup[1], 'x')
+        return future
+
+    def map(self, argsList, timeout = None):
+        """
+        Run a batch of commands and wait for all of them
+
+        Returns
+        -------
+        An array of CommandResult, in the same order as argsList
+        """
+        futures = [self.submit(args, timeout) for args in argsList]
+        return [future.result() for future in futures]
+
+    def startLoop(self):
+        """
+        Start the loop thread the first time a command is submitted
+        """
+        with self.lock:
+            if self.thread is None:
+                self.wakeup = os.pipe()
+                self.loop = CommandLoop(self.size)
+                self.loop.watch(self.wakeup[0], self.drain)
+                self.thread = threading.Thread(target=self.loop.run, args=(True,))
+                self.thread.daemon = True
+                self.thread.start()
+
+    def drain(self):
+        """
+        Called on the loop thread when commands have been submitted:
+        move them from the queue onto the loop, until a None sentinel
+        is received
+        """
+        os.read(self.wakeup[0], 4096)
+
+        while True:
+            try:
+                future = self.queue.get_nowait()
+            except (Queue.Empty):
+                break
+
+            if future is None:
+                self.loop.stop()
+                break
+
+            self.loop.submit(future.args, future.timeout,
+                             onDone=lambda task, future=future: future.setResult(task.result))
+
+    def shutdown(self):
+        """
+        Stop the loop thread once the queued commands have run
+        """
+        with self.lock:
+            if self.thread is None:
+                return
+
+            self.queue.put(None)
+            os.write(self.wakeup[1], 'x')
+            self.thread.join()
+
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+            self.thread = None
+            self.wakeup = None
@@ -0,0 +1,288 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from nmc_probe.log import Log
+from nmc_probe.fixture import Fixture, OUTPUT_ENCODING
+
+class CommandCache:
+    """
+    Opt-in memoization of read-only tool output, keyed on the full
+    argument list. Each tool has its own time to live, the number of
+    entries held in memory is bounded (least recently used entries are
+    dropped first), and entries can optionally be written to a directory
+    so that back to back runs of different programs share them.
+
+    Install a cache with Command.enableCache(). Once installed, every
+    command run through nmc_probe.command consults it.
+
+    Example
+    -------
+    Command.enableCache(CommandCache.withDefaultRules('/var/cache/nmc_probe'))
+    """
+    def __init__(self, maxSize = 256, path = None):
+        """
+        Constructor
+
+        Params
+        ------
+        maxSize : int
+                  Maximum number of entries kept in memory
+        path    : string
+                  Optional directory used as a backing store. If it
+                  cannot be created, the cache is memory only
+        """
+        self.maxSize = maxSize
+        self.path = path
+        self.rules = {}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.path is not None:
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+            except (OSError) as e:
+                Log.error('Command cache disabled on disk: %s' % e)
+                self.path = None
+
+    @classmethod
+    def withDefaultRules(cls, path = None, maxSize = 256):
+        """
+        Returns
+        -------
+        A cache with rules for the disk tools used by the jbod_* programs
+        """
+        cache = cls(maxSize, path)
+        cache.addRule('sas2ircu', 60, readOnly=['LIST', 'DISPLAY'], mutating=['LOCATE'])
+        cache.addRule('hdparm', 300, readOnly=['-I'])
+        cache.addRule('smartctl', 60, readOnly=['-i', '-a'], mutating=['--test', '-t'])
+        return cache
+
+    def addRule(self, tool, ttl, readOnly = None, mutating = None):
+        """
+        Describe which invocations of a tool may be cached
+
+        Params
+        ------
+        tool     : string
+                   Base name of the executable, eg sas2ircu
+        ttl      : float
+                   Seconds an entry stays valid
+        readOnly : array
+                   Arguments that mark an invocation as a read-only query.
+                   Only invocations containing one of them are cached.
+                   Compared case insensitively
+        mutating : array
+                   Argument prefixes that mark an invocation as changing
+                   the device. These bypass the cache and invalidate every
+                   entry for the tool
+        """
+        self.rules[tool] = {'ttl':      ttl,
+                            'readOnly': [arg.lower() for arg in (readOnly or [])],
+                            'mutating': [arg.lower() for arg in (mutating or [])]}
+
+    def classify(self, args):
+        """
+        Returns
+        -------
+        A tuple (rule, mutating). rule is None if this tool has no rule
+        or the invocation is not a cacheable query
+        """
+        rule = self.rules.get(os.path.basename(args[0]), None)
+        if rule is None:
+            return (None, False)
+
+        lowered = [str(arg).lower() for arg in args[1:]]
+
+        for arg in lowered:
+            for prefix in rule['mutating']:
+                if arg.startswith(prefix):
+                    return (None, True)
+
+        for arg in lowered:
+            if arg in rule['readOnly']:
+                return (rule, False)
+
+        return (None, False)
+
+    def lookup(self, args):
+        """
+        Find a fresh cached result for a command. A mutating command
+        invalidates everything cached for its tool.
+
+        Returns
+        -------
+        A tuple (stdout, exitcode), or None if the command must be run
+        """
+        (rule, mutating) = self.classify(args)
+
+        if mutating:
+            self.invalidate(args[0])
+            return None
+
+        if rule is None:
+            return None
+
+        key = self.key(args)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = self.load(args, key)
+
+            if entry is None or entry['expires'] <= now:
+                return None
+
+            # Re-insert to mark as most recently used
+            self.entries[key] = entry
+
+        Log.debug(100, 'cached: %s' % ' '.join(args))
+        return (entry['stdout'], entry['exitcode'])
+
+    def store(self, args, stdout, exitcode):
+        """
+        Remember the output of a successful read-only command
+        """
+        if exitcode != 0 or stdout is None:
+            return
+
+        (rule, mutating) = self.classify(args)
+        if rule is None:
+            return
+
+        key = self.key(args)
+        entry = {'args':     list(args),
+                 'expires':  time.time() + rule['ttl'],
+                 'stdout':   stdout,
+                 'exitcode': exitcode}
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+        self.save(args, key, entry)
+
+    def invalidate(self, tool):
+        """
+        Drop every entry for a tool, in memory and on disk
+        """
+        name = os.path.basename(tool)
+
+        with self.lock:
+            for key in self.entries.keys():
+                if os.path.basename(self.entries[key]['args'][0]) == name:
+                    del self.entries[key]
+
+        if self.path is not None:
+            prefix = '%s-' % name
+            for filename in os.listdir(self.path):
+                if filename.startswith(prefix):
+                    try:
+                        os.unlink(os.path.join(self.path, filename))
+                    except (OSError):
+                        pass
+
+    def key(self, args):
+        """
+        Returns
+        -------
+        The cache key for an argument list
+        """
+        return '\0'.join([str(arg) for arg in args])
+
+    def filename(self, args, key):
+        """
+        Returns
+        -------
+        The backing store file for a cache key
+        """
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.path, '%s-%s.json' % (os.path.basename(args[0]), digest))
+
+    def load(self, args, key):
+        """
+        Read an entry from the backing store, if there is one
+        """
+        if self.path is None:
+            return None
+
+        try:
+            with open(self.filename(args, key)) as file:
+                entry = json.load(file)
+        except (IOError, ValueError):
+            return None
+
+        # json hands back unicode, callers expect the same str a pipe gives.
+        # Entries written before the encoding was stored hold UTF-8
+        encoding = entry.get('encoding', 'utf-8')
+        entry['args'] = [Fixture.decodeOutput(arg, encoding) for arg in entry.get('args', [])]
+        entry['stdout'] = Fixture.decodeOutput(entry['stdout'], encoding)
+
+        # Guard against hash collisions
+        if entry['args'] != [str(arg) for arg in args]:
+            return None
+
+        return entry
+
+    def save(self, args, key, entry):
+        """
+        Write an entry to the backing store, if there is one
+        """
+        if self.path is None:
+            return
+
+        filename = self.filename(args, key)
+        tmp = '%s.%d' % (filename, os.getpid())
+
+        # Stored the way fixtures store output, so any bytes survive
+        stored = dict(entry, args = [Fixture.encodeOutput(arg) for arg in entry['args']],
+                      stdout = Fixture.encodeOutput(entry['stdout']),
+                      encoding = OUTPUT_ENCODING)
+
+        try:
+            with open(tmp, 'w') as file:
+                json.dump(stored, file)
+            os.rename(tmp, filename)
+        except (IOError, OSError, ValueError) as e:
+            Log.error('Cannot write command cache entry %s: %s' % (filename, e))
+            # Don't leave a partly written entry behind
+            if os.path.exists(tmp):
+                os.unlink(tmp)
@@ -148,8 +148,38 @@ class CouchDB:
                  The unique ID of the document                                  
         params : dictionary                                                     
                  A dictionary of parameters that define the document            
+
+        Returns
+        -------
+        True if the document was written or already held params, False
+        if CouchDB refused the write
         """
-        results = self.getDocument(docId)
+        results = CouchDB.merge(self.getDocument(docId), params)
+
+        # Put document, if needed
+        if results is None:
+            return True
+
+        return not self.putDocument(docId, results).has_key(u'error')
+
+    @classmethod
+    def merge(cls, existing, params):
+        """
+        Merge params into a document
+
+        Params
+        ------
+        existing : dictionary
+                   The document as stored, or the error CouchDB returned
+                   if it does not exist
+        params   : dictionary
+                   The attributes to save
+
+        Returns
+        -------
+        The document to write, or None if params would not change it
+        """
+        results = existing
         needsPut = None
 
         # Document already exists, merge the param sets
@@ -170,9 +200,131 @@ class CouchDB:
             results = params
             results['createdAt'] = CouchDB.now()
 
-        # Put document, if needed
         if needsPut:
-            self.putDocument(docId, results)
+            return results
+        return None
+
+    def getDocuments(self, docIds):
+        """
+        GET many documents with a single POST to _all_docs
+
+        Params
+        ------
+        docIds : array
+                 The unique IDs of the documents
+
+        Returns
+        -------
+        A dictionary of docId => document, for the documents that exist
+        """
+        if not docIds:
+            return {}
+
+        path = '/%s/_all_docs?include_docs=true' % self.db
+        connection = httplib.HTTPConnection(self.host, self.port)
+        connection.connect()
+        connection.request('POST', path,
+                           json.dumps({'keys': docIds}),
+                           {
+                               'Content-Type': 'application/json'
+                           })
+
+        result = json.loads(connection.getresponse().read())
+
+        if result.has_key(u'error'):
+            Log.error('POST %s: %s' % (path, result))
+            return {}
+
+        docs = {}
+        for row in result.get(u'rows', []):
+            # Missing documents come back as rows with an error, deleted
+            # ones with a null doc
+            if row.get(u'doc', None) is not None:
+                docs[row[u'key']] = row[u'doc']
+
+        return docs
+
+    def saveDocuments(self, documents, existing = None):
+        """
+        Save many documents, like saveDocument(), with one request to
+        read them and one to write the ones that changed
+
+        Params
+        ------
+        documents : dictionary
+                    docId => dictionary of parameters for the document
+        existing  : dictionary
+                    docId => document as stored, for documents already
+                    read. The rest are read with getDocuments()
+
+        Returns
+        -------
+        The number of documents written, not counting the ones
+        _bulk_docs rejected
+        """
+        existing = dict(existing or {})
+        missing = [docId for docId in documents if not existing.has_key(docId)]
+        existing.update(self.getDocuments(missing))
+
+        docs = []
+        for (docId, params) in documents.items():
+            results = CouchDB.merge(dict(existing.get(docId, {})), dict(params))
+            if results is not None:
+                results['_id'] = docId
+                docs.append(results)
+
+        results = self.bulkSave(docs)
+        return len([row for row in results if not row.has_key(u'error')])
+
+    def bulkSave(self, docs, create = False):
+        """
+        Write many documents with a single POST to _bulk_docs. Documents
+        without a _rev are created, so this is meant for new documents
+        with unique ids, like log entries
+
+        Params
+        ------
+        docs   : array
+                 Documents, each a dictionary with an _id
+        create : bool
+                 Only create documents. The ones that already exist are
+                 left as they are, and their conflicts are not errors
+
+        Returns
+        -------
+        An array with a result for each document, in the same order
+        """
+        if not docs:
+            return []
+
+        now = CouchDB.now()
+        for doc in docs:
+            doc['updatedAt'] = now
+            if not doc.has_key('_rev'):
+                doc.setdefault('createdAt', now)
+
+        path = '/%s/_bulk_docs' % self.db
+        Log.debug(100, 'Posting %d documents to %s' % (len(docs), path))
+        connection = httplib.HTTPConnection(self.host, self.port)
+        connection.connect()
+        connection.request('POST', path,
+                           json.dumps({'docs': docs}),
+                           {
+                               'Content-Type': 'application/json'
+                           })
+
+        result = json.loads(connection.getresponse().read())
+
+        if isinstance(result, dict):
+            # The whole request failed
+            Log.error('POST %s: %s' % (path, result))
+            return [result for doc in docs]
+
+        for row in result:
+            if row.has_key(u'error') and not (create and row[u'error'] == u'conflict'):
+                Log.error('POST %s: %s' % (path, row))
+
+        return result
 
     def delete(self, params):
         """
@@ -243,6 +395,64 @@ class CouchDB:
 
         return results
 
+    def getViewKeys(self, design, view, keys):
+        """
+        Get the rows of a view for many keys with a single POST
+
+        Params
+        ------
+        design:  string
+                 The design document name
+        view:    string
+                 The view name
+        keys:    array
+                 The keys to select
+
+        Returns
+        -------
+        A dictionary of view key/value pairs, as getView() returns them,
+        for the keys that have rows
+        """
+        if not keys:
+            return {}
+
+        path = '/%s/_design/%s/_view/%s' % (self.db, design, view)
+        connection = httplib.HTTPConnection(self.host, self.port)
+        connection.connect()
+        connection.request('POST', path,
+                           json.dumps({'keys': keys}),
+                           {
+                               'Content-Type': 'application/json'
+                           })
+
+        output = json.loads(connection.getresponse().read())
+
+        if output.has_key(u'error'):
+            Log.error('POST %s: %s' % (path, output))
+            return {}
+
+        Log.debug(10, '%s returned %d rows for %d keys' %
+                  (path, len(output.get(u'rows', [])), len(keys)))
+
+        results = {}
+        for row in output.get(u'rows', []):
+            value = row[u'value']
+            key   = row[u'key']
+
+            if results.has_key(key):
+                storedValue = results[key]
+
+                # If the stored value is a dict, change to an array of dicts
+                if isinstance(storedValue, list):
+                    storedValue.append(value)
+                    value = storedValue
+                else:
+                    value = [storedValue, value]
+
+            results[key] = value
+
+        return results
+
     def getViewPath(self, design, view, params = None):
         """
         Internal function for building the path portion of 
@@ -414,13 +624,34 @@ class CouchDoc (object):
                 if params.has_key(attr):
                     setattr(self, attr, params[attr])
 
-    def persist(self, couch):
+    def document(self):
         """
-        Persist this object to CouchDB
+        Returns
+        -------
+        The attributes of this object that are persisted to CouchDB
         """
         params = {'type': self.type}
         for attr in self.persistentAttributes:
             if hasattr(self, attr):
                 params[attr] = getattr(self, attr)
 
-        couch.saveDocument(self.docId, params)
+        return params
+
+    def persist(self, couch):
+        """
+        Persist this object to CouchDB
+        """
+        couch.saveDocument(self.docId, self.document())
+
+    @classmethod
+    def persistNew(cls, couch, objects, create = False):
+        """
+        Create many new documents with one request, see CouchDB.bulkSave()
+        """
+        docs = []
+        for obj in objects:
+            doc = obj.document()
+            doc['_id'] = obj.docId
+            docs.append(doc)
+
+        return couch.bulkSave(docs, create)
@@ -0,0 +1,243 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import re, datetime, threading, time
+
+# Severity:INFO  Source:Blade_11  Serviceable Flag: U  EventID:0x10000002  Name:SN#YK13A082B0KY  Date:07/15/15  Time:22:04:08
+#
+# Name may be blank:
+# Severity:INFO Source:Audit Serviceable Flag: U EventID:0x0001608c Name: Date:02/19/15 Time:14:08:20
+attributeRegex = re.compile(r'^Severity:(\S+)\s+Source:(\S+)\s+Serviceable Flag:\s+(\S+)\s+EventID:(\S+)\s+'
+                            r'Name:(\S*)\s+Date:([0-9]+/[0-9]+/[0-9]+)\s+Time:([0-9]+:[0-9]+:[0-9]+)$')
+
+bladeSourceRegex = re.compile(r'Blade_([0-9]+)')
+
+class EventRecord(object):
+    """
+    One parsed AMM event log attribute line. Fields the line did not
+    have are None
+
+    Attributes
+    ----------
+    rawAttribute    : string
+                      The line, kept in case parsing failed
+    chassisDocId    : string
+    severity        : string
+                      INFO, WARN, ERR
+    source          : string
+                      Blade_11, Audit, ...
+    serviceableFlag : string
+    eventID         : string
+                      0x10000002
+    name            : string
+                      The blade name, SN# and its serial number
+    timestamp       : string
+                      ISO 8601, 2015-07-15T22:04:08
+    slotDocId       : string
+                      For events from a blade
+    bladeDocId      : string
+                      For events from a blade with a known serial number
+    """
+    __slots__ = ('rawAttribute', 'chassisDocId', 'severity', 'source', 'serviceableFlag',
+                 'eventID', 'name', 'timestamp', 'slotDocId', 'bladeDocId')
+
+    def __init__(self, rawAttribute, chassisDocId, severity = None, source = None,
+                 serviceableFlag = None, eventID = None, name = None, timestamp = None,
+                 slotDocId = None, bladeDocId = None):
+        self.rawAttribute = rawAttribute
+        self.chassisDocId = chassisDocId
+        self.severity = severity
+        self.source = source
+        self.serviceableFlag = serviceableFlag
+        self.eventID = eventID
+        self.name = name
+        self.timestamp = timestamp
+        self.slotDocId = slotDocId
+        self.bladeDocId = bladeDocId
+
+    def asDict(self):
+        """
+        Returns
+        -------
+        The fields that are set, as a dictionary of LogEntry params
+        """
+        dict = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value is not None:
+                dict[field] = value
+        return dict
+
+class EventLogParser:
+    """
+    Parses AMM event log attribute lines from one chassis. The date,
+    time and source of an entry repeat across a log, so their
+    conversions are memoized rather than done for every line
+
+    Example
+    -------
+    parser = EventLogParser(chassis.docId, EventLogParser.serialNumbers(couch))
+    for record in parser.parseMany(lines):
+        print record.timestamp, record.severity
+    """
+    # couch => (time fetched, serial number => blade docId)
+    _serialNumbers = {}
+    _serialNumbersLock = threading.Lock()
+
+    def __init__(self, chassisDocId, serialNumberToDocId = None):
+        """
+        Constructor
+
+        Params
+        ------
+        chassisDocId        : string
+                              The chassis the lines come from
+        serialNumberToDocId : dictionary
+                              Blade serial numbers mapped to blade docIds
+        """
+        self.chassisDocId = chassisDocId
+        self.serialNumberToDocId = serialNumberToDocId or {}
+        self.dates = {}
+        self.times = {}
+        self.slots = {}
+
+    @classmethod
+    def serialNumbers(cls, couch, maxAge = 600):
+        """
+        Returns
+        -------
+        The blade/serial_number_to_doc_id view, fetched at most once
+        every maxAge seconds for each CouchDB
+        """
+        with cls._serialNumbersLock:
+            cached = cls._serialNumbers.get(couch, None)
+            if cached is None or time.time() - cached[0] > maxAge:
+                cached = (time.time(), couch.getView('blade', 'serial_number_to_doc_id'))
+                cls._serialNumbers[couch] = cached
+            return cached[1]
+
+    def date(self, text):
+        """
+        Returns
+        -------
+        An AMM date, mm/dd/yy, as yyyy-mm-dd
+        """
+        date = self.dates.get(text, None)
+        if date is None:
+            (month, day, year) = [int(part) for part in text.split('/')]
+
+            # Years come from the AMM offset from 2000
+            if year < 1970:
+                year = year + 2000
+
+            date = datetime.date(year, month, day).isoformat()
+            self.dates[text] = date
+        return date
+
+    def time(self, text):
+        """
+        Returns
+        -------
+        An AMM time, hh:mm:ss, with two digits for each part
+        """
+        clock = self.times.get(text, None)
+        if clock is None:
+            (hour, minute, second) = [int(part) for part in text.split(':')]
+            clock = datetime.time(hour, minute, second).isoformat()
+            self.times[text] = clock
+        return clock
+
+    def slotDocId(self, source):
+        """
+        Returns
+        -------
+        The slotDocId for a source like Blade_11, None for other sources
+        """
+        try:
+            return self.slots[source]
+        except KeyError:
+            match = bladeSourceRegex.search(source)
+            slotDocId = None
+            if match:
+                slotDocId = '%s:slot-%02d' % (self.chassisDocId, int(match.group(1)))
+            self.slots[source] = slotDocId
+            return slotDocId
+
+    def parse(self, line):
+        """
+        Returns
+        -------
+        The EventRecord for one attribute line
+        """
+        return next(self.parseMany([line]))
+
+    def parseMany(self, lines):
+        """
+        Params
+        ------
+        lines : iterable
+                Attribute lines, a list or any stream of them
+
+        Returns
+        -------
+        A generator of EventRecords, one for each line
+        """
+        # Everything the loop touches is local, memoized values are
+        # looked up inline and only converted on a miss
+        match = attributeRegex.match
+        chassisDocId = self.chassisDocId
+        serialNumberToDocId = self.serialNumberToDocId
+        dates = self.dates
+        times = self.times
+        slots = self.slots
+
+        for line in lines:
+            matched = match(line)
+            if matched is None:
+                yield EventRecord(line, chassisDocId)
+                continue
+
+            (severity, source, serviceableFlag, eventID, name, date, clock) = matched.groups()
+
+            day = dates.get(date, None) or self.date(date)
+            second = times.get(clock, None) or self.time(clock)
+            if source in slots:
+                slotDocId = slots[source]
+            else:
+                slotDocId = self.slotDocId(source)
+
+            yield EventRecord(line, chassisDocId, severity, source, serviceableFlag, eventID, name,
+                              day + 'T' + second, slotDocId, serialNumberToDocId.get(name, None))
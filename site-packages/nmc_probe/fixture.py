@@ -0,0 +1,158 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import os, json, hashlib
+
+# Commands write bytes, JSON holds text. Latin-1 maps every byte to the
+# code point with the same value, so any output survives the round trip
+OUTPUT_ENCODING = 'latin-1'
+
+class Fixture:
+    """
+    A recorded run of an external command: its arguments, exit code,
+    standard output and standard error. Fixtures are stored one per
+    JSON file in a directory, named after the tool and a hash of the
+    arguments, so that a replay can find them from the argument list alone.
+
+    See nmc_probe.replay for recording, replaying and scaling fixtures.
+    """
+    def __init__(self, args, exitcode = 0, stdout = '', stderr = ''):
+        self.args = [str(arg) for arg in args]
+        self.exitcode = exitcode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @classmethod
+    def filename(cls, directory, args):
+        """
+        Returns
+        -------
+        The path of the fixture file for an argument list
+        """
+        digest = hashlib.sha1('\0'.join([str(arg) for arg in args])).hexdigest()
+        return os.path.join(directory, '%s-%s.json' % (os.path.basename(str(args[0])), digest))
+
+    @classmethod
+    def load(cls, directory, args):
+        """
+        Returns
+        -------
+        The fixture recorded for an argument list, None if there is none
+        """
+        try:
+            with open(Fixture.filename(directory, args)) as file:
+                params = json.load(file)
+        except (IOError, ValueError):
+            return None
+
+        return cls.fromDict(params)
+
+    @classmethod
+    def loadFile(cls, filename):
+        """
+        Returns
+        -------
+        The fixture stored in a file
+        """
+        with open(filename) as file:
+            return cls.fromDict(json.load(file))
+
+    @classmethod
+    def all(cls, directory):
+        """
+        Returns
+        -------
+        Every fixture in a directory
+        """
+        fixtures = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json'):
+                fixtures.append(cls.loadFile(os.path.join(directory, filename)))
+        return fixtures
+
+    @classmethod
+    def encodeOutput(cls, data):
+        """
+        Returns
+        -------
+        Command output, or an argument, as text that json can store
+        """
+        return data.decode(OUTPUT_ENCODING)
+
+    @classmethod
+    def decodeOutput(cls, text, encoding = OUTPUT_ENCODING):
+        """
+        Returns
+        -------
+        The str encodeOutput() was given. encoding is the one the text
+        was stored with
+        """
+        return text.encode(encoding)
+
+    @classmethod
+    def fromDict(cls, params):
+        # json hands back unicode, commands produce str. Fixtures
+        # recorded before the encoding was stored hold UTF-8
+        encoding = params.get('encoding', 'utf-8')
+        return cls([cls.decodeOutput(arg, encoding) for arg in params['args']],
+                   params['exitcode'],
+                   cls.decodeOutput(params['stdout'], encoding),
+                   cls.decodeOutput(params['stderr'], encoding))
+
+    def save(self, directory):
+        """
+        Write this fixture into a directory, replacing any earlier
+        recording of the same arguments
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filename = Fixture.filename(directory, self.args)
+        tmp = '%s.%d' % (filename, os.getpid())
+
+        try:
+            with open(tmp, 'w') as file:
+                json.dump({'args':     [Fixture.encodeOutput(arg) for arg in self.args],
+                           'exitcode': self.exitcode,
+                           'encoding': OUTPUT_ENCODING,
+                           'stdout':   Fixture.encodeOutput(self.stdout),
+                           'stderr':   Fixture.encodeOutput(self.stderr)}, file, indent=1)
+            os.rename(tmp, filename)
+        except:
+            # Don't leave a partly written fixture behind
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
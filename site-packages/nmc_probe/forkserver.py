@@ -0,0 +1,336 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+#
+# A small helper process that starts commands on behalf of a large one.
+#
+# fork() copies the caller's page tables, so starting zfs from a process
+# holding Flask, SQLAlchemy and rtslib costs more the bigger it grows.
+# The helper is a fresh interpreter that imports next to nothing, so
+# commands it starts cost the same no matter how big the caller is.
+#
+# Protocol, one Unix socket connection per command:
+#   client -> server  {"args": [...], "group": bool, "stdout": fifo, "stderr": fifo}
+#   server -> client  {"pid": N}  or  {"errno": N, "message": "..."}
+#   server -> client  {"exitcode": N}  once the command has finished
+#
+# Output flows through the two named pipes, which the client creates
+# and opens for reading before sending the request.
+
+import os, sys, json, socket, errno, signal, threading, tempfile, atexit, fcntl, select
+from subprocess import PIPE, Popen
+
+class ForkServerError(Exception):
+    pass
+
+class ForkServerProcess:
+    """
+    A command started by the fork server. Has the parts of the Popen
+    interface nmc_probe.command uses: pid, stdout, stderr, returncode,
+    poll(), wait() and kill()
+    """
+    def __init__(self, conn, pid, stdoutFd, stderrFd):
+        self.conn = conn
+        self.pid = pid
+        self.stdout = os.fdopen(stdoutFd, 'rb', 0)
+        self.stderr = os.fdopen(stderrFd, 'rb', 0)
+        self.returncode = None
+
+    def wait(self):
+        """
+        Wait for the command to exit
+
+        Returns
+        -------
+        The exit code, negative if a signal killed the command
+        """
+        if self.returncode is None:
+            reply = self.conn.readReply()
+            self.conn.close()
+            if reply is None:
+                raise ForkServerError('Fork server went away while running pid %d' % self.pid)
+            self.returncode = reply['exitcode']
+        return self.returncode
+
+    def poll(self):
+        """
+        Returns
+        -------
+        The exit code if the command has exited, otherwise None
+        """
+        if self.returncode is None:
+            (readable, writable, errors) = select.select([self.conn.sock], [], [], 0)
+            if readable:
+                self.wait()
+        return self.returncode
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except (OSError) as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+class Connection:
+    """
+    One JSON message per line over a socket
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile('rb')
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message) + '\n')
+
+    def readReply(self):
+        """
+        Returns
+        -------
+        The next message, None if the other end closed the connection
+        """
+        while True:
+            try:
+                line = self.file.readline()
+                break
+            except (socket.error, IOError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+class ForkServer:
+    """
+    Client side of the fork server: starts the helper process and asks
+    it to run commands
+
+    Example
+    -------
+    Once enabled, every command nmc_probe.command runs is started here
+
+    Command.enableForkServer()
+    result = Command.execute(['/sbin/zfs', 'list'])
+    for line in StreamingCommand(['/usr/local/bin/sas2ircu', 'list']):
+        print line
+    """
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='nmc_probe_forkserver.')
+        self.path = os.path.join(self.dir, 'socket')
+        self.owner = os.getpid()
+        self.count = 0
+        self.lock = threading.Lock()
+
+        # The helper exits when this pipe closes, which happens when
+        # this process exits, however it exits
+        script = os.path.abspath(__file__)
+        if script.endswith('.pyc'):
+            script = script[:-1]
+        self.proc = Popen([sys.executable, script, self.path],
+                          stdin=PIPE, stdout=PIPE, close_fds=True)
+
+        if self.proc.stdout.readline().strip() != 'ready':
+            raise ForkServerError('Fork server failed to start')
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns
+        -------
+        The process wide fork server, started on first use
+        """
+        with cls._sharedLock:
+            if cls._shared is None:
+                cls._shared = cls()
+                atexit.register(cls._shared.shutdown)
+        return cls._shared
+
+    def spawn(self, args, group = False):
+        """
+        Start a command
+
+        Params
+        ------
+        args  : array
+                The command and its arguments
+        group : bool
+                Start the command in its own process group
+
+        Returns
+        -------
+        A ForkServerProcess. Raises OSError if the command could not start
+        """
+        with self.lock:
+            self.count = self.count + 1
+            name = '%d.%d' % (os.getpid(), self.count)
+
+        stdoutPath = os.path.join(self.dir, name + '.out')
+        stderrPath = os.path.join(self.dir, name + '.err')
+        os.mkfifo(stdoutPath, 0600)
+        os.mkfifo(stderrPath, 0600)
+
+        # Open the read ends first, so the server's opens of the write
+        # ends do not block, then switch them to blocking reads
+        stdoutFd = os.open(stdoutPath, os.O_RDONLY | os.O_NONBLOCK)
+        stderrFd = os.open(stderrPath, os.O_RDONLY | os.O_NONBLOCK)
+        conn = None
+        reply = None
+
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            conn = Connection(sock)
+            conn.send({'args': [str(arg) for arg in args],
+                       'group': group,
+                       'stdout': stdoutPath,
+                       'stderr': stderrPath})
+            reply = conn.readReply()
+        finally:
+            os.unlink(stdoutPath)
+            os.unlink(stderrPath)
+
+            if reply is None or 'pid' not in reply:
+                if conn is not None:
+                    conn.close()
+                os.close(stdoutFd)
+                os.close(stderrFd)
+
+        if reply is None:
+            raise ForkServerError('Fork server went away')
+        if 'pid' not in reply:
+            raise OSError(reply['errno'], reply['message'])
+
+        for fd in (stdoutFd, stderrFd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+        return ForkServerProcess(conn, reply['pid'], stdoutFd, stderrFd)
+
+    def shutdown(self):
+        """
+        Stop the helper process. Only the process that started it may,
+        processes forked from it afterwards share the helper
+        """
+        if os.getpid() != self.owner or self.proc is None:
+            return
+
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
+
+        try:
+            os.unlink(self.path)
+            os.rmdir(self.dir)
+        except (OSError):
+            pass
+
+def serveCommand(sock):
+    """
+    Server side: run one command for a client connection
+    """
+    conn = Connection(sock)
+    try:
+        request = conn.readReply()
+        if request is None:
+            return
+
+        preexec = None
+        if request['group']:
+            preexec = os.setpgrp
+
+        try:
+            stdout = os.open(request['stdout'], os.O_WRONLY)
+            stderr = os.open(request['stderr'], os.O_WRONLY)
+            try:
+                proc = Popen(request['args'], stdout=stdout, stderr=stderr,
+                             close_fds=True, preexec_fn=preexec)
+            finally:
+                os.close(stdout)
+                os.close(stderr)
+        except (OSError) as e:
+            conn.send({'errno': e.errno, 'message': e.strerror})
+            return
+
+        conn.send({'pid': proc.pid})
+        conn.send({'exitcode': proc.wait()})
+    except (socket.error, IOError):
+        # The client went away
+        pass
+    finally:
+        conn.close()
+
+def serve(path):
+    """
+    Server side: accept connections until standard input closes
+    """
+    # Keep terminal signals meant for the client away from the helper
+    os.setpgrp()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+
+    def watchParent():
+        sys.stdin.read()
+        os._exit(0)
+
+    watcher = threading.Thread(target=watchParent)
+    watcher.daemon = True
+    watcher.start()
+
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+
+    while True:
+        try:
+            (sock, address) = listener.accept()
+        except (socket.error) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        worker = threading.Thread(target=serveCommand, args=(sock,))
+        worker.daemon = True
+        worker.start()
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
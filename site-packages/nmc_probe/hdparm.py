@@ -34,17 +34,40 @@
 #
 # }}}
 
-from nmc_probe.command import AsyncCommand, Command
+from nmc_probe.command import Command, CommandPool
+from nmc_probe.output_parser import OutputParser
 from nmc_probe.log import Log
 import os
 
 hdparm_cmd='/usr/sbin/hdparm'
 
 class HDParm:
+    # Attributes parsed from hdparm -I output
+    info_parser = OutputParser([
+        ('serial_number',                   '^\s*Serial Number:\s*(.*)\s*$',         'strip'),
+        ('firmware',                        '^\s*Firmware Revision:\s*(.*)\s*$',     'strip'),
+        ('transport',                       '^\s*Transport:\s*(.*)\s*$',             'strip'),
+        ('naa',                             '^\s*NAA:\s*(.*)\s*$',                   'strip'),
+        ('ieee_oui',                        '^\s*IEEE OUI:\s*(.*)\s*$',              'strip'),
+        ('unique_id',                       '^\s*Unique ID:\s*(.*)\s*$',             'strip'),
+        ('wwn',                             '^\s*Logical Unit WWN Device Identifier:\s*(.*)\s*$', 'strip'),
+        ('model_number',                    '^\s*Model Number:\s+(.*)\s*$',          'strip'),
+        ('chs_current_addressable_sectors', '^\s*CHS current addressable sectors\s*:\s*(\d+)', 'int'),
+        ('lba_user_addressable_sectors',    '^\s*LBA\s+user\s+addressable\s+sectors\s*:\s*(\d+)', 'strip'),
+        ('lba48_user_addressable_sectors',  '^\s*LBA48  user addressable sectors:\s*(\d+)', 'int'),
+        ('sector_size_bytes',               '^\s*Logical/Physical Sector size:\s*(\d+)', 'int'),
+        ('size_mb',                         '^\s*device size with M = 1024\*1024:\s*(\d+)', 'int'),
+    ])
+
+    # Attributes parsed from hdparm -t output
+    speed_parser = OutputParser([
+        ('speed', '^\s*Timing.*=\s*([0-9\.]+)', 'float'),
+    ])
+
     def __init__(self, dev):
         self.dev = dev
         # If hdparm is not present, throw an exception
-        os.stat(hdparm_cmd)
+        Command.requireTool(hdparm_cmd)
 
     @property
     def info(self):
@@ -54,38 +77,28 @@ class HDParm:
         return self._info
 
     def get_info(self):
-        hdparm_attrs = {
-            '^\s*Serial Number:\s*(.*)\s*$': 'serial_number',
-            '^\s*Firmware Revision:\s*(.*)\s*$': 'firmware',
-            '^\s*Transport:\s*(.*)\s*$':     'transport',
-            '^\s*NAA:\s*(.*)\s*$':           'naa',
-            '^\s*IEEE OUI:\s*(.*)\s*$':      'ieee_oui',
-            '^\s*Unique ID:\s*(.*)\s*$':     'unique_id',
-            '^\s*Logical Unit WWN Device Identifier:\s*(.*)\s*$': 'wwn',
-            '^\s*Model Number:\s+(.*)\s*$':  'model_number',
-            '^\s*CHS current addressable sectors\s*:\s*(\d+)': 'chs_current_addressable_sectors',
-            '^\s*LBA\s+user\s+addressable\s+sectors\s*:\s*(\d+)': 'lba_user_addressable_sectors',
-            '^\s*LBA48  user addressable sectors:\s*(\d+)': 'lba48_user_addressable_sectors',
-            '^\s*Logical/Physical Sector size:\s*(\d+)': 'sector_size_bytes',
-            '^\s*device size with M = 1024\*1024:\s*(\d+)': 'size_mb',
-}
-
         cmd = [hdparm_cmd, '-I', self.dev]
+        return HDParm.info_parser.run(cmd)
 
-        attrs = Command.run_and_extract_attrs(cmd, hdparm_attrs)
+    @classmethod
+    def get_info_batch(cls, devs, pool = None):
+        '''Run hdparm -I against many disks at once
 
-        for (key, value) in attrs.iteritems():
-            attrs[key] = value.strip()
+        devs -- array of device paths
+        pool -- CommandPool to run hdparm in, defaults to the shared pool
 
-        # Convert integer values to integers
-        int_attrs = ['size_mb', 'sector_size_bytes', 'lba48_user_addressable_sectors', 'chs_current_addressable_sectors']
+        Returns a dictionary of device path => dictionary of disk information
+        '''
+        if pool is None:
+            pool = CommandPool.shared()
 
-        for attr in int_attrs:
-            value = attrs.get(attr, None)
-            if value is not None:
-                attrs[attr] = int(value)
+        futures = [(dev, pool.submit([hdparm_cmd, '-I', dev])) for dev in devs]
 
-        return attrs
+        info = {}
+        for (dev, future) in futures:
+            info[dev] = HDParm.info_parser.parse(future.result().lines)
+
+        return info
 
     def speed_test(self, offset=None):
         cmd = [hdparm_cmd, '-t', '--direct']
@@ -95,20 +108,8 @@ class HDParm:
             cmd.append('%d' % offset)
 
         cmd.append(self.dev)
-        
-        patterns = {
-            '^\s*Timing.*=\s*([0-9\.]+)': 'speed'
-        }
-
-        attrs = Command.run_and_extract_attrs(cmd, patterns)
-
-        float_attrs = ['speed']
-
-        for attr in float_attrs:
-            value = attrs.get(attr, None)
-            if value is not None:
-                attrs[attr] = float(value)
 
+        attrs = HDParm.speed_parser.run(cmd)
         return attrs['speed']
 
 
@@ -34,7 +34,7 @@
 #
 # }}}
 
-from nmc_probe.command import AsyncCommand, Command
+from nmc_probe.command import StreamingCommand, Command
 from nmc_probe.log import Log
 from nmc_probe.hdparm import HDParm
 from nmc_probe.disk_controller import DiskController
@@ -49,8 +49,7 @@ class LSI:
     def __init__(cls):
         # Make sure that the sas2ircu command exists. If it doesn't exist,
         # an exeception will be thrown.
-        if os.stat(sas2ircu_cmd):
-            pass
+        Command.requireTool(sas2ircu_cmd)
 
     '''Interface to LSI sas2ircu command'''
     @property
@@ -86,23 +85,19 @@ class LSI:
     def list_controllers(self):
         '''Get the list of controllers'''
         controllers = []
-        cmd = AsyncCommand([sas2ircu_cmd, 'list'])
-
-        while not cmd.eof:
-            while not cmd.queue.empty():
-                line = cmd.queue.get()
-                if re.match('^\s+[0-9]+\s+\w+.*', line):
-                    parts = line.split()
-                    controllers.append(DiskController({
-                        'index':         parts[0],
-                        'type':          parts[1],
-                        'vendor_id':     parts[2],
-                        'device_id':     parts[3],
-                        'pci_address':   self.extract_pci_address(parts[4]),
-                        'subsys_ven_id': parts[5],
-                        'subsys_dev_id': parts[6],
-                        'api':           self
-                    }))
+        for line in StreamingCommand([sas2ircu_cmd, 'list']):
+            if re.match('^\s+[0-9]+\s+\w+.*', line):
+                parts = line.split()
+                controllers.append(DiskController({
+                    'index':         parts[0],
+                    'type':          parts[1],
+                    'vendor_id':     parts[2],
+                    'device_id':     parts[3],
+                    'pci_address':   self.extract_pci_address(parts[4]),
+                    'subsys_ven_id': parts[5],
+                    'subsys_dev_id': parts[6],
+                    'api':           self
+                }))
 
         return controllers
 
@@ -150,41 +145,36 @@ class LSI:
         parse_hdd = None
         parse_enclosure = None
 
-        command = AsyncCommand([sas2ircu_cmd, controller.index, 'display'])
-
-        while not command.eof:
-            while not command.queue.empty():
-                line = command.queue.get()
-
-                if re.match('^Device is a Hard disk', line):
-                    parse_hdd = True
-                    hdd_attrs = {}
-                elif re.match('Device is a Enclosure services device', line):
-                    parse_enclosure = True
-                    enclosure_attrs = {}
-                else:
-                        
-                    if parse_hdd:
-                        for (match_attr, attr) in hdd_parse_attrs.iteritems():
-                            pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
-                            match = re.match(pattern, line)
-                                
-                            if match is not None:
-                                hdd_attrs[attr] = match.group(1)
-
-                                if attr == 'sas_address':
-                                    hdd_attrs[attr] = self.extract_sas_address(hdd_attrs[attr])
-
-                                if attr == 'serial_number':
-                                    hdd_attrs[attr] = self.fix_serial_number(hdd_attrs[attr])
-
-                                if match_attr == hdd_last_attr:
-                                    parse_hdd = None
-                                    key = '%s:%s:%s' % (controller.index, hdd_attrs['enclosure'], hdd_attrs['bay'])
+        for line in StreamingCommand([sas2ircu_cmd, controller.index, 'display']):
+            if re.match('^Device is a Hard disk', line):
+                parse_hdd = True
+                hdd_attrs = {}
+            elif re.match('Device is a Enclosure services device', line):
+                parse_enclosure = True
+                enclosure_attrs = {}
+            else:
+                    
+                if parse_hdd:
+                    for (match_attr, attr) in hdd_parse_attrs.iteritems():
+                        pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
+                        match = re.match(pattern, line)
+                            
+                        if match is not None:
+                            hdd_attrs[attr] = match.group(1)
+
+                            if attr == 'sas_address':
+                                hdd_attrs[attr] = self.extract_sas_address(hdd_attrs[attr])
+
+                            if attr == 'serial_number':
+                                hdd_attrs[attr] = self.fix_serial_number(hdd_attrs[attr])
+
+                            if match_attr == hdd_last_attr:
+                                parse_hdd = None
+                                key = '%s:%s:%s' % (controller.index, hdd_attrs['enclosure'], hdd_attrs['bay'])
 
 #                                        attrs['dev_by_path'] = self.disk_by_path(controller, attrs)
 #                                        attrs['dev'] = os.path.realpath(attrs['dev_by_path'])
-                                        
+                                    
 #                                        hdparm = HDParm(attrs['dev'])
 #                                        attrs.update(hdparm.info)
 
@@ -192,22 +182,22 @@ class LSI:
 #                                            attrs['dev_by_id_wwn'] = self.disk_by_id_wwn(attrs)
 
 #                                        attrs['dev_by_id_protocol'] = self.disk_by_id_protocol(attrs)
-                                 
-                                    hdd_attrs['controller'] = controller
-                                    disks[key] = Disk(hdd_attrs)
-                    elif parse_enclosure:
-                        for (match_attr, attr) in enclosure_parse_attrs.iteritems():
-                            pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
-                            match = re.match(pattern, line)
-                            if match is not None:
-                                enclosure_attrs[attr] = match.group(1)
-                                if match_attr == enclosure_last_attr:
-                                    parse_enclosure = None    
-                                    key = enclosure_attrs['index']
-                                    enclosure_attrs['controller'] = controller
-                                    enc = DiskEnclosure(enclosure_attrs)
-                                    enclosures[key] = enc
-                
+                             
+                                hdd_attrs['controller'] = controller
+                                disks[key] = Disk(hdd_attrs)
+                elif parse_enclosure:
+                    for (match_attr, attr) in enclosure_parse_attrs.iteritems():
+                        pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
+                        match = re.match(pattern, line)
+                        if match is not None:
+                            enclosure_attrs[attr] = match.group(1)
+                            if match_attr == enclosure_last_attr:
+                                parse_enclosure = None    
+                                key = enclosure_attrs['index']
+                                enclosure_attrs['controller'] = controller
+                                enc = DiskEnclosure(enclosure_attrs)
+                                enclosures[key] = enc
+            
         # Set enclosure <-->> disk to many relationship
         for k, v in disks.iteritems():
             num = '%s' % v.enclosure
@@ -262,41 +252,36 @@ class LSI:
         parse_enclosure = None
 
         for index,controller in self.controllers:
-            sas2ircu = AsyncCommand([sas2ircu_cmd, controller.index, 'display'])
-
-            while not sas2ircu.eof:
-                while not sas2ircu.queue.empty():
-                    line = sas2ircu.queue.get()
-
-                    if re.match('^Device is a Hard disk', line):
-                        parse_hdd = True
-                        hdd_attrs = {}
-                    elif re.match('Device is a Enclosure services device', line):
-                        parse_enclosure = True
-                        enclosure_attrs = {}
-                    else:
-                        
-                        if parse_hdd:
-                            for (match_attr, attr) in hdd_parse_attrs.iteritems():
-                                pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
-                                match = re.match(pattern, line)
-                                
-                                if match is not None:
-                                    hdd_attrs[attr] = match.group(1)
-
-                                    if attr == 'sas_address':
-                                        hdd_attrs[attr] = self.extract_sas_address(hdd_attrs[attr])
-
-                                    if attr == 'serial_number':
-                                        hdd_attrs[attr] = self.fix_serial_number(hdd_attrs[attr])
-
-                                    if match_attr == hdd_last_attr:
-                                        parse_hdd = None
-                                        key = '%s:%s:%s' % (controller.index, hdd_attrs['enclosure'], hdd_attrs['bay'])
+            for line in StreamingCommand([sas2ircu_cmd, controller.index, 'display']):
+                if re.match('^Device is a Hard disk', line):
+                    parse_hdd = True
+                    hdd_attrs = {}
+                elif re.match('Device is a Enclosure services device', line):
+                    parse_enclosure = True
+                    enclosure_attrs = {}
+                else:
+                    
+                    if parse_hdd:
+                        for (match_attr, attr) in hdd_parse_attrs.iteritems():
+                            pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
+                            match = re.match(pattern, line)
+                            
+                            if match is not None:
+                                hdd_attrs[attr] = match.group(1)
+
+                                if attr == 'sas_address':
+                                    hdd_attrs[attr] = self.extract_sas_address(hdd_attrs[attr])
+
+                                if attr == 'serial_number':
+                                    hdd_attrs[attr] = self.fix_serial_number(hdd_attrs[attr])
+
+                                if match_attr == hdd_last_attr:
+                                    parse_hdd = None
+                                    key = '%s:%s:%s' % (controller.index, hdd_attrs['enclosure'], hdd_attrs['bay'])
 
 #                                        attrs['dev_by_path'] = self.disk_by_path(controller, attrs)
 #                                        attrs['dev'] = os.path.realpath(attrs['dev_by_path'])
-                                        
+                                    
 #                                        hdparm = HDParm(attrs['dev'])
 #                                        attrs.update(hdparm.info)
 
@@ -304,28 +289,25 @@ class LSI:
 #                                            attrs['dev_by_id_wwn'] = self.disk_by_id_wwn(attrs)
 
 #                                        attrs['dev_by_id_protocol'] = self.disk_by_id_protocol(attrs)
-                                 
-                                        hdd_attrs['controller'] = controller
-                                        hdd_attrs['api'] = self
-                                        disks[key] = hdd_attrs
-                        elif parse_enclosure:
-                            print 'parse_enclosure'
-                            for (match_attr, attr) in enclosure_parse_attrs.iteritems():
-                                pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
-                                match = re.match(pattern, line)
-                                print attr
-                                if match is not None:
-                                    enclosure_attrs[attr] = match.group(1)
-                                    print 'match'
-                                    if match_attr == enclosure_last_attr:
-                                        parse_enclosure = None    
-                                        key = enclosure_attrs['index']
-                                        enclosure_attrs['controller'] = controller
-                                        enclosure_attrs['api'] = self
-                                        enc = DiskEnclosure(enclosure_attrs)
-                                        enclosures[key] = enc
-                                        print 'add_enclosure to controller %s' % controller.index
-                                        controller.add_enclosure(enc)
+                             
+                                    hdd_attrs['controller'] = controller
+                                    hdd_attrs['api'] = self
+                                    disks[key] = hdd_attrs
+                    elif parse_enclosure:
+                        for (match_attr, attr) in enclosure_parse_attrs.iteritems():
+                            pattern = '^\s+%s\s+:\s+(.*)\s*$' % match_attr
+                            match = re.match(pattern, line)
+                            if match is not None:
+                                enclosure_attrs[attr] = match.group(1)
+                                if match_attr == enclosure_last_attr:
+                                    parse_enclosure = None    
+                                    key = enclosure_attrs['index']
+                                    enclosure_attrs['controller'] = controller
+                                    enclosure_attrs['api'] = self
+                                    enc = DiskEnclosure(enclosure_attrs)
+                                    enclosures[key] = enc
+                                    Log.debug(10, 'Adding enclosure %s to controller %s' % (key, controller.index))
+                                    controller.add_enclosure(enc)
 
 
          
@@ -346,7 +328,7 @@ class LSI:
         wwn = attrs.get('wwn', None)
 
         if wwn is None:
-            print attrs
+            Log.debug(10, 'Disk attributes: %s' % attrs)
             raise Exception('No wwn attribute, cannot find /dev/disk/by-id/wwn-')
 
         dev = '/dev/disk/by-id/wwn-0x%s' % wwn
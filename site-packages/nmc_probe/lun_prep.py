@@ -36,6 +36,7 @@
 
 import sys, os, subprocess, time
 from nmc_probe.log import Log
+from nmc_probe.command import Command
 
 # Command locations
 mount_cmd             = '/usr/bin/mount'
@@ -245,15 +246,17 @@ class LUNPrep:
         self.run([udevadm_cmd, 'trigger', 'block'])
         self.run([udevadm_cmd, 'settle'])
 
-    def run(self, args):
-        '''Run a command, capture stderr and report the exception, if an exception happens'''
+    def run(self, args, timeout = None):
+        '''Run a command, capture stderr and report the exception, if an exception happens.
+        The command is killed if it runs for longer than timeout seconds'''
         Log.info('%s' % ' '.join(args))
 
-        pipes = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = pipes.communicate()
+        result = Command.execute(args, timeout)
 
-        if pipes.returncode != 0:
+        if result.exitcode != 0:
             # an error happened!
-            err_msg = "%s. Code: %s" % (stderr.strip(), pipes.returncode)
+            err_msg = "%s. Code: %s" % ((result.stderr or '').strip(), result.exitcode)
+            if result.timedOut:
+                err_msg = "%s. Timed out after %s seconds" % (err_msg, timeout)
             raise Exception(err_msg)
     
@@ -38,6 +38,7 @@ from nmc_probe.lun_clone_job import LUNCloneJob
 from nmc_probe.target_manager import TargetManager
 from nmc_probe.zfs import ZFS
 from nmc_probe.log import Log
+from nmc_probe.stats import CommandStats
 
 import traceback
 
@@ -57,14 +58,16 @@ class LUNQueue:
         created = None
         # Create the iSCSI target
         args['device'] = '/dev/zvol/%s' % args['dst']
-        created = mgr.create_iscsi_target(args)
+        with CommandStats.timer('rtslib create_iscsi_target'):
+            created = mgr.create_iscsi_target(args)
 
         if created is not None:
             return True
         return None
 
     def remove_target(self, mgr, args):
-        mgr.delete_target_and_block_store(args)
+        with CommandStats.timer('rtslib delete_target_and_block_store'):
+            mgr.delete_target_and_block_store(args)
 
     def remove_clone(self, task, zfs, args):
         # If deleteClones = true, then the dst parameter is also required.
@@ -84,7 +87,8 @@ class LUNQueue:
     def create_clones(self, task):
         # Set up ZFS and Target management
         zfs = ZFS()
-        mgr = TargetManager()
+        with CommandStats.timer('rtslib load'):
+            mgr = TargetManager()
         num_created = 0
 
         task.set_status_start_creating_clones()
@@ -108,12 +112,14 @@ class LUNQueue:
             task.increment_num_completed()
 
         task.set_status_done_creating_targets()
-        mgr.save()
+        with CommandStats.timer('rtslib save'):
+            mgr.save()
 
     def delete_clones(self, task):
         # Set up ZFS and Target management
         zfs = ZFS()
-        mgr = TargetManager()
+        with CommandStats.timer('rtslib load'):
+            mgr = TargetManager()
 
         task.set_status_start_deleting_targets()
 
@@ -131,7 +137,8 @@ class LUNQueue:
             task.increment_num_completed()
 
         task.set_status_done_deleting_clones()
-        mgr.save()
+        with CommandStats.timer('rtslib save'):
+            mgr.save()
 
     def process(self):
         try:
@@ -0,0 +1,428 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+#
+# Compile MIBs into a Python symbol table, so nmc_probe.snmp translates
+# names like BLADE-MIB::bladeMACAddress1Vpd with dictionary lookups
+# instead of loading MIBs in snmptranslate.
+#
+# Compile the MIBs listed in the [snmp] section of the config file:
+#   mib_compiler.py
+#
+# Compile a MIB file, and the MIBs it imports from the search path:
+#   mib_compiler.py -M /usr/share/snmp/mibs -o /tmp/mib_symbols.py mibs/BLADE-MIB.txt
+
+import os, sys, re, getopt
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nmc_probe.bladeutilsconfig import BladeUtilsConfig
+
+# Where the compiled table is written, and where nmc_probe.snmp loads it from
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mib_symbols.py')
+
+DEFAULT_MIB_DIRS = ['/usr/share/snmp/mibs', '/usr/local/share/snmp/mibs']
+
+MIB_SUFFIXES = ['', '.txt', '.mib', '.my']
+
+# Nodes defined by the SMI itself, that every MIB builds on
+SMI_ROOTS = {
+    'ccitt':           (0,),
+    'iso':             (1,),
+    'joint-iso-ccitt': (2,),
+    'org':             (1, 3),
+    'dod':             (1, 3, 6),
+    'internet':        (1, 3, 6, 1),
+    'directory':       (1, 3, 6, 1, 1),
+    'mgmt':            (1, 3, 6, 1, 2),
+    'mib-2':           (1, 3, 6, 1, 2, 1),
+    'transmission':    (1, 3, 6, 1, 2, 1, 10),
+    'experimental':    (1, 3, 6, 1, 3),
+    'private':         (1, 3, 6, 1, 4),
+    'enterprises':     (1, 3, 6, 1, 4, 1),
+    'security':        (1, 3, 6, 1, 5),
+    'snmpV2':          (1, 3, 6, 1, 6),
+    'snmpDomains':     (1, 3, 6, 1, 6, 1),
+    'snmpProxys':      (1, 3, 6, 1, 6, 2),
+    'snmpModules':     (1, 3, 6, 1, 6, 3),
+}
+
+# Macros whose value is an OID, name MACRO ... ::= { parent subid }
+OID_MACROS = ['OBJECT-TYPE', 'MODULE-IDENTITY', 'OBJECT-IDENTITY',
+              'NOTIFICATION-TYPE', 'OBJECT-GROUP', 'NOTIFICATION-GROUP',
+              'MODULE-COMPLIANCE', 'AGENT-CAPABILITIES']
+
+moduleRegex     = re.compile('([A-Za-z][\w-]*)\s+DEFINITIONS\s*::=\s*BEGIN')
+importsRegex    = re.compile('\\bIMPORTS\\b(.*?);', re.S)
+importFromRegex = re.compile('FROM\s+([A-Za-z][\w-]*)')
+# Clause bodies never contain ::=, which starts the next definition
+identifierRegex = re.compile('\\b([a-z][\w-]*)\s+OBJECT\s+IDENTIFIER\s*::=\s*\{([^}]*)\}')
+assignRegex     = re.compile('\\b([a-z][\w-]*)\s+(%s)\\b((?:(?!::=).)*)::=\s*\{([^}]*)\}' %
+                             '|'.join(OID_MACROS), re.S)
+typeRegex       = re.compile('\\b([A-Z][\w-]*)\s*::=\s*(?:TEXTUAL-CONVENTION\\b(?:(?!::=).)*?SYNTAX\s+)?'
+                             'INTEGER\s*\{([^}]*)\}', re.S)
+syntaxRegex     = re.compile('\\bSYNTAX\s+([A-Za-z][\w-]*)\s*(\{([^}]*)\})?')
+enumRegex       = re.compile('([A-Za-z][\w-]*)\s*\(\s*(-?\d+)\s*\)')
+subidRegex      = re.compile('^(?:[A-Za-z][\w-]*\s*\(\s*)?(\d+)\s*\)?$')
+
+class MIBModule:
+    """
+    The definitions in one MIB module
+
+    Attributes
+    ----------
+    name        : string
+                  The module name, e.g. BLADE-MIB
+    imports     : array
+                  Names of the modules it imports from
+    assignments : array
+                  (name, parent name, sub-identifiers) for each OID it defines
+    enums       : dictionary
+                  name => {integer: label} for its enumerated INTEGER objects
+    types       : dictionary
+                  type name => {integer: label} for the enumerated types,
+                  like textual conventions, it defines
+    syntaxes    : dictionary
+                  name => type name for objects whose SYNTAX is a named type
+    """
+    def __init__(self, name):
+        self.name = name
+        self.imports = []
+        self.assignments = []
+        self.enums = {}
+        self.types = {}
+        self.syntaxes = {}
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Returns
+        -------
+        The MIBModule defined in the text of a MIB file, None if the
+        text is not a MIB
+        """
+        text = stripComments(text)
+
+        match = moduleRegex.search(text)
+        if not match:
+            return None
+
+        module = cls(match.group(1))
+
+        match = importsRegex.search(text)
+        if match:
+            module.imports = importFromRegex.findall(match.group(1))
+
+        # Enumerated types: Name ::= INTEGER { a(1) } and textual conventions
+        for (name, values) in typeRegex.findall(text):
+            module.types[name] = parseEnums(values)
+
+        for (name, value) in identifierRegex.findall(text):
+            module.assign(name, value)
+
+        for (name, macro, body, value) in assignRegex.findall(text):
+            module.assign(name, value)
+
+            syntax = syntaxRegex.search(body)
+            if syntax:
+                if syntax.group(1) == 'INTEGER' and syntax.group(3):
+                    module.enums[name] = parseEnums(syntax.group(3))
+                elif syntax.group(1)[0].isupper():
+                    module.syntaxes[name] = syntax.group(1)
+
+        return module
+
+    def assign(self, name, value):
+        """
+        Add an assignment from the value of ::= { parent 1 2 }, which
+        may also name the sub-identifiers, { parent child(1) 2 }
+        """
+        parts = value.split()
+        if not parts:
+            return
+
+        subids = []
+        for part in parts[1:]:
+            subid = subidRegex.match(part)
+            if subid is None:
+                return
+            subids.append(int(subid.group(1)))
+
+        self.assignments.append((name, parts[0].split('(')[0], tuple(subids)))
+
+def stripComments(text):
+    """
+    Returns
+    -------
+    MIB text without comments and with the contents of quoted strings
+    removed, so DESCRIPTION clauses can't confuse the parser
+    """
+    out = []
+    i = 0
+    length = len(text)
+
+    while i < length:
+        char = text[i]
+        if char == '"':
+            end = text.find('"', i + 1)
+            if end < 0:
+                break
+            out.append('""')
+            i = end + 1
+        elif text.startswith('--', i):
+            # Comments run to the next -- or the end of the line
+            newline = text.find('\n', i + 2)
+            if newline < 0:
+                newline = length
+            close = text.find('--', i + 2, newline)
+            if close < 0:
+                i = newline
+            else:
+                i = close + 2
+        else:
+            out.append(char)
+            i = i + 1
+
+    return ''.join(out)
+
+def parseEnums(values):
+    """
+    Returns
+    -------
+    A dictionary of integer => label for the body of INTEGER { a(1), b(2) }
+    """
+    return dict([(int(value), label) for (label, value) in enumRegex.findall(values)])
+
+def findMib(name, dirs):
+    """
+    Returns
+    -------
+    The path of the file defining a MIB module, None if it is not found
+    """
+    for directory in dirs:
+        for suffix in MIB_SUFFIXES:
+            path = os.path.join(directory, name + suffix)
+            if os.path.isfile(path):
+                return path
+    return None
+
+def loadModules(paths, names, dirs):
+    """
+    Parse MIB files and named MIB modules, and the modules they import
+
+    Returns
+    -------
+    A dictionary of module name => MIBModule
+    """
+    modules = {}
+    missing = set()
+    queue = [(path, None) for path in paths] + [(None, name) for name in names]
+
+    while queue:
+        (path, name) = queue.pop(0)
+
+        if name is not None:
+            if modules.has_key(name) or name in missing:
+                continue
+            path = findMib(name, dirs)
+            if path is None:
+                missing.add(name)
+                continue
+
+        with open(path) as file:
+            module = MIBModule.parse(file.read())
+
+        if module is None:
+            sys.stderr.write('%s is not a MIB\n' % path)
+            continue
+
+        modules[module.name] = module
+        queue.extend([(None, imported) for imported in module.imports])
+
+    return modules
+
+def resolve(modules):
+    """
+    Work out the numeric OID of every name the modules define
+
+    Returns
+    -------
+    A tuple (symbols, enums): dictionaries of MODULE::name => OID tuple,
+    and MODULE::name => {integer: label}
+    """
+    # Bare names from every module, to resolve parents defined elsewhere
+    known = dict(SMI_ROOTS)
+    resolved = dict([(name, {}) for name in modules.keys()])
+    unresolved = [(module, assignment) for module in modules.values()
+                                       for assignment in module.assignments]
+
+    while unresolved:
+        remaining = []
+        for (module, (name, parent, subids)) in unresolved:
+            local = resolved[module.name]
+            base = local.get(parent, None) or known.get(parent, None)
+            if base is None:
+                remaining.append((module, (name, parent, subids)))
+            else:
+                local[name] = base + subids
+                known.setdefault(name, local[name])
+
+        if len(remaining) == len(unresolved):
+            for (module, (name, parent, subids)) in remaining:
+                sys.stderr.write('%s::%s: unknown parent %s\n' % (module.name, name, parent))
+            break
+        unresolved = remaining
+
+    # Enumerated types, which are often imported from another module
+    types = {}
+    for module in modules.values():
+        types.update(module.types)
+
+    symbols = {}
+    enums = {}
+    for module in modules.values():
+        for (name, oid) in resolved[module.name].items():
+            symbols['%s::%s' % (module.name, name)] = oid
+
+        for (name, typeName) in module.syntaxes.items():
+            values = module.types.get(typeName, None) or types.get(typeName, None)
+            if values and not module.enums.has_key(name):
+                module.enums[name] = values
+
+        for (name, values) in module.enums.items():
+            if resolved[module.name].has_key(name):
+                enums['%s::%s' % (module.name, name)] = values
+
+    return (symbols, enums)
+
+def writeTable(path, symbols, enums, modules):
+    """
+    Write the symbol table as a Python module
+    """
+    lines = ['# Generated by mib_compiler.py from %s, do not edit' % ', '.join(sorted(modules)),
+             '',
+             'MODULES = %r' % sorted(modules),
+             '',
+             'SYMBOLS = {']
+    for name in sorted(symbols.keys(), key=lambda name: symbols[name]):
+        lines.append('    %r: %r,' % (name, symbols[name]))
+    lines.append('}')
+    lines.append('')
+    lines.append('ENUMS = {')
+    for name in sorted(enums.keys()):
+        lines.append('    %r: %r,' % (name, enums[name]))
+    lines.append('}')
+
+    tmp = '%s.tmp' % path
+    with open(tmp, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.rename(tmp, path)
+
+def configuredMibs(file = None):
+    """
+    Returns
+    -------
+    A tuple (MIB names, MIB directories) from the [snmp] section of the
+    config file, whose mibs option is in the format of $MIBS
+    """
+    options = BladeUtilsConfig(file).options.get('snmp', {})
+    names = [name.lstrip('+') for name in options.get('mibs', 'BLADE-MIB').split(':') if name.lstrip('+')]
+    dirs = [directory for directory in options.get('mibdirs', '').split(':') if directory]
+    return (names, dirs)
+
+def usage(progName):
+    print ('Usage: %s [-c config] [-M dir:dir] [-o output] [MIB file or name ...]' % progName)
+    print ('Without MIBs, compiles the mibs listed in the [snmp] section of the config file')
+    print ('The table is written to %s by default' % DEFAULT_OUTPUT)
+
+def main(argv):
+    """
+    Program entry point
+
+    Returns
+    -------
+    The exit code
+    """
+    progName = os.path.basename(sys.argv[0])
+
+    try:
+        optlist, args = getopt.getopt(argv, 'c:hM:o:', ['config=', 'help', 'mibdirs=', 'output='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage(progName)
+        return 1
+
+    configFile = None
+    dirs = []
+    output = DEFAULT_OUTPUT
+
+    for (opt, value) in optlist:
+        if opt == '--config' or opt == '-c':
+            configFile = value
+
+        if opt == '--mibdirs' or opt == '-M':
+            dirs.extend(value.split(':'))
+
+        if opt == '--output' or opt == '-o':
+            output = value
+
+        if opt == '--help' or opt == '-h':
+            usage(progName)
+            return 0
+
+    paths = [arg for arg in args if os.path.isfile(arg)]
+    names = [arg for arg in args if not os.path.isfile(arg)]
+
+    if not args:
+        (names, configDirs) = configuredMibs(configFile)
+        dirs.extend(configDirs)
+
+    dirs.extend([os.path.dirname(os.path.abspath(path)) for path in paths])
+    dirs.extend(DEFAULT_MIB_DIRS)
+
+    modules = loadModules(paths, names, dirs)
+    if not modules:
+        sys.stderr.write('No MIBs found\n')
+        return 1
+
+    (symbols, enums) = resolve(modules)
+    writeTable(output, symbols, enums, modules.keys())
+    print ('Wrote %d symbols from %s to %s' % (len(symbols), ', '.join(sorted(modules)), output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -34,11 +34,16 @@
 #
 # }}}
 
-import re,bitarray,datetime,uuid,sys
+import re,bitarray,datetime,uuid,sys,os,time,hashlib,zlib,base64,json
 from nmc_probe.couchdb import CouchDoc
 from nmc_probe.log import Log
 from nmc_probe.command import Command
-from nmc_probe.snmp import SNMP, SNMPWalk
+from nmc_probe.snmp import SNMP, SNMPWalk, SNMPProbe, SNMPError
+from nmc_probe.reachability import CircuitBreaker
+from nmc_probe.scheduler import HostScheduler
+from nmc_probe.event_log import EventLogParser
+from nmc_probe.proc.inventory import Inventory
+from nmc_probe.bladeutilsconfig import BladeUtilsConfig
 from bitarray import bitarray
 
 class Blade (CouchDoc):
@@ -97,8 +102,9 @@ class Blade (CouchDoc):
         """
         return ['mac0', 'mac1', 'biosVersion',
                 'bmcVersion', 'diagVersion', 'serialNumber',
-                'memory', 'numCPUs', 'incorrectBIOSSettings',
-                'healthState']
+                'memory', 'numCPUs', 'dimmCount', 'nicSpeeds',
+                'incorrectBIOSSettings', 'biosFingerprint',
+                'biosExpectedFingerprint', 'biosSettings', 'healthState']
 
     @property
     def mac0(self):
@@ -120,36 +126,194 @@ class Blade (CouchDoc):
     def mac1(self, value):
         self.__mac1 = value.lower()
 
+    @classmethod
+    def discoverInventory(self):
+        '''
+        Returns the hardware inventory of this computer, read from
+        /proc and /sys in one pass, as blade parameters. See Inventory
+        '''
+        return Inventory.info()
+
     @classmethod
     def discoverNumCPUs(self):
         '''
         Checks /proc/cpuinfo for the number of processors
         '''
-        (lines, exitcode) = Command.run(['/bin/cat', '/proc/cpuinfo'])
-        regex = re.compile('^processor\s+:')
-        return len(filter(regex.match, lines))
+        return Inventory.numCPUs()
 
     @classmethod
     def discoverMemory(self):
         '''
         Returns the amount of physical memory on this computer
         '''
-        (lines, exitcode) = Command.run(['free'])
-        regex = re.compile('^Mem:\s+')
-        memLine = filter(regex.match, lines)
-        memLineParts = memLine[0].split()
-        return memLineParts[1]
+        return Inventory.memory()
 
     @classmethod
     def discoverMac0(self):
         '''
         Returns the mac address of eth0
         '''
-        (output, exitcode) = Command.run(['/sbin/ip', 'addr', 'show', 'eth0'])
-        regex = re.compile('^\s+link\/ether')
-        filteredLines = filter(regex.match, output)
-        firstLineSplit = filteredLines[0].split()
-        return firstLineSplit[1]
+        return Inventory.mac0()
+
+    # Expected BIOS settings already loaded by this process,
+    # filename => ((mtime, size), settings, fingerprint)
+    expectedBiosCache = {}
+
+    @classmethod
+    def discoverBIOSCompliance(cls, expectedFilename, dumpCmd):
+        """
+        Compare this blade's BIOS settings against the expected settings
+        by fingerprint. Only when the fingerprints differ are the settings
+        diffed and the full settings included.
+
+        Params
+        ------
+        expectedFilename: string
+        A filename of expected bios settings
+
+        dumpCmd: array
+        Command to dump bios settings
+
+        Returns
+        -------
+        A dictionary of blade parameters:
+        biosFingerprint         : fingerprint of the actual values of the
+                                  expected settings
+        biosExpectedFingerprint : fingerprint of the expected values of the
+                                  same settings, so the two match exactly
+                                  when incorrectBIOSSettings is 'None'
+        incorrectBIOSSettings   : 'None', or the incorrect settings as
+                                  discoverIncorrectBIOSSettings() returns them
+        biosSettings            : 'None', or the compressed actual settings when
+                                  some are incorrect, see biosDigest()
+        """
+        try:
+            (expected, expectedFingerprint) = Blade.loadExpectedBios(expectedFilename)
+
+            (actualFile, exitcode) = Command.run(dumpCmd)
+            actual = Blade.parseBios(actualFile)
+        except (OSError, IOError) as e:
+            Log.error(str(e))
+            sys.exit(1)
+
+        # Only the settings that are expected count towards compliance.
+        # Settings the blade does not have are skipped, as they are by
+        # compareBiosSettings(), so both fingerprints cover the same keys
+        relevant = {}
+        for key in expected:
+            if actual.has_key(key):
+                relevant[key] = actual[key]
+
+        (fingerprint, blob) = Blade.biosDigest(relevant)
+
+        if len(relevant) != len(expected):
+            expectedFingerprint = Blade.biosDigest(dict([(key, expected[key]) for key in relevant]))[0]
+
+        params = {
+            'biosFingerprint':         fingerprint,
+            'biosExpectedFingerprint': expectedFingerprint,
+            'incorrectBIOSSettings':   'None',
+            'biosSettings':            'None',
+        }
+
+        if fingerprint != expectedFingerprint:
+            incorrect = Blade.compareBiosSettings(expected, actual)
+            if len(incorrect) > 0:
+                params['incorrectBIOSSettings'] = incorrect
+                params['biosSettings'] = Blade.biosDigest(actual)[1]
+
+        return params
+
+    @classmethod
+    def biosDigest(cls, settings):
+        """
+        Reduce BIOS settings to a canonical form: one setting=value
+        line per setting, sorted by setting
+
+        Params
+        ------
+        settings: dictionary
+        Settings as returned by parseBios()
+
+        Returns
+        -------
+        (fingerprint, blob), the SHA-1 hex digest of the canonical form and
+        the canonical form compressed and base64 encoded, see biosSettingsFromBlob()
+        """
+        canonical = ''.join(['%s=%s\n' % (key, settings[key]) for key in sorted(settings)])
+        return (hashlib.sha1(canonical).hexdigest(),
+                base64.b64encode(zlib.compress(canonical, 9)))
+
+    @classmethod
+    def biosSettingsFromBlob(cls, blob):
+        """
+        Returns the settings dictionary a biosDigest() blob holds
+        """
+        return Blade.parseBios(zlib.decompress(base64.b64decode(blob)).splitlines())
+
+    @classmethod
+    def loadExpectedBios(cls, filename):
+        """
+        Load expected BIOS settings. The parsed settings are kept in
+        filename.compiled, and reused while filename's mtime and size
+        are unchanged
+
+        Params
+        ------
+        filename: string
+        A filename of expected bios settings, or '-' for stdin
+
+        Returns
+        -------
+        (settings, fingerprint)
+        """
+        if filename == '-':
+            settings = Blade.parseBios(sys.stdin)
+            return (settings, Blade.biosDigest(settings)[0])
+
+        stat = os.stat(filename)
+        key = (stat.st_mtime, stat.st_size)
+
+        cached = Blade.expectedBiosCache.get(filename)
+        if cached is not None and cached[0] == key:
+            return (cached[1], cached[2])
+
+        compiledFilename = filename + '.compiled'
+        compiled = None
+
+        try:
+            with open(compiledFilename, 'r') as fh:
+                compiled = json.load(fh)
+            if compiled['mtime'] != stat.st_mtime or compiled['size'] != stat.st_size:
+                compiled = None
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            compiled = None
+
+        if compiled is not None:
+            settings = {}
+            for (setting, value) in compiled['settings'].iteritems():
+                settings[str(setting)] = str(value)
+            fingerprint = str(compiled['fingerprint'])
+        else:
+            with open(filename, 'r') as fh:
+                settings = Blade.parseBios(fh)
+            fingerprint = Blade.biosDigest(settings)[0]
+
+            # Write the compiled settings next to the expected file. Failing
+            # to do so only costs a parse the next time around
+            tmpFilename = '%s.%d' % (compiledFilename, os.getpid())
+            try:
+                with open(tmpFilename, 'w') as fh:
+                    json.dump({'mtime':       stat.st_mtime,
+                               'size':        stat.st_size,
+                               'fingerprint': fingerprint,
+                               'settings':    settings}, fh)
+                os.rename(tmpFilename, compiledFilename)
+            except (IOError, OSError) as e:
+                Log.debug(5, 'Unable to write %s: %s' % (compiledFilename, str(e)))
+
+        Blade.expectedBiosCache[filename] = (key, settings, fingerprint)
+        return (settings, fingerprint)
 
     @classmethod
     def discoverIncorrectBIOSSettings(cls, expectedFilename, dumpCmd):
@@ -170,8 +334,7 @@ class Blade (CouchDoc):
 
         try:
             # Read expected bios settings
-            expectedFile = Blade.openFile(expectedFilename)
-            expected = Blade.parseBios(expectedFile)
+            (expected, fingerprint) = Blade.loadExpectedBios(expectedFilename)
 
             # Read actual bios settings
             (actualFile, exitcode) = Command.run(dumpCmd)
@@ -281,6 +444,9 @@ class Slot (CouchDoc):
                    The docId of the Chassis to which this slot belongs
     bladeDocId   : string, optional
                    The docId of the Blade that is in this slot
+    powerState   : string, optional
+                   The blade's power state, e.g. on(1), kept up to date
+                   by the chassis poller
     """
     @property
     def type(self):
@@ -309,7 +475,7 @@ class Slot (CouchDoc):
         -------
             An array attributes that will be persisted to CouchDB
         """
-        return ['nodeName', 'num', 'chassisDocId', 'bladeDocId', 'bladeInstalled', 'bladeCommunicating']
+        return ['nodeName', 'num', 'chassisDocId', 'bladeDocId', 'bladeInstalled', 'bladeCommunicating', 'powerState']
         
     @classmethod
     def retrieveWithMac(cls, couch, mac):
@@ -339,6 +505,37 @@ class Slot (CouchDoc):
 
         return None
 
+    @classmethod
+    def retrieveManyWithMac(cls, couch, macs):
+        """
+        Find the slots that match many mac addresses with one request,
+        see retrieveWithMac()
+
+        Params
+        ------
+        couch:  object
+                couch database connection
+        macs:   array
+                The mac addresses for which to search
+
+        Returns
+        -------
+        Dictionary of mac address => the slot that matches it, for the
+        mac addresses that are in a slot
+        """
+        macs = [mac for mac in macs if mac != 'not available' and mac != 'not installed']
+
+        slots = {}
+        for (mac, value) in couch.getViewKeys('slot', 'mac_to_slot', macs).iteritems():
+            # A blade that moved can be named by more than one slot
+            if isinstance(value, list):
+                Log.debug(10, '%s is in %d slots' % (mac, len(value)))
+                value = value[0]
+            if value:
+                slots[mac] = value
+
+        return slots
+
     @classmethod
     def communicationProblems(cls, couch):
         """
@@ -379,7 +576,7 @@ class Slot (CouchDoc):
         return couch.getViewTuple('slot', 'slot_to_blade', slotDocId)
 
 class LogEntry (CouchDoc):
-    def __init__(self, params):
+    def __init__(self, params, docId = None):
         """
         Constructor
 
@@ -387,9 +584,47 @@ class LogEntry (CouchDoc):
         ----------
         params : dictionary
              Set of attributes
+        docId  : string
+             The document ID, a random one if None
         """
         super(LogEntry, self).__init__(params)
-        self.docId = '%s' % uuid.uuid4()
+        self.docId = docId or '%s' % uuid.uuid4()
+
+    @classmethod
+    def eventDocId(cls, params, index = None, occurrence = 1):
+        """
+        Params
+        ------
+        params     : dictionary
+                     The parsed event
+        index      : int
+                     The index of the entry in the event log, if known
+        occurrence : int
+                     1 for the first event with these params, 2 for the
+                     second and so on. The AMM logs to the second, so the
+                     same event can happen twice with the same timestamp
+
+        Returns
+        -------
+        The docId for an AMM event, the same every time the event is
+        read, whether from the event log or from a trap (Chassis.parseTrap()),
+        so an event is only stored once. Made from the chassis, timestamp,
+        eventID, source, a short hash of the message text and the
+        occurrence, or the text of the entry and its index in the log if
+        it did not parse
+        """
+        if params.has_key('timestamp'):
+            source = re.sub('[^A-Za-z0-9_.]', '_', params.get('source', None) or '')
+            message = hashlib.sha1((params.get('message', None) or '').strip()).hexdigest()[:8]
+            key = '%s-%s-%s-%s' % (params['timestamp'], params.get('eventID', ''), source, message)
+            if occurrence > 1:
+                key = '%s-%d' % (key, occurrence)
+        else:
+            key = hashlib.sha1(params.get('rawAttribute', '')).hexdigest()[:16]
+            if index is not None:
+                key = '%s-%d' % (key, index)
+
+        return '%s:log-%s' % (params.get('chassisDocId', ''), key)
 
     @property
     def type(self):
@@ -533,7 +768,18 @@ class Chassis (CouchDoc):
                         The last node number in the chassis, eg 14 or 28
     community         : string
                         The SNMP community string
+    hardwareChanged   : bool
+                        Whether the blade VPD columns and slots need fetching, see detectChanges()
+    eventLogChanged   : bool
+                        Whether the event log needs walking, see detectChanges()
     """
+    # Seconds after which the blade tables are walked even if nothing changed
+    fullCollectionInterval = 86400
+
+    # Seconds the boot time computed from sysUpTime may drift without
+    # counting as a restart
+    bootTimeSlack = 60
+
     def __init__(self, params):
         """
         Constructor
@@ -547,6 +793,8 @@ class Chassis (CouchDoc):
 
         self.isPingable = 0
         self.collectedSNMP = 0
+        self.hardwareChanged = True
+        self.eventLogChanged = True
 
         if params:
             setattr(self, 'nodeNameFormat', params['nodeNameFormat'])
@@ -572,16 +820,44 @@ class Chassis (CouchDoc):
         """
         return 'chassis-%03d' % self.num
 
+    # Seconds an answer from the AMM counts as proof it is up
+    pingMaxAge = 60
+
     def ping(self):
         """
+        Check that the AMM answers SNMP, with a GET of sysUpTime and a
+        short timeout. An answer to any request in the last pingMaxAge
+        seconds, like a probeMany(), counts without asking again
+
         Returns
         -------
         None if the chassis was not pingable
         """
-        (output, exitcode) = Command.run(["/bin/ping", "-c1", "-w100", self.host])
-        if exitcode == 0:
-	    return True
-        return None
+        if CircuitBreaker.shared().isUp(self.host, self.pingMaxAge):
+            return True
+        if SNMPProbe.withConfigFile().probe([self.host])[self.host] is None:
+            return None
+        return True
+
+    @classmethod
+    def probeMany(cls, chassisList):
+        """
+        Probe every chassis at once, see ping()
+
+        Returns
+        -------
+        The chassis that answered, in the same order
+        """
+        uptimes = SNMPProbe.withConfigFile().probe([chassis.host for chassis in chassisList])
+
+        reachable = []
+        for chassis in chassisList:
+            if uptimes[chassis.host] is None:
+                Log.info('%s not pingable' % chassis.name)
+            else:
+                reachable.append(chassis)
+
+        return reachable
 
     def powerState(self):
         """
@@ -590,41 +866,90 @@ class Chassis (CouchDoc):
         walkAttr = 'remoteControlBladePowerState'
         oid = 'BLADE-MIB::%s' % walkAttr
 
-        # Start async snmpwalk. This call returns immediately
-        # and spawns a background thread to perform the SNMPWalk
         snmpWalk = SNMPWalk.withConfigFile(self.host, oid)
 
         state = []
 
-        # While the snmpwalk is running
-        while not snmpWalk.eof:
-            # Get snmp oid/value pairs off the queue
-            while not snmpWalk.queue.empty():
-                (oid, value) = snmpWalk.queue.get()
-                (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
+        # Blocks until each oid/value pair arrives
+        for (oid, value) in snmpWalk:
+            (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
 
-                if attr == walkAttr:
-                    if value == 'on(1)':
-                        state.append(1)
-                    else:
-                        state.append(0)
-        snmpWalk.join()
+            if attr == walkAttr:
+                if value == 'on(1)':
+                    state.append(1)
+                else:
+                    state.append(0)
         Log.debug(100, 'ch %03d power state: %s' % (self.num, state))
         return state
 
+    def slotPowerStates(self, slots):
+        """
+        Get the power state of several slots with one SNMP GET
+
+        Params
+        ------
+        slots : array
+                The slot numbers
+
+        Returns
+        -------
+        A dictionary of slot => remoteControlBladePowerState as an integer,
+        0 = off, 1 = on, 3 = standby, 4 = hibernate, for the slots the AMM
+        has, or None if the request failed
+        """
+        oids = [(slot, 'BLADE-MIB::remoteControlBladePowerState.%d' % slot) for slot in slots]
+        values = self.snmp.scalars([oid for (slot, oid) in oids])
+        if values is None:
+            return None
+
+        states = {}
+        for (slot, oid) in oids:
+            if values.has_key(oid):
+                # on(1) with the MIB loaded, 1 without
+                match = re.search('(\d+)\)?$', values[oid])
+                if match:
+                    states[slot] = int(match.group(1))
+
+        Log.debug(100, 'ch %03d power state: %s' % (self.num, states))
+        return states
+
+    @property
+    def snmp(self):
+        """
+        Returns
+        -------
+        An SNMP connection to this chassis, made once
+        """
+        if getattr(self, '_snmp', None) is None:
+            self._snmp = SNMP.withConfigFile(self.host)
+        return self._snmp
+
     def powerCycleSlot(self, slot):
-        snmp = SNMP.withConfigFile(self.host)
-        snmp.set('BLADE-MIB::restartBlade.%d' % slot, 'i', '1')
+        return self.powerCycleSlots([slot]).get(slot, False)
+
+    def powerCycleSlots(self, slots):
+        """
+        Power cycle several slots with one SNMP SET
+
+        Returns
+        -------
+        A dictionary of slot => True if the restart was accepted
+        """
+        return self.setSlots('BLADE-MIB::restartBlade.%d', slots, '1')
 
     def powerCycle(self):
         """
         Power cycle all slots
+
+        Returns
+        -------
+        A dictionary of slot => True if the restart was accepted
         """
         if self.ping():
-            for slot in range(1, 15):
-                self.powerCycleSlot(slot)
+            return self.powerCycleSlots(range(1, 15))
         else:
             Log.info('%s not pingable, cannot power cycle all blades' % self.host)
+            return {}
 
     def powerOnOffSlot(self, slot, func):
         """
@@ -637,21 +962,177 @@ class Chassis (CouchDoc):
         func:  int
                0 = off, 1 = on, 2 = soft off
         """
-        snmp = SNMP.withConfigFile(self.host)
-        snmp.set('BLADE-MIB::powerOnOffBlade.%d' % slot, 'i', str(func))
-        
+        return self.powerOnOffSlots([slot], func).get(slot, False)
+
+    def powerOnOffSlots(self, slots, func):
+        """
+        Power on / off several slots with one SNMP SET
+
+        Params
+        ------
+        slots : array
+                The slot numbers
+        func:   int
+                0 = off, 1 = on, 2 = soft off
+
+        Returns
+        -------
+        A dictionary of slot => True if the power function was accepted
+        """
+        return self.setSlots('BLADE-MIB::powerOnOffBlade.%d', slots, str(func))
+
     def powerOnOff(self, func):
         """
         Power on / off all slots in the chassis
 
         func:  int
                0 = off, 1 = on, 2 = soft off
+
+        Returns
+        -------
+        A dictionary of slot => True if the power function was accepted
         """
         if self.ping():
-            for slot in range(1, 15):
-                self.powerOnOffSlot(slot, func)
+            return self.powerOnOffSlots(range(1, 15), func)
         else:
             Log.info('%s is not pingable, cannot apply power func %d all slots' % (self.host, func))
+            return {}
+
+    def setSlots(self, oidFormat, slots, value):
+        """
+        Set an integer object for several slots in one SET request
+
+        Returns
+        -------
+        A dictionary of slot => True if it was set
+        """
+        oids = [(slot, oidFormat % slot) for slot in slots]
+        results = self.snmp.setMany([(oid, 'i', value) for (slot, oid) in oids])
+        return dict([(slot, results[oid]) for (slot, oid) in oids])
+
+    @classmethod
+    def powerOnOffMany(cls, chassisList, func, slots = None, limit = 16):
+        """
+        Power on / off slots in many chassis at once, one SET per chassis
+
+        Params
+        ------
+        chassisList : array
+                      Chassis objects
+        func        : int
+                      0 = off, 1 = on, 2 = soft off
+        slots       : array
+                      The slot numbers, all 14 if None
+        limit       : int
+                      Chassis to talk to at the same time
+
+        Returns
+        -------
+        A dictionary of chassis name => dictionary of slot => True if
+        the power function was accepted
+        """
+        return cls.forMany(chassisList, limit, lambda chassis:
+                           chassis.powerOnOffSlots(slots or range(1, 15), func))
+
+    @classmethod
+    def powerCycleMany(cls, chassisList, slots = None, limit = 16):
+        """
+        Power cycle slots in many chassis at once, one SET per chassis
+
+        Returns
+        -------
+        A dictionary of chassis name => dictionary of slot => True if
+        the restart was accepted
+        """
+        return cls.forMany(chassisList, limit, lambda chassis:
+                           chassis.powerCycleSlots(slots or range(1, 15)))
+
+    @classmethod
+    def parseNumbers(cls, value):
+        """
+        Returns
+        -------
+        Chassis numbers from a list like 12,13,20-22
+        """
+        numbers = []
+        for part in re.split('[,\s]+', value.strip()):
+            if not part:
+                continue
+            if '-' in part:
+                (first, last) = part.split('-', 1)
+                numbers.extend(range(int(first), int(last) + 1))
+            else:
+                numbers.append(int(part))
+        return numbers
+
+    @classmethod
+    def numbersFromOptions(cls, couch, numbers, allChassis):
+        """
+        The chassis a command asks for with --num or --all
+
+        Params
+        ------
+        couch      : CouchDB
+        numbers    : array
+                     Chassis numbers from --num
+        allChassis : bool
+                     Whether --all was given
+
+        Returns
+        -------
+        The numbers of every chassis in the chassis/all view for --all,
+        otherwise numbers, otherwise the list option of the [chassis]
+        section of the config file. Empty if none of them name a chassis
+        """
+        if allChassis:
+            numbers = sorted([int(doc[u'num']) for (docId, doc) in Chassis.all(couch)
+                              if doc and doc.has_key(u'num')])
+
+        if not numbers:
+            options = BladeUtilsConfig().options.get('chassis', {})
+            numbers = Chassis.parseNumbers(options.get('list', ''))
+
+        return numbers
+
+    @classmethod
+    def forNumber(cls, num):
+        """
+        Returns
+        -------
+        The Chassis with a chassis number, its name, address and nodes
+        """
+        lastNode = num * 14
+        firstNode = lastNode - 13
+
+        return Chassis({'nodeNameFormat': 'na%04d',
+                        'chassisNameFormat': 'na-mm-%02d',
+                        'host': '10.56.100.%d' % num,
+                        'num': num,
+                        'firstNode': firstNode,
+                        'lastNode': lastNode})
+
+    @classmethod
+    def forMany(cls, chassisList, limit, func):
+        """
+        Run func(chassis) for each chassis that answers a probe, limit
+        at a time
+
+        Returns
+        -------
+        A dictionary of chassis name => what func returned, an empty
+        dictionary for chassis that did not answer or where func raised
+        """
+        results = dict([(chassis.name, {}) for chassis in chassisList])
+
+        scheduler = HostScheduler(limit, 1)
+        jobs = [(chassis, scheduler.submit(chassis.host, chassis.name, func, chassis))
+                for chassis in cls.probeMany(chassisList)]
+        scheduler.run()
+
+        for (chassis, job) in jobs:
+            results[chassis.name] = job.result or {}
+
+        return results
 
     def collectMac(self):
         """
@@ -661,31 +1142,25 @@ class Chassis (CouchDoc):
         """
 
         mac = [ {}, {} ]
-        for interface in range(2):
-            oid = 'BLADE-MIB::bladeMACAddress%dVpd' % (int(interface) + int(1))
-
-            # Start async snmpwalk. This call returns immediately
-            # and spawns a background thread to perform the SNMPWalk
-            snmpWalk = SNMPWalk.withConfigFile(self.host, oid)
-
-            macDict = {}
-            # While the snmpwalk is running
-            while not snmpWalk.eof:
-                # Get snmp oid/value pairs off the queue
-                while not snmpWalk.queue.empty():
-                    (oid, value) = snmpWalk.queue.get()
-                    (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
-                    mac[interface][lastOctet] = value
-
-            snmpWalk.join()
-            
+
+        # Start both walks, they run at the same time
+        snmpWalks = [SNMPWalk.withConfigFile(self.host, 'BLADE-MIB::bladeMACAddress%dVpd' % (interface + 1))
+                     for interface in range(2)]
+
+        for (interface, snmpWalk) in enumerate(snmpWalks):
+            for (oid, value) in snmpWalk:
+                (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
+                mac[interface][lastOctet] = value
+
         return mac
 
-    def collectInfoAndPersist(self, couch):
+    def collectInfoAndPersist(self, couch, force = False):
         """
         Collect blade info for this chassis via SNMP, and 
         persist those blades and slots and this Chassis object
-        to CouchDB when done
+        to CouchDB when done. Blade health is fetched every time, the
+        VPD columns and the slots only when detectChanges() finds a
+        change, unless force is set
         """
         if not self.ping():
             Log.info('%s not pingable, not collecting SNMP info' % self.host)
@@ -693,34 +1168,48 @@ class Chassis (CouchDoc):
             Log.debug(5, '%s is pingable' % self.host)
             self.isPingable = 1
 
-            snmp = SNMP.withConfigFile(self.host)
+            snmp = self.snmp
 
             self.collectChassisInfo(snmp)
+            previous = couch.getDocument(self.docId)
+            self.detectChanges(previous, force)
             self.collectFanPackInfo()
 
-            bladesCommunicating = bitarray(self.bladesCommunicating)
-            bladesInstalled = bitarray(self.bladesInstalled)
-
+            # Health changes without anything detectChanges() looks at, so
+            # it is fetched every time. mac0 is the blade document ID
             oids = {'mac0':                     'BLADE-MIB::bladeMACAddress1Vpd',
-                    'mac1':                     'BLADE-MIB::bladeMACAddress2Vpd',
-                    'biosVersion':              'BLADE-MIB::bladeBiosVpdRevision',
-                    'bmcVersion':               'BLADE-MIB::bladeSysMgmtProcVpdRevision',
-                    'diagVersion':              'BLADE-MIB::bladeDiagsVpdRevision',
-                    'serialNumber':             'BLADE-MIB::bladeBiosVpdName',
                     'healthState':              'BLADE-MIB::bladeHealthState',
                     'healthSummarySeverity':    'BLADE-MIB::bladeHealthSummarySeverity',
                     'healthSummaryDescription': 'BLADE-MIB::bladeHealthSummaryDescription',
                 }
 
+            if self.hardwareChanged:
+                self.walkedAt = time.time()
+                oids.update({'mac1':         'BLADE-MIB::bladeMACAddress2Vpd',
+                             'biosVersion':  'BLADE-MIB::bladeBiosVpdRevision',
+                             'bmcVersion':   'BLADE-MIB::bladeSysMgmtProcVpdRevision',
+                             'diagVersion':  'BLADE-MIB::bladeDiagsVpdRevision',
+                             'serialNumber': 'BLADE-MIB::bladeBiosVpdName',
+                })
+            else:
+                Log.info('%s unchanged, only fetching blade health' % self.name)
+
+            bladesCommunicating = bitarray(self.bladesCommunicating)
+            bladesInstalled = bitarray(self.bladesInstalled)
+
             blade = {}
-            
-            for (attr, oid) in oids.items():
-                values = self.bladeInfo(snmp, oid)
-                if values:
-                    for (slot, value) in values:
-                        if not blade.has_key(slot):
-                            blade[slot] = {}
-                        blade[slot][attr] = value
+
+            # docId => document, written together once the walk is done
+            documents = {}
+
+            # Fetch every column at once, slot => {oid: value}
+            rows = snmp.table(oids.values())
+            if rows:
+                for (slot, row) in rows.items():
+                    blade[slot] = {}
+                    for (attr, oid) in oids.items():
+                        if row.has_key(oid):
+                            blade[slot][attr] = row[oid]
 
             if len(blade) > 0:
                 self.collectedSNMP = 1
@@ -731,6 +1220,13 @@ class Chassis (CouchDoc):
 
                     blade = Blade(params)
 
+                    if blade.validMac0:
+                        documents[blade.docId] = blade.document()
+
+                    # Slots only change with the hardware
+                    if not self.hardwareChanged:
+                        continue
+
                     slotInt = int(slotNum)
 
                     slotParams = {'num':                slotInt,
@@ -748,10 +1244,14 @@ class Chassis (CouchDoc):
 #                    if blade.mac0 == 'not available':
 #                        blade.mac0 = '%s-%s' % (blade.mac0, slot.docId)
 
-                    slot.persist(couch)
+                    documents[slot.docId] = slot.document()
 
-                    if blade.validMac0:
-                        blade.persist(couch)
+            documents[self.docId] = self.document()
+
+            # One read for the slots and blades, one write for what changed
+            written = couch.saveDocuments(documents, {self.docId: previous})
+            Log.debug(5, '%s: %d of %d documents written' % (self.name, written, len(documents)))
+            return
 
         self.persist(couch)
 
@@ -773,157 +1273,322 @@ class Chassis (CouchDoc):
 
     def collectChassisInfo(self, snmp):
         """
-        Retrieve chassis information
+        Retrieve chassis information and the change indicators, in one GET
         """ 
-        for (attr, oid) in self.chassisOidDict.items():
-            values = snmp.walk(oid)
-            if values:
-                Log.debug(10, '%s: %s' % (attr, values[0][1]))
-                setattr(self, attr, values[0][1])
+        oids = dict(self.chassisOidDict, **self.changeOidDict)
+        values = snmp.scalars(oids.values())
+        if values:
+            for (attr, oid) in oids.items():
+                if values.has_key(oid):
+                    Log.debug(10, '%s: %s' % (attr, values[oid]))
+                    setattr(self, attr, values[oid])
+
+    def detectChanges(self, previous, force = False):
+        """
+        Compare the change indicators collectChassisInfo() just read with
+        the ones stored with the chassis document, and set
+        hardwareChanged and eventLogChanged.
+
+        The blade tables need walking when the AMM restarted (the boot
+        time sysUpTime gives moved forward), a blade was added, removed or stopped
+        communicating, or they have not been walked for
+        fullCollectionInterval seconds. The event log needs walking when
+        its first two entries changed. The log is cleared after every
+        walk, so a new entry changes one of them whichever end of the
+        log the AMM numbers from
+
+        Params
+        ------
+        previous : dictionary
+                   The chassis document from CouchDB
+        force    : bool
+                   Walk everything
+        """
+        def changed(attr):
+            return getattr(self, attr, None) != previous.get(attr, None)
+
+        # Carry over when the tables were last walked
+        self.walkedAt = previous.get('walkedAt', 0)
+
+        # The boot time is stored rather than sysUpTime, which changes every run
+        uptime = self.ticks(getattr(self, 'sysUpTime', None))
+        previousBootedAt = previous.get('bootedAt', None)
+        rebooted = True
+
+        if uptime is not None:
+            self.bootedAt = int(time.time() - uptime / 100)
+            if previousBootedAt is not None and self.bootedAt - previousBootedAt <= self.bootTimeSlack:
+                self.bootedAt = previousBootedAt
+                rebooted = False
+
+        self.hardwareChanged = bool(force or rebooted or
+                                    not previous.get('collectedSNMP', None) or
+                                    changed('bladesInstalled') or
+                                    changed('bladesCommunicating') or
+                                    time.time() - self.walkedAt >= self.fullCollectionInterval)
+
+        self.eventLogChanged = bool(force or
+                                    not previous.has_key('eventLogHead') or
+                                    changed('eventLogHead') or
+                                    changed('eventLogNext'))
+
+        Log.debug(5, '%s hardware changed: %s, event log changed: %s' %
+                  (self.name, self.hardwareChanged, self.eventLogChanged))
+
+    @classmethod
+    def ticks(cls, value):
+        """
+        Returns
+        -------
+        The TimeTicks in a value like (8640123) 1 day, 0:00:01.23, or None
+        """
+        match = re.search('^\\(([0-9]+)\\)', value or '')
+        if match:
+            return int(match.group(1))
+        return None
 
     def collectFanPackInfo(self):
         oid = 'BLADE-MIB::fanPack'
 
-        # Start async snmpwalk. This call returns immediately
-        # and spawns a background thread to perform the SNMPWalk
         snmpWalk = SNMPWalk.withConfigFile(self.host, oid)
 
-        # While the snmpwalk is running
-        while not snmpWalk.eof:
-            # Get snmp oid/value pairs off the queue
-            while not snmpWalk.queue.empty():
-                (oid, value) = snmpWalk.queue.get()
-                (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
+        # Blocks until each oid/value pair arrives
+        for (oid, value) in snmpWalk:
+            (mibName, attr, lastOctet) = snmpWalk.extractOidParts(oid)
 
-                if attr != 'fanPackIndex': 
+            if attr != 'fanPackIndex': 
 
-                    if hasattr(self, attr):
-                        attrValue = getattr(self, attr)
-                        attrValue.append(value)
-                        setattr(self, attr, attrValue)
-                    else:
-                        setattr(self, attr, [value])
-
-
-        snmpWalk.join()
+                if hasattr(self, attr):
+                    attrValue = getattr(self, attr)
+                    attrValue.append(value)
+                    setattr(self, attr, attrValue)
+                else:
+                    setattr(self, attr, [value])
 
     def parseEventLogAttribute(self, line, serialNumberToDocId):
         """
         Parse a line of format
            'Severity:INFO  Source:Blade_11  Serviceable Flag: U  EventID:0x10000002  Name:SN#YK13A082B0KY  Date:07/15/15  Time:22:04:08
-        Into its key value pairs
+        Into its key value pairs. To parse many lines, use an EventLogParser
+        """
+        return EventLogParser(self.docId, serialNumberToDocId).parse(line).asDict()
+
+    # spTrapPriority values of MMALERT-MIB, as event log severities
+    trapSeverities = {0: 'ERR', 2: 'WARN', 4: 'INFO'}
+
+    def parseTrap(self, values, serialNumberToDocId, received = None):
+        """
+        Turn the varbinds of an AMM alert trap (MMALERT-MIB spTrap*)
+        into the same keys parseEventLogAttribute() and
+        collectAndClearEventLog() produce for an event log entry
+
+        Params
+        ------
+        values              : array
+                              (oid, value) tuples, see SNMPTrapListener.values()
+        serialNumberToDocId : dictionary
+                              Blade serial numbers mapped to blade docIds
+        received            : datetime
+                              When the trap arrived, used when the trap
+                              has no spTrapDateTime
+
+        Returns
+        -------
+        A dictionary for a LogEntry, or None if this is not an AMM alert
         """
-        # keep the raw line, just in case parsing fails
-        dict = {'rawAttribute': line, 'chassisDocId': self.docId}
+        fields = {}
+        for (oid, value) in values:
+            (mibName, oidBase, lastOctet) = self.snmp.extractOidParts(oid)
+            if oidBase.startswith('spTrap'):
+                fields[oidBase] = value
 
-        # Some assumptions:
-        #
-        # The keys will always be in this order and named this way
-        # Values will never have spaces
-        #
-        # A firmware update could change this, or maybe some unknown corner case exists. This
-        # is why the rawAttribute is stored.
-        #
-#        match = re.search('^Severity:(\S+)\s+Source:(\S+)\s+Serviceable Flag:(\S+)\s+EventID:(\S+)\s+Name:(\S+)\s+Date:([0-9]+)\/([0-9]+)/([0-9]+)\s+Time:([0-9]+):([0-9]+):([0-9]+)$', line)
+        if not fields:
+            return None
+
+        priority = re.search('([0-9]+)\)?$', fields.get('spTrapPriority', ''))
+        severity = 'INFO'
+        if priority:
+            severity = self.trapSeverities.get(int(priority.group(1)), severity)
 
-        # Corner case, Name is blank
-        # Severity:INFO Source:Audit Serviceable Flag: U EventID:0x0001608c Name: Date:02/19/15 Time:14:08:20
-        match = re.search('^Severity:(\S+)\s+Source:(\S+)\s+Serviceable Flag:\s+(\S+)\s+EventID:(\S+)\s+Name:(\S*)\s+Date:([0-9]+)\/([0-9]+)/([0-9]+)\s+Time:([0-9]+):([0-9]+):([0-9]+)$', line)
+        eventID = fields.get('spTrapEvtName', '')
+        if re.search('^[0-9]+$', eventID):
+            eventID = '0x%08x' % int(eventID)
 
+        # spTrapDateTime looks like: Date(m/d/y)=07/15/15, Time(h:m:s)=22:04:08
+        match = re.search('([0-9]+/[0-9]+/[0-9]+)\D+([0-9]+:[0-9]+:[0-9]+)',
+                          fields.get('spTrapDateTime', ''))
         if match:
-            datetimeKeys = ['month', 'day', 'year', 'hour', 'minute', 'second']
-            keys = ['severity', 'source', 'serviceableFlag', 'eventID', 'name']
-            keys.extend(datetimeKeys)
-            idx = 1
-            for key in keys:
-                dict[key] = match.group(idx)
-                idx = idx + 1
-
-            month  = int(dict.get('month',  1))
-            day    = int(dict.get('day',    1))
-            year   = int(dict.get('year',   1970))
-            hour   = int(dict.get('hour',   0))
-            minute = int(dict.get('minute', 0))
-            second = int(dict.get('second', 0))
-
-            # Years come from the AMM offset from 2000
-            if year < 1970:
-                year = year + 2000
-
-            dt = datetime.datetime(year, month, day, hour, minute, second, 0)
-
-            dict['timestamp'] = dt.isoformat()
-
-            # Remove date/time keys
-            for key in datetimeKeys:
-                del dict[key]
-
-            # If this is a blade, extract the blade number and turn it into a slotDocId
-            match = re.search('Blade_([0-9]+)', dict['source'])
-            if match:
-                dict['slotDocId'] = '%s:slot-%02d' % (self.docId, int(match.group(1)))
-
-            # Match the serial number to a bladeDocId, if possible
-            if serialNumberToDocId.has_key(dict['name']):
-                dict['bladeDocId'] = serialNumberToDocId[dict['name']]
+            (date, clock) = match.groups()
+        else:
+            when = received or datetime.datetime.now()
+            (date, clock) = (when.strftime('%m/%d/%y'), when.strftime('%H:%M:%S'))
 
-        return dict
+        # Build the line the event log would have, so both parse the same way
+        line = 'Severity:%s  Source:%s  Serviceable Flag: U  EventID:%s  Name:%s  Date:%s  Time:%s' % (
+            severity, fields.get('spTrapSourceId', '').replace(' ', '_'), eventID,
+            fields.get('spTrapBladeName', '').replace(' ', '_'), date, clock)
 
-    def collectAndClearEventLog(self, couch):
-        log = {}
+        dict = self.parseEventLogAttribute(line, serialNumberToDocId)
+        dict['message'] = fields.get('spTrapMsgText', '')
 
-        # OIDs to retrieve
-        oids = ['BLADE-MIB::readEnhancedEventLogAttribute', 'BLADE-MIB::readEnhancedEventLogMessage']
+        return dict
 
-        # Get the mapping of blade serial numbers to blade document ids
-        serialNumberToDocId = Blade.serialNumberToDocId(couch)
+    # Log entries written to CouchDB per request
+    eventLogBatchSize = 500
 
-        for oid in oids:
+    def eventLog(self, serialNumberToDocId):
+        """
+        Walk the event log attribute and message columns at the same
+        time, and join them on the entry index as the values arrive
 
-            # Start async snmpwalk. This call returns immediately
-            # and spawns a background thread to perform the SNMPWalk
-            snmpWalk = SNMPWalk.withConfigFile(self.host, oid)
+        Params
+        ------
+        serialNumberToDocId : dictionary
+                              Blade serial numbers mapped to blade docIds
 
-            # While the snmpwalk is running
-            while not snmpWalk.eof:
-                # Get snmp oid/value pairs off the queue
-                while not snmpWalk.queue.empty():
-                    (oid, value) = snmpWalk.queue.get()
-                    (mibName, oidBase, lastOctet) = snmpWalk.extractOidParts(oid)
+        Returns
+        -------
+        A generator of (index, dictionary for a LogEntry), in index order.
+        It raises SNMPError at the end of a column whose walk failed, so
+        a log that was only partly read is not taken for the whole log
+        """
+        # Start both walks, they run at the same time
+        oids = ['BLADE-MIB::readEnhancedEventLogAttribute', 'BLADE-MIB::readEnhancedEventLogMessage']
+        (attributes, messages) = [self.eventLogColumn(SNMPWalk.withConfigFile(self.host, oid))
+                                  for oid in oids]
+        parser = EventLogParser(self.docId, serialNumberToDocId)
+
+        attribute = next(attributes, None)
+        message = next(messages, None)
+
+        # Both columns are in index order, so join them like a merge:
+        # the lower index goes next, with both halves when they match
+        while attribute or message:
+            if message is None or (attribute and attribute[0] <= message[0]):
+                index = attribute[0]
+            else:
+                index = message[0]
+
+            dict = {}
+            if attribute and attribute[0] == index:
+                dict.update(parser.parse(attribute[1]).asDict())
+                attribute = next(attributes, None)
+
+            if message and message[0] == index:
+                value = message[1]
+                match = re.search('^Text:(.*)$', value)
+                if match:
+                    value = match.group(1)
+                dict['message'] = value
+                message = next(messages, None)
+
+            yield (index, dict)
+
+    def eventLogColumn(self, snmpWalk):
+        """
+        Returns
+        -------
+        A generator of (index, value) for one event log column, which
+        raises SNMPError if the walk failed
+        """
+        # Blocks until each oid/value pair arrives
+        for (oid, value) in snmpWalk:
+            (mibName, oidBase, lastOctet) = snmpWalk.extractOidParts(oid)
+            if oidBase != 'readEnhancedEventLogNumber' and lastOctet:
+                yield (int(lastOctet), value)
 
-                    if oidBase != 'readEnhancedEventLogNumber':
-                        # Start with an empty dictionary
-                        dict = {}
+        # A walk that failed ends early, like one that reached the end
+        if snmpWalk.error is not None:
+            raise SNMPError('%s: %s' % (self.name, snmpWalk.error))
 
-                        # Get the existing log entry, if it exists
-                        if log.has_key(lastOctet):
-                            dict = log[lastOctet]
+    def collectAndClearEventLog(self, couch):
+        """
+        Store the event log as LogEntry documents, eventLogBatchSize at a
+        time, and clear it once every entry is read and stored. Entries have
+        docIds made from the entry, see LogEntry.eventDocId(), so the
+        entries of a log that was not cleared are not stored twice
+        """
+        if not self.eventLogChanged:
+            Log.info('%s event log unchanged, not walking it' % self.name)
+            return
 
-                        # Update the dictionary with this line from the snmpwalk
-                        if oidBase == 'readEnhancedEventLogAttribute':
-                            dict.update(self.parseEventLogAttribute(value, serialNumberToDocId))
-                        else:
-                            match = re.search('^Text:(.*)$', value)
-                            if match:
-                                value = match.group(1)
+        # Get the mapping of blade serial numbers to blade document ids
+        serialNumberToDocId = EventLogParser.serialNumbers(couch)
 
-                            dict.update({'message': value})
+        entries = 0
+        batch = []
+        failures = 0
+        walkError = None
 
-                        # Update the log entry list
-                        log[lastOctet] = dict
+        try:
+            # Identical events in the same second are numbered, the
+            # way bc_trapd numbers their traps
+            occurrences = {}
+            for (index, dict) in self.eventLog(serialNumberToDocId):
+                dict.setdefault('chassisDocId', self.docId)
+                docId = LogEntry.eventDocId(dict, index)
+                occurrences[docId] = occurrences.get(docId, 0) + 1
+                batch.append(LogEntry(dict, LogEntry.eventDocId(dict, index, occurrences[docId])))
+                entries = entries + 1
+
+                if len(batch) >= self.eventLogBatchSize:
+                    failures = failures + self.persistEventLog(couch, batch)
+                    batch = []
+        except SNMPError as e:
+            walkError = e
+
+        failures = failures + self.persistEventLog(couch, batch)
+
+        if walkError is not None:
+            Log.error('Event log walk of %s failed after %d entries, not clearing the log: %s' %
+                      (self.name, entries, walkError))
+            return
+
+        if failures:
+            Log.error('%d of %d system log entries from %s not stored, not clearing the log' %
+                      (failures, entries, self.name))
+            return
+
+        Log.info('%s system log entries collected from %s' % (entries, self.name))
+
+        (output, exitcode) = self.snmp.set('BLADE-MIB::clearEventLog.0', 'i', '1')
+        if exitcode:
+            Log.error('Unable to clear the event log of %s' % self.name)
+            return
+
+        # Remember the log as cleared, so the next run only walks it if it
+        # grows. Until now the stored indicators are the ones from before
+        # the walk, so a run that fails above walks the log again
+        self.saveEventLogIndicators(couch)
+
+    def persistEventLog(self, couch, logEntries):
+        """
+        Create log entries with one request. Entries stored by an earlier
+        run are left as they are
 
-                        # On the final snmp walk command, create CouchDB objects
-                        if dict and oidBase == 'readEnhancedEventLogMessage':
-                            logEntry = LogEntry(dict)
-                            logEntry.persist(couch)
+        Returns
+        -------
+        The number of entries that could not be stored
+        """
+        results = LogEntry.persistNew(couch, logEntries, create = True)
+        return len([row for row in results if row.has_key(u'error') and row[u'error'] != u'conflict'])
 
-            # Join snmpwalk background thread
-            snmpWalk.join()
-        
-        snmp = SNMP.withConfigFile(self.host)
-        snmp.set('BLADE-MIB::clearEventLog.0', 'i', '1')
+    def saveEventLogIndicators(self, couch):
+        """
+        Read the event log change indicators and store them with the
+        chassis document
+        """
+        oids = self.changeOidDict
+        values = self.snmp.scalars([oids['eventLogHead'], oids['eventLogNext']])
+        if values is None:
+            return
+
+        params = {}
+        for attr in ['eventLogHead', 'eventLogNext']:
+            params[attr] = values.get(oids[attr], None)
+            setattr(self, attr, params[attr])
 
-        Log.info('%s system log entries collected from %s' % (len(log), self.name))
+        couch.saveDocument(self.docId, params)
         
     @property
     def name(self):
@@ -943,9 +1608,12 @@ class Chassis (CouchDoc):
             An array attributes that will be persisted to CouchDB
         """
         oidAttr = self.chassisOidDict.keys()
-        attr = ['num', 'name', 'host', 'firstNode', 'lastNode', 'isPingable', 'collectedSNMP', 'fanPackState', 'fanPackAverageSpeed', 'fanPackControllerState', 'fanPackCount', 'fanPackAverageSpeedRPM']
+        attr = ['num', 'name', 'host', 'firstNode', 'lastNode', 'isPingable', 'collectedSNMP', 'fanPackState', 'fanPackAverageSpeed', 'fanPackControllerState', 'fanPackCount', 'fanPackAverageSpeedRPM', 'walkedAt']
 
         attr.extend(oidAttr)
+        # eventLogHead and eventLogNext are only stored once the log they
+        # describe is stored and cleared, see saveEventLogIndicators()
+        attr.append('bootedAt')
         return attr
 
     @property
@@ -969,6 +1637,20 @@ class Chassis (CouchDoc):
                 'informationLED':             'BLADE-MIB::informationLED.0',
         }
 
+    @property
+    def changeOidDict(self):
+        """
+        Returns
+        -------
+        A dictionary of chassis document keys that maps to SNMP OIDs
+        that are cheap to read and show whether anything changed,
+        along with bladesInstalled and bladesCommunicating
+        """
+        return {'sysUpTime':    '.1.3.6.1.2.1.1.3.0',
+                'eventLogHead': 'BLADE-MIB::readEnhancedEventLogAttribute.1',
+                'eventLogNext': 'BLADE-MIB::readEnhancedEventLogAttribute.2',
+        }
+
     @classmethod
     def allBladesFailToNetboot(cls, couch):
         """
@@ -986,11 +1668,14 @@ class Chassis (CouchDoc):
 
         results = couch.getView('blade', 'failed_netboot')
 
+        # The slots of all failed blades, in one request
+        slotInfos = Slot.retrieveManyWithMac(couch, results.keys())
+
         chassis = {}
         failedChassis = []
 
         for bladeDocId in results:
-            slotInfo = Slot.retrieveWithMac(couch, bladeDocId)
+            slotInfo = slotInfos.get(bladeDocId, None)
 
             chassisDocId = None
             slotNum = None
@@ -0,0 +1,221 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import re
+from nmc_probe.command import StreamingCommand
+
+class OutputParser:
+    """
+    Extracts attributes from line oriented command output, such as
+    smartctl -a or hdparm -I.
+
+    The parser is built from a spec: a list of (attribute, pattern, convert)
+    tuples. All patterns are compiled once into a single regular expression,
+    so each line costs one regex call no matter how many attributes are
+    being looked for. Patterns are anchored at the start of the line, the
+    same as re.match(), and the first group of a pattern is the value. A
+    pattern without groups sets its attribute to True. Patterns must not
+    use numbered backreferences, since their group numbers shift when
+    they are combined.
+
+    convert is None, 'strip', 'int', 'float' or any callable taking a string.
+
+    The first line that matches an attribute wins, and parsing stops as
+    soon as every requested attribute has been found. When run() is used,
+    that also stops the command.
+
+    Example
+    -------
+    parser = OutputParser([
+        ('serial_number', '^\s*Serial Number:\s*(.*)$', 'strip'),
+        ('size_mb',       '^\s*device size with M = 1024\*1024:\s*(\d+)', 'int'),
+    ])
+    attrs = parser.run(['/usr/sbin/hdparm', '-I', '/dev/sda'])
+    """
+    converters = {
+        None:    None,
+        'strip': lambda value: value.strip(),
+        'int':   int,
+        'float': float,
+    }
+
+    def __init__(self, spec):
+        """
+        Constructor
+
+        Params
+        ------
+        spec : array
+               List of (attribute, pattern, convert) tuples
+        """
+        self.spec = spec
+        self.compiled = {}
+
+    @property
+    def attributes(self):
+        """
+        Returns
+        -------
+        The names of all attributes in the spec
+        """
+        return [attr for (attr, pattern, convert) in self.spec]
+
+    def compile(self, attrs = None):
+        """
+        Build the dispatch structure for a set of attributes. Results are
+        memoized, so this only happens once per attribute set
+
+        Params
+        ------
+        attrs : array
+                The attributes to look for, None for all of them
+
+        Returns
+        -------
+        A tuple (prefilter, combined, dispatch). prefilter matches any line
+        that at least one pattern matches. combined has one optional
+        lookahead per pattern, so a single match captures every pattern
+        that applies to the line. dispatch lists (outer group, value group,
+        attribute, converter) for each pattern
+        """
+        key = None
+        if attrs is not None:
+            key = frozenset(attrs)
+
+        compiled = self.compiled.get(key, None)
+        if compiled is not None:
+            return compiled
+
+        alternatives = []
+        lookaheads = []
+        dispatch = []
+        group = 1
+
+        for (attr, pattern, convert) in self.spec:
+            if key is not None and attr not in key:
+                continue
+
+            if callable(convert):
+                converter = convert
+            else:
+                converter = OutputParser.converters[convert]
+
+            numGroups = re.compile(pattern).groups
+            valueGroup = None
+            if numGroups >= 1:
+                valueGroup = group + 1
+
+            alternatives.append('(?:%s)' % pattern)
+            lookaheads.append('(?:(?=(%s)))?' % pattern)
+            dispatch.append((group, valueGroup, attr, converter))
+            group = group + 1 + numGroups
+
+        compiled = (re.compile('|'.join(alternatives)),
+                    re.compile(''.join(lookaheads)),
+                    dispatch)
+        self.compiled[key] = compiled
+        return compiled
+
+    def parse(self, lines, attrs = None):
+        """
+        Parse lines of output
+
+        Params
+        ------
+        lines : iterable
+                Lines of output. May be a generator; it is not consumed
+                past the point where every attribute has been found
+        attrs : array
+                The attributes to look for, None for all of them
+
+        Returns
+        -------
+        A dictionary of attribute => converted value
+        """
+        (prefilter, combined, dispatch) = self.compile(attrs)
+        values = {}
+
+        if lines is None:
+            return values
+
+        wanted = len(set([attr for (outer, value, attr, converter) in dispatch]))
+        prefilterMatch = prefilter.match
+        combinedMatch = combined.match
+
+        for line in lines:
+            if prefilterMatch(line) is None:
+                continue
+
+            match = combinedMatch(line)
+            for (outerGroup, valueGroup, attr, converter) in dispatch:
+                if attr in values or match.group(outerGroup) is None:
+                    continue
+
+                if valueGroup is None:
+                    values[attr] = True
+                else:
+                    value = match.group(valueGroup)
+                    if converter is not None:
+                        value = converter(value)
+                    values[attr] = value
+
+            if len(values) >= wanted:
+                break
+
+        return values
+
+    def run(self, args, attrs = None):
+        """
+        Run a command and parse its output as it streams in. The command
+        is stopped once every requested attribute has been found, unless
+        its output is being recorded or cached, see StreamingCommand.lines()
+
+        Params
+        ------
+        args  : array
+                The command and its arguments
+        attrs : array
+                The attributes to look for, None for all of them
+
+        Returns
+        -------
+        A dictionary of attribute => converted value
+        """
+        lines = StreamingCommand(args).lines()
+        try:
+            return self.parse(lines, attrs)
+        finally:
+            lines.close()
@@ -0,0 +1,380 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import time
+
+from nmc_probe.log import Log
+from nmc_probe.scheduler import HostScheduler
+
+class SlotPower:
+    """
+    The progress of one slot through a PowerOrchestrator operation
+
+    Attributes
+    ----------
+    chassis     : Chassis
+    slot        : int
+    operation   : string
+                  on, off or softoff
+    wave        : int
+                  The wave the slot was sent in, counting from 1
+    accepted    : bool
+                  Whether the AMM accepted the SET, None until it is sent
+    answered    : bool
+                  Whether the chassis answered a power state read
+    state       : int
+                  The last power state read, see Chassis.slotPowerStates(),
+                  None for an empty bay
+    sentAt      : float
+                  When the SET was sent
+    convergedAt : float
+                  When the slot was first seen in the expected state
+    timedOut    : bool
+                  Whether the slot never reached the expected state
+    settledAt   : float
+                  When the SET was rejected or the slot timed out
+    """
+    def __init__(self, chassis, slot, operation):
+        self.chassis = chassis
+        self.slot = slot
+        self.operation = operation
+        self.wave = None
+        self.accepted = None
+        self.answered = False
+        self.state = None
+        self.sentAt = None
+        self.convergedAt = None
+        self.timedOut = False
+        self.settledAt = None
+
+    @property
+    def name(self):
+        return '%s:slot-%02d' % (self.chassis.name, self.slot)
+
+    @property
+    def status(self):
+        """
+        Returns
+        -------
+        unreachable, absent, already, rejected, converged, timeout or pending
+        """
+        if self.accepted is None:
+            if self.convergedAt is not None:
+                return 'already'
+            if not self.answered:
+                return 'unreachable'
+            if self.state is None:
+                # The chassis answered, but has no blade in this slot
+                return 'absent'
+            return 'pending'
+        if not self.accepted:
+            return 'rejected'
+        if self.convergedAt is not None:
+            return 'converged'
+        if self.timedOut:
+            return 'timeout'
+        return 'pending'
+
+    @property
+    def succeeded(self):
+        return self.status in ('already', 'converged')
+
+    @property
+    def failed(self):
+        """
+        True if the slot did not reach the new state. Empty bays are
+        not failures
+        """
+        return self.status not in ('already', 'converged', 'absent')
+
+    @property
+    def elapsed(self):
+        """
+        Returns
+        -------
+        Seconds from the SET until the slot converged or gave up, None
+        if no SET was sent
+        """
+        if self.sentAt is None:
+            return None
+        if self.convergedAt is not None:
+            return self.convergedAt - self.sentAt
+        if self.settledAt is not None:
+            return self.settledAt - self.sentAt
+        return time.time() - self.sentAt
+
+class PowerOrchestrator:
+    """
+    Applies a power operation to slots across many chassis, and follows
+    each slot until the AMM reports it in the new state or it times out.
+
+    Powering on is sent in waves of waveSize slots, waveInterval seconds
+    apart, to limit inrush current. A wave takes slots from every chassis
+    in turn, so no one chassis powers up many blades at once. Power off
+    draws no inrush and is sent in one wave.
+
+    Each chassis gets one SET per wave and, every pollInterval seconds,
+    one GET of remoteControlBladePowerState for its unsettled slots,
+    limit chassis at a time.
+
+    Example
+    -------
+    orchestrator = PowerOrchestrator(waveSize = 56, waveInterval = 5)
+    results = orchestrator.run('cycle', [(chassis, None) for chassis in chassisList])
+    PowerOrchestrator.printTable(results)
+    """
+    # Power function sent, and the power state that means it took effect
+    functions = {'off':     (0, 0),
+                 'on':      (1, 1),
+                 'softoff': (2, 0)}
+
+    def __init__(self, waveSize = 56, waveInterval = 5.0, timeout = 300.0,
+                 pollInterval = 2.0, limit = 16):
+        """
+        Constructor
+
+        Params
+        ------
+        waveSize     : int
+                       Slots to power on at the same time, across all chassis
+        waveInterval : float
+                       Seconds between waves
+        timeout      : float
+                       Seconds a slot has to reach the new state after its SET
+        pollInterval : float
+                       Seconds between power state reads
+        limit        : int
+                       Chassis to talk to at the same time
+        """
+        self.waveSize = waveSize
+        self.waveInterval = waveInterval
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.limit = limit
+
+    def run(self, operation, targets):
+        """
+        Apply a power operation
+
+        Params
+        ------
+        operation : string
+                    on, off, softoff or cycle. cycle powers the slots off,
+                    then powers on the slots that went from on to off.
+                    Slots that were already off are left off
+        targets   : array
+                    (chassis, slots) tuples, slots are slot numbers, all 14
+                    if None
+
+        Returns
+        -------
+        An array of SlotPower, in the order the operations were applied.
+        A cycle has an off entry for each slot, and an on entry for each
+        slot that powered off
+        """
+        slots = self.interleave(targets)
+
+        if operation != 'cycle':
+            return self.apply(operation, slots)
+
+        offResults = self.apply('off', slots)
+        onResults = self.apply('on', [(result.chassis, result.slot)
+                                      for result in offResults if result.status == 'converged'])
+        return offResults + onResults
+
+    def interleave(self, targets):
+        """
+        Returns
+        -------
+        (chassis, slot) tuples, taking the first slot of every chassis,
+        then the second, and so on
+        """
+        slotLists = [[(chassis, slot) for slot in (slots or range(1, 15))]
+                     for (chassis, slots) in targets]
+
+        interleaved = []
+        for i in xrange(max([0] + [len(slotList) for slotList in slotLists])):
+            for slotList in slotLists:
+                if i < len(slotList):
+                    interleaved.append(slotList[i])
+        return interleaved
+
+    def apply(self, operation, slots):
+        """
+        Apply one power function to slots, see run()
+        """
+        (func, expected) = self.functions[operation]
+        results = [SlotPower(chassis, slot, operation) for (chassis, slot) in slots]
+        started = time.time()
+
+        # Slots already in the expected state need no SET, slots whose
+        # chassis does not answer can't be powered
+        self.poll(results, expected)
+        toSend = [result for result in results if result.status == 'pending']
+
+        waveSize = len(toSend) or 1
+        if operation == 'on' and self.waveSize:
+            waveSize = self.waveSize
+        waves = [toSend[i:i + waveSize] for i in xrange(0, len(toSend), waveSize)]
+
+        Log.info('%s: %d slots, %d already %s, %d unreachable, %d empty, %d waves' %
+                 (operation, len(results),
+                  len([result for result in results if result.status == 'already']),
+                  operation, len([result for result in results if result.status == 'unreachable']),
+                  len([result for result in results if result.status == 'absent']),
+                  len(waves)))
+
+        pending = []
+        nextWave = 0
+        nextWaveAt = time.time()
+
+        while nextWave < len(waves) or pending:
+            if nextWave < len(waves) and time.time() >= nextWaveAt:
+                self.send(waves[nextWave], func, nextWave + 1)
+                pending.extend([result for result in waves[nextWave] if result.accepted])
+                nextWave = nextWave + 1
+                nextWaveAt = time.time() + self.waveInterval
+
+            wake = time.time() + self.pollInterval
+            if nextWave < len(waves):
+                wake = min(wake, nextWaveAt)
+            time.sleep(max(0.0, wake - time.time()))
+
+            if pending:
+                self.poll(pending, expected)
+
+                now = time.time()
+                for result in pending:
+                    if result.convergedAt is None and now - result.sentAt >= self.timeout:
+                        result.timedOut = True
+                        result.settledAt = now
+                pending = [result for result in pending if result.status == 'pending']
+
+        Log.info('%s: %d of %d slots succeeded in %.1fs' %
+                 (operation, len([result for result in results if result.succeeded]),
+                  len(results), time.time() - started))
+        return results
+
+    def byChassis(self, results):
+        """
+        Returns
+        -------
+        An array of (chassis, array of SlotPower) tuples
+        """
+        groups = {}
+        order = []
+        for result in results:
+            if not groups.has_key(result.chassis.name):
+                groups[result.chassis.name] = (result.chassis, [])
+                order.append(result.chassis.name)
+            groups[result.chassis.name][1].append(result)
+        return [groups[name] for name in order]
+
+    def send(self, wave, func, waveNum):
+        """
+        Send power function func to the slots in a wave, one SET per chassis
+        """
+        Log.info('Wave %d: power function %d to %d slots' % (waveNum, func, len(wave)))
+
+        scheduler = HostScheduler(self.limit, 1)
+        jobs = []
+        for (chassis, results) in self.byChassis(wave):
+            job = scheduler.submit(chassis.host, chassis.name, chassis.powerOnOffSlots,
+                                   [result.slot for result in results], func)
+            jobs.append((results, job))
+        scheduler.run()
+
+        for (results, job) in jobs:
+            accepted = job.result or {}
+            for result in results:
+                result.wave = waveNum
+                result.sentAt = job.started
+                result.accepted = accepted.get(result.slot, False)
+                if not result.accepted:
+                    result.settledAt = time.time()
+
+    def poll(self, results, expected):
+        """
+        Read the power state of slots, one GET per chassis, and note the
+        slots that reached the expected state
+        """
+        scheduler = HostScheduler(self.limit, 1)
+        jobs = []
+        for (chassis, chassisResults) in self.byChassis(results):
+            job = scheduler.submit(chassis.host, chassis.name, chassis.slotPowerStates,
+                                   [result.slot for result in chassisResults])
+            jobs.append((chassisResults, job))
+        scheduler.run()
+
+        for (chassisResults, job) in jobs:
+            if job.result is None:
+                continue
+            # The state was read when the GET was answered
+            readAt = job.started + job.elapsed
+            for result in chassisResults:
+                result.answered = True
+                result.state = job.result.get(result.slot)
+                if result.state == expected and result.convergedAt is None:
+                    result.convergedAt = readAt
+
+    @classmethod
+    def printTable(cls, results):
+        """
+        Print one line per slot: operation, wave, status, seconds and state
+
+        Returns
+        -------
+        The number of slots that failed, empty bays are not counted
+        """
+        print '%-24s %-8s %4s %-11s %7s %5s' % ('slot', 'op', 'wave', 'result', 'seconds', 'state')
+
+        failed = 0
+        for result in results:
+            elapsed = '-'
+            if result.elapsed is not None:
+                elapsed = '%.1f' % result.elapsed
+
+            state = '-'
+            if result.state is not None:
+                state = str(result.state)
+
+            print '%-24s %-8s %4s %-11s %7s %5s' % (result.name, result.operation,
+                                                    result.wave or '-', result.status,
+                                                    elapsed, state)
+            if result.failed:
+                failed = failed + 1
+
+        return failed
@@ -0,0 +1,155 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import os
+from nmc_probe.log import Log
+
+proc_cpuinfo_fn = '/proc/cpuinfo'
+proc_meminfo_fn = '/proc/meminfo'
+sys_net_dir = '/sys/class/net'
+sys_edac_dir = '/sys/devices/system/edac/mc'
+
+class Inventory:
+    '''Reads the hardware inventory of this computer straight from
+    /proc and /sys, without starting any processes
+
+    { 'numCPUs':   integer, processors in /proc/cpuinfo
+      'memory':    string, MemTotal in kB, the total column of free
+      'mac0':      string, the address of eth0
+      'dimmCount': integer, populated DIMMs EDAC knows of, None without EDAC
+      'nicSpeeds': { interface: integer, Mb/s, None when the link is down }
+    }'''
+
+    @classmethod
+    def info(cls):
+        '''Gather the whole inventory, return the hash'''
+        nics = cls.nics()
+
+        return {
+            'numCPUs':   cls.numCPUs(),
+            'memory':    cls.memory(),
+            'mac0':      cls.mac0(nics),
+            'dimmCount': cls.dimmCount(),
+            'nicSpeeds': dict([(name, speed) for (name, (address, speed)) in nics.items()]),
+        }
+
+    @classmethod
+    def numCPUs(cls):
+        '''Count the processors in /proc/cpuinfo'''
+        count = 0
+        with open(proc_cpuinfo_fn, 'r') as fh:
+            for line in fh:
+                if line.startswith('processor') and line[9:].lstrip(' \t').startswith(':'):
+                    count = count + 1
+        return count
+
+    @classmethod
+    def memory(cls):
+        '''MemTotal from /proc/meminfo, in kB, as a string'''
+        with open(proc_meminfo_fn, 'r') as fh:
+            for line in fh:
+                if line.startswith('MemTotal:'):
+                    return line.split()[1]
+        return None
+
+    @classmethod
+    def read(cls, path):
+        '''The stripped contents of a sysfs attribute, None if it can't be read'''
+        try:
+            with open(path, 'r') as fh:
+                return fh.read().strip()
+        except (IOError, OSError):
+            # Attributes like speed can't be read while the link is down
+            return None
+
+    @classmethod
+    def nics(cls):
+        '''Map each physical network interface to (address, speed in Mb/s)'''
+        nics = {}
+        for name in os.listdir(sys_net_dir):
+            path = os.path.join(sys_net_dir, name)
+
+            # Virtual interfaces, like lo and bridges, have no device
+            if not os.path.exists(os.path.join(path, 'device')) and name != 'eth0':
+                continue
+
+            speed = cls.read(os.path.join(path, 'speed'))
+            if speed is not None and speed.isdigit():
+                speed = int(speed)
+            else:
+                speed = None
+
+            nics[name] = (cls.read(os.path.join(path, 'address')), speed)
+
+        return nics
+
+    @classmethod
+    def mac0(cls, nics = None):
+        '''The address of eth0, or of the first physical interface if
+        there is no eth0'''
+        if nics is None:
+            nics = cls.nics()
+
+        if nics.has_key('eth0'):
+            return nics['eth0'][0]
+
+        if nics:
+            name = sorted(nics.keys())[0]
+            Log.debug(5, 'No eth0, using the address of %s' % name)
+            return nics[name][0]
+
+        return None
+
+    @classmethod
+    def dimmCount(cls):
+        '''Count the populated DIMMs the EDAC memory controllers report'''
+        if not os.path.isdir(sys_edac_dir):
+            return None
+
+        count = 0
+        for mc in os.listdir(sys_edac_dir):
+            mcPath = os.path.join(sys_edac_dir, mc)
+            if not mc.startswith('mc') or not os.path.isdir(mcPath):
+                continue
+
+            for entry in os.listdir(mcPath):
+                # dimmN on newer kernels, rankN when the controller reports ranks
+                if entry.startswith('dimm') or entry.startswith('rank'):
+                    size = cls.read(os.path.join(mcPath, entry, 'size'))
+                    if size is not None and size.isdigit() and int(size) > 0:
+                        count = count + 1
+
+        return count
@@ -0,0 +1,197 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import threading, time
+from nmc_probe.log import Log
+
+class HostHealth:
+    """
+    What has been seen of one host
+
+    Attributes
+    ----------
+    failures  : int
+                Requests in a row that went unanswered
+    openUntil : float
+                time.time() before which requests to the host are skipped
+    srtt      : float
+                Smoothed round trip time in seconds, None until measured
+    rttvar    : float
+                Round trip time variation in seconds
+    lastSeen  : float
+                time.time() of the last answer, None if never answered
+    """
+    def __init__(self):
+        self.failures = 0
+        self.openUntil = 0
+        self.srtt = None
+        self.rttvar = None
+        self.lastSeen = None
+
+class CircuitBreaker:
+    """
+    Tracks which hosts answer and how quickly. A host that leaves
+    threshold requests in a row unanswered is skipped for a cooldown,
+    which doubles every time a request after the cooldown fails too.
+    Timeouts for hosts that answer follow their round trip time, the
+    way TCP computes its retransmission timeout (RFC 6298)
+
+    Example
+    -------
+    breaker = CircuitBreaker.shared()
+    if breaker.allow(host):
+        timeout = breaker.timeout(host, 10.0)
+        ...
+        breaker.succeeded(host, rtt)
+    """
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, threshold = 2, cooldown = 30.0, maxCooldown = 600.0, minTimeout = 0.5):
+        """
+        Constructor
+
+        Params
+        ------
+        threshold   : int
+                      Unanswered requests in a row before a host is skipped
+        cooldown    : float
+                      Seconds to skip a host the first time
+        maxCooldown : float
+                      Most seconds to skip a host
+        minTimeout  : float
+                      Shortest timeout timeout() returns
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxCooldown = maxCooldown
+        self.minTimeout = minTimeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns
+        -------
+        The process wide circuit breaker
+        """
+        with cls._sharedLock:
+            if cls._shared is None:
+                cls._shared = cls()
+        return cls._shared
+
+    def health(self, host):
+        """
+        Returns
+        -------
+        The HostHealth of a host, call with the lock held
+        """
+        if not self.hosts.has_key(host):
+            self.hosts[host] = HostHealth()
+        return self.hosts[host]
+
+    def allow(self, host):
+        """
+        Returns
+        -------
+        False while a host is being skipped
+        """
+        with self.lock:
+            return self.health(host).openUntil <= time.time()
+
+    def succeeded(self, host, rtt = None):
+        """
+        Record an answer from a host
+
+        Params
+        ------
+        rtt : float
+              Seconds the request took. Leave it out for requests that
+              were resent, since the answer may be to an earlier copy
+        """
+        with self.lock:
+            health = self.health(host)
+            if health.openUntil:
+                Log.info('%s is answering again' % host)
+            health.failures = 0
+            health.openUntil = 0
+            health.lastSeen = time.time()
+
+            if rtt is not None:
+                if health.srtt is None:
+                    health.srtt = rtt
+                    health.rttvar = rtt / 2
+                else:
+                    health.rttvar = 0.75 * health.rttvar + 0.25 * abs(health.srtt - rtt)
+                    health.srtt = 0.875 * health.srtt + 0.125 * rtt
+
+    def failed(self, host):
+        """
+        Record a request the host never answered
+        """
+        with self.lock:
+            health = self.health(host)
+            health.failures = health.failures + 1
+            if health.failures >= self.threshold:
+                cooldown = min(self.cooldown * 2 ** (health.failures - self.threshold), self.maxCooldown)
+                health.openUntil = time.time() + cooldown
+                Log.info('%s is not answering, skipping it for %ds' % (host, cooldown))
+
+    def timeout(self, host, limit, attempt = 0):
+        """
+        Returns
+        -------
+        Seconds to wait for an answer: four deviations past the
+        smoothed round trip time, doubled for every resend, but no more
+        than limit. Hosts without a measurement get limit
+        """
+        with self.lock:
+            health = self.health(host)
+            if health.srtt is None:
+                return limit
+            timeout = max(health.srtt + 4 * health.rttvar, self.minTimeout)
+        return min(timeout * 2 ** attempt, limit)
+
+    def isUp(self, host, maxAge):
+        """
+        Returns
+        -------
+        True if the host answered in the last maxAge seconds
+        """
+        with self.lock:
+            health = self.health(host)
+            return health.lastSeen is not None and time.time() - health.lastSeen <= maxAge
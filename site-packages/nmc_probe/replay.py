@@ -0,0 +1,372 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+#
+# Record, replay and scale fixtures of the external tools nmc_probe runs
+# through Command, like sas2ircu, hdparm and smartctl
+#
+# Record a run:
+#   NMC_PROBE_RECORD=/tmp/fixtures jbod_list_disks
+#
+# Replay it offline, every tool is served from /tmp/fixtures:
+#   NMC_PROBE_REPLAY=/tmp/fixtures jbod_list_disks
+#
+# Scale a recorded sas2ircu run up to 4 controllers with 240 disks each:
+#   replay.py scale-disks -c 4 -d 240 /tmp/fixtures /tmp/jbod
+#
+# Copy fixtures of a tool that takes a host argument for 48 hosts:
+#   replay.py scale-hosts -c 48 -f 10.0.0.%d /tmp/fixtures /tmp/fleet 10.0.0.12
+#
+# SNMP is spoken natively and runs no tools, so chassis collection leaves
+# nothing to record. Serve a saved walk of a chassis with snmp_agent.py
+# instead, see that file
+
+import os, sys, re, getopt
+
+if __name__ == '__main__':
+    # Run as a script by Command in replay mode, make the package importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nmc_probe.fixture import Fixture
+
+# Exit code of a shell asked to run a command that does not exist
+MISSING_EXITCODE = 127
+
+def serve(directory, args):
+    """
+    Stand in for a tool: write the recorded standard output and error
+    for an argument list and return the recorded exit code
+
+    Returns
+    -------
+    The exit code
+    """
+    fixture = Fixture.load(directory, args)
+
+    if fixture is None:
+        sys.stderr.write('No fixture for %s in %s\n' % (' '.join(args), directory))
+        return MISSING_EXITCODE
+
+    sys.stdout.write(fixture.stdout)
+    sys.stderr.write(fixture.stderr)
+    return fixture.exitcode
+
+def scaleHosts(src, dst, host, count, hostFormat):
+    """
+    Copy every fixture that mentions a host once for each of count
+    hosts, for example to turn a single recorded chassis into a fleet.
+    Fixtures that do not mention the host are copied unchanged
+
+    Params
+    ------
+    src        : string
+                 Directory of recorded fixtures
+    dst        : string
+                 Directory to write the scaled fixtures to
+    host       : string
+                 The host the fixtures were recorded against
+    count      : int
+                 Number of hosts to generate
+    hostFormat : string
+                 Format for the generated hosts, given 1 through count
+
+    Returns
+    -------
+    The number of fixtures written
+    """
+    written = 0
+
+    for fixture in Fixture.all(src):
+        if host not in fixture.args:
+            fixture.save(dst)
+            written = written + 1
+            continue
+
+        for num in xrange(1, count + 1):
+            name = hostFormat % num
+            args = [name if arg == host else arg for arg in fixture.args]
+            Fixture(args, fixture.exitcode,
+                    fixture.stdout.replace(host, name),
+                    fixture.stderr.replace(host, name)).save(dst)
+            written = written + 1
+
+    return written
+
+def scaleDisks(src, dst, controllers, disks):
+    """
+    Generate sas2ircu fixtures for a number of identical controllers,
+    each with a number of disks, from a recording of one controller.
+    The first disk recorded is the template for every generated disk,
+    which are spread evenly over the recorded enclosures
+
+    Params
+    ------
+    src         : string
+                  Directory of recorded fixtures
+    dst         : string
+                  Directory to write the scaled fixtures to
+    controllers : int
+                  Number of controllers to generate
+    disks       : int
+                  Number of disks to generate on each controller
+
+    Returns
+    -------
+    The number of fixtures written
+    """
+    listing = None
+    display = None
+
+    for fixture in Fixture.all(src):
+        if os.path.basename(fixture.args[0]) != 'sas2ircu':
+            continue
+        if len(fixture.args) == 2 and fixture.args[1].lower() == 'list':
+            listing = fixture
+        elif len(fixture.args) == 3 and fixture.args[2].lower() == 'display':
+            if display is None or fixture.args[1] < display.args[1]:
+                display = fixture
+
+    if listing is None or display is None:
+        raise ValueError('%s needs a recording of sas2ircu list and sas2ircu display' % src)
+
+    scaleControllerList(listing, controllers).save(dst)
+
+    for index in xrange(controllers):
+        scaleControllerDisplay(display, index, disks).save(dst)
+
+    return controllers + 1
+
+def scaleControllerList(listing, controllers):
+    """
+    Returns
+    -------
+    A sas2ircu list fixture with the first recorded controller repeated,
+    each copy on its own PCI bus
+    """
+    lines = listing.stdout.split('\n')
+    rows = [i for (i, line) in enumerate(lines) if re.match('^\s+[0-9]+\s+\w+.*', line)]
+
+    if not rows:
+        raise ValueError('No controllers in %s' % ' '.join(listing.args))
+
+    template = lines[rows[0]]
+    generated = []
+    for index in xrange(controllers):
+        line = re.sub('^(\s+)[0-9]+', lambda m: '%s%d' % (m.group(1), index), template)
+        line = re.sub('([0-9a-fA-F]+h):([0-9a-fA-F]+)h:', lambda m: '%s:%02xh:' % (m.group(1), index + 1), line, 1)
+        generated.append(line)
+
+    lines[rows[0]:rows[-1] + 1] = generated
+    return Fixture(listing.args, listing.exitcode, '\n'.join(lines), listing.stderr)
+
+def scaleControllerDisplay(display, index, disks):
+    """
+    Returns
+    -------
+    A sas2ircu display fixture for one generated controller
+    """
+    (head, blocks, tail) = splitDeviceBlocks(display.stdout.split('\n'))
+
+    template = None
+    enclosures = []
+    for block in blocks:
+        if block[0].startswith('Device is a Hard disk'):
+            if template is None:
+                template = block
+        elif block[0].startswith('Device is a Enclosure services device'):
+            enclosures.append(blockField(block, 'Enclosure #'))
+
+    if template is None:
+        raise ValueError('No disks in %s' % ' '.join(display.args))
+
+    if not enclosures:
+        enclosures = [blockField(template, 'Enclosure #')]
+
+    perEnclosure = (disks + len(enclosures) - 1) / len(enclosures)
+    serial = blockField(template, 'Serial No')
+
+    generated = []
+    for num in xrange(disks):
+        unique = (index << 16) | num
+        generated.append(setBlockFields(template, {
+            'Enclosure #': enclosures[num / perEnclosure],
+            'Slot #':      '%d' % (num % perEnclosure),
+            'Serial No':   '%s%06x' % (serial[:-6], unique),
+            'SAS Address': '5000c50-0-%04x-%04x' % (index, num),
+            'GUID':        '5000c500%08x' % unique,
+        }))
+
+    # Enclosures first, as sas2ircu lists them, then the generated disks
+    others = [block for block in blocks if not block[0].startswith('Device is a Hard disk')]
+    lines = head
+    for block in others + generated:
+        lines = lines + block
+    lines = lines + tail
+
+    args = list(display.args)
+    args[1] = '%d' % index
+    return Fixture(args, display.exitcode, '\n'.join(lines), display.stderr)
+
+def splitDeviceBlocks(lines):
+    """
+    Split sas2ircu display output into the lines before the first device,
+    the lines of each device, and the lines after the last device
+
+    Returns
+    -------
+    A tuple: (head lines, array of device line arrays, tail lines)
+    """
+    head = []
+    blocks = []
+    tail = []
+
+    for line in lines:
+        if line.startswith('Device is a'):
+            blocks.append([line])
+        elif not blocks:
+            head.append(line)
+        elif tail or (line and not line[0].isspace()):
+            # The first unindented line after a device ends the device list
+            tail.append(line)
+        else:
+            blocks[-1].append(line)
+
+    return (head, blocks, tail)
+
+def blockField(block, field):
+    """
+    Returns
+    -------
+    The value of a field in a sas2ircu device block, None if it is missing
+    """
+    for line in block:
+        match = re.match('^\s+%s\s+:\s+(.*?)\s*$' % re.escape(field), line)
+        if match is not None:
+            return match.group(1)
+    return None
+
+def setBlockFields(block, values):
+    """
+    Returns
+    -------
+    A copy of a sas2ircu device block with some field values replaced
+    """
+    copy = []
+    for line in block:
+        for (field, value) in values.iteritems():
+            match = re.match('^(\s+%s\s+:\s+)' % re.escape(field), line)
+            if match is not None:
+                line = match.group(1) + value
+                break
+        copy.append(line)
+    return copy
+
+def usage(progName):
+    print ('%s serve DIR -- COMMAND [ARGS...]' % progName)
+    print ('%s list DIR' % progName)
+    print ('%s scale-hosts [-c count] [-f host format] SRC DST HOST' % progName)
+    print ('%s scale-disks [-c controllers] [-d disks] SRC DST' % progName)
+
+def main(argv):
+    """
+    Program entry point
+
+    Returns
+    -------
+    The exit code
+    """
+    progName = os.path.basename(sys.argv[0])
+
+    if not argv:
+        usage(progName)
+        return 1
+
+    action = argv[0]
+
+    if action == 'serve':
+        if len(argv) < 4 or argv[2] != '--':
+            usage(progName)
+            return 1
+        return serve(argv[1], argv[3:])
+
+    try:
+        optlist, args = getopt.getopt(argv[1:], 'c:d:f:h', ['count=', 'disks=', 'format=', 'help'])
+    except getopt.GetoptError as err:
+        print(err)
+        usage(progName)
+        return 1
+
+    count = 1
+    disks = 24
+    hostFormat = None
+
+    for (opt, value) in optlist:
+        if opt == '--count' or opt == '-c':
+            count = int(value)
+
+        if opt == '--disks' or opt == '-d':
+            disks = int(value)
+
+        if opt == '--format' or opt == '-f':
+            hostFormat = value
+
+        if opt == '--help' or opt == '-h':
+            usage(progName)
+            return 0
+
+    if action == 'list' and len(args) == 1:
+        for fixture in Fixture.all(args[0]):
+            print ('%3d %8d %s' % (fixture.exitcode, len(fixture.stdout), ' '.join(fixture.args)))
+        return 0
+
+    if action == 'scale-hosts' and len(args) == 3:
+        if hostFormat is None:
+            # Number hosts on the same subnet, 10.56.100.12 -> 10.56.100.%d
+            hostFormat = re.sub('[0-9]+$', '%d', args[2])
+        written = scaleHosts(args[0], args[1], args[2], count, hostFormat)
+        print ('Wrote %d fixtures to %s' % (written, args[1]))
+        return 0
+
+    if action == 'scale-disks' and len(args) == 2:
+        written = scaleDisks(args[0], args[1], count, disks)
+        print ('Wrote %d fixtures to %s' % (written, args[1]))
+        return 0
+
+    usage(progName)
+    return 1
+
+# Program entry point
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
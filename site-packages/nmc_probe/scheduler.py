@@ -0,0 +1,224 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import threading, time, traceback
+from nmc_probe.log import Log
+
+class HostJob:
+    """
+    A unit of work against one host
+
+    Attributes
+    ----------
+    host    : string
+              The host the work talks to
+    name    : string
+              A description for logs and the summary
+    started : float
+              time.time() when the job started, None until then
+    elapsed : float
+              Wall clock seconds the job took
+    result  : object
+              What the job returned
+    error   : string
+              The traceback if the job raised, None otherwise
+    """
+    def __init__(self, host, name, func, args):
+        self.host = host
+        self.name = name
+        self.func = func
+        self.args = args
+        self.started = None
+        self.elapsed = None
+        self.result = None
+        self.error = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def run(self):
+        self.started = time.time()
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.error = traceback.format_exc()
+        self.elapsed = time.time() - self.started
+
+class HostScheduler:
+    """
+    Runs jobs against many hosts at once, with a limit on the jobs
+    running in total and on the jobs running against any one host.
+    Jobs start in the order they were submitted, skipping jobs whose
+    host is busy until it is not.
+
+    Example
+    -------
+    scheduler = HostScheduler(limit = 16, perHost = 1)
+    for chassis in chassisList:
+        scheduler.submit(chassis.host, chassis.name, chassis.collectInfoAndPersist, couch)
+    scheduler.run()
+    scheduler.logSummary()
+    """
+    def __init__(self, limit = 8, perHost = 1):
+        """
+        Constructor
+
+        Params
+        ------
+        limit   : int
+                  Most jobs to run at the same time
+        perHost : int
+                  Most jobs to run against one host at the same time
+        """
+        self.limit = limit
+        self.perHost = perHost
+        self.jobs = []
+        self.pending = []
+        self.running = {}
+        self.condition = threading.Condition()
+        self.started = None
+        self.elapsed = None
+
+    def submit(self, host, name, func, *args):
+        """
+        Queue func(*args) to run against host
+
+        Returns
+        -------
+        The HostJob
+        """
+        job = HostJob(host, name, func, args)
+        with self.condition:
+            self.jobs.append(job)
+            self.pending.append(job)
+        return job
+
+    def run(self):
+        """
+        Run every submitted job, returns when all of them are done
+
+        Returns
+        -------
+        The jobs, in the order they were submitted
+        """
+        self.started = time.time()
+
+        workers = [threading.Thread(target=self.work) for i in xrange(min(self.limit, len(self.pending)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        for worker in workers:
+            # A timeout keeps the main thread interruptible by ^C
+            while worker.is_alive():
+                worker.join(1.0)
+
+        self.elapsed = time.time() - self.started
+        return self.jobs
+
+    def next(self):
+        """
+        Wait for a job whose host is not at its limit
+
+        Returns
+        -------
+        The job, None when there is nothing left to run
+        """
+        with self.condition:
+            while self.pending:
+                for (i, job) in enumerate(self.pending):
+                    if self.running.get(job.host, 0) < self.perHost:
+                        del self.pending[i]
+                        self.running[job.host] = self.running.get(job.host, 0) + 1
+                        return job
+                self.condition.wait()
+        return None
+
+    def work(self):
+        while True:
+            job = self.next()
+            if job is None:
+                return
+
+            Log.debug(5, 'Starting %s' % job.name)
+            job.run()
+
+            if job.failed:
+                Log.error('%s failed after %.1fs\n%s' % (job.name, job.elapsed, job.error))
+            else:
+                Log.debug(5, '%s finished in %.1fs' % (job.name, job.elapsed))
+
+            with self.condition:
+                self.running[job.host] = self.running[job.host] - 1
+                self.condition.notify_all()
+
+    def summary(self):
+        """
+        Returns
+        -------
+        A dictionary of the sweep: wall clock seconds, the sum of the
+        job seconds, the slowest job, and the jobs that failed
+        """
+        done = [job for job in self.jobs if job.elapsed is not None]
+        slowest = None
+        if done:
+            slowest = max(done, key=lambda job: job.elapsed)
+
+        return {'jobs':     len(self.jobs),
+                'elapsed':  self.elapsed,
+                'total':    sum([job.elapsed for job in done]),
+                'slowest':  slowest and {'name': slowest.name, 'elapsed': slowest.elapsed},
+                'failures': [{'name': job.name, 'host': job.host, 'elapsed': job.elapsed,
+                              'error': job.error.strip().splitlines()[-1]}
+                             for job in done if job.failed]}
+
+    def logSummary(self):
+        """
+        Log the timing of each job and the summary
+        """
+        for job in sorted(self.jobs, key=lambda job: job.elapsed):
+            Log.info('%-24s %7.1fs %s' % (job.name, job.elapsed or 0.0,
+                                          job.failed and 'FAILED' or 'ok'))
+
+        summary = self.summary()
+        Log.info('%d jobs in %.1fs, %.1fs of work, slowest %s %.1fs' %
+                 (summary['jobs'], summary['elapsed'] or 0.0, summary['total'],
+                  summary['slowest'] and summary['slowest']['name'],
+                  summary['slowest'] and summary['slowest']['elapsed'] or 0.0))
+
+        for failure in summary['failures']:
+            Log.error('%s (%s) failed: %s' % (failure['name'], failure['host'], failure['error']))
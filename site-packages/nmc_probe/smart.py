@@ -34,7 +34,8 @@
 #
 # }}}
 
-from nmc_probe.command import AsyncCommand, Command
+from nmc_probe.command import Command, CommandPool
+from nmc_probe.output_parser import OutputParser
 from nmc_probe.log import Log
 import os
 
@@ -42,6 +43,25 @@ smartctl_cmd='/usr/sbin/smartctl'
 
 class Smart:
     '''Get SMART info for a disk'''
+    # Attributes parsed from smartctl -a output
+    info_parser = OutputParser([
+        ('model_family',     '^\s*Model Family:\s+(.*)',       None),
+        ('device_model',     '^\s*Device Model:\s+(.*)',       None),
+        ('serial_number',    '^\s*Serial Number:\s+(.*)',      None),
+        ('wwn',              '^\s*LU WWN Device Id:\s+(.*)',   None),
+        ('firmware_version', '^\s*Firmware Version:\s+(.*)',   None),
+        ('user_capacity',    '^\s*User Capacity:\s+(.*)',      None),
+        ('sector_size_b',    '^\s*Sector Size:\s+(.*)',        None),
+        ('device_is',        '^\s*Device is:\s+(.*)',          None),
+        ('ata_version',      '^\s*ATA Version is:\s+(.*)',     None),
+        ('sata_version',     '^\s*SATA Version is:\s+(.*)',    None),
+        ('local_time',       '^\s*Local Time is:\s+(.*)',      None),
+        ('available',        '^\s*SMART support is: Available - device has SMART capability.\s*$', None),
+        # smartctl prints 'SMART support is:' twice, skip the availability line
+        ('smart_enabled',    '^\s*SMART support is:\s+(?!Available)(.*)', None),
+        ('test',             '^\s*SMART overall-health self-assessment test result:\s+(.*)', None),
+    ])
+
     def __init__(self, dev):
         '''Constructor
 
@@ -69,26 +89,9 @@ class Smart:
         return self._info
 
     def get_info(self):
-        smart_attrs = {
-            '^\s*Model Family:\s+(.*)': 'model_family',
-            '^\s*Device Model:\s+(.*)': 'device_model',
-            '^\s*Serial Number:\s+(.*)': 'serial_number',
-            '^\s*LU WWN Device Id:\s+(.*)': 'wwn',
-            '^\s*Firmware Version:\s+(.*)': 'firmware_version',
-            '^\s*User Capacity:\s+(.*)': 'user_capacity',
-            '^\s*Sector Size:\s+(.*)': 'sector_size_b',
-            '^\s*Device is:\s+(.*)': 'device_is',
-            '^\s*ATA Version is:\s+(.*)': 'ata_version',
-            '^\s*SATA Version is:\s+(.*)': 'sata_version',
-            '^\s*Local Time is:\s+(.*)': 'local_time',
-            '^\s*SMART support is: Available - device has SMART capability.\s*$': 'available',
-            '^\s*SMART support is:\s+(.*)': 'smart_enabled',
-            '^\s*SMART overall-health self-assessment test result:\s+(.*)': 'test',
-        }
-
         cmd = [smartctl_cmd, '-a', self.dev]
 
-        attrs = Command.run_and_extract_attrs(cmd, smart_attrs)
+        attrs = Smart.info_parser.run(cmd)
 
 #        for (key, value) in attrs.iteritems():
 #            if callable(value.strip):
@@ -96,6 +99,30 @@ class Smart:
 
         return attrs
 
+    @classmethod
+    def get_info_batch(cls, devs, pool = None):
+        '''Get SMART info for many disks at once
+
+        Params:
+        -------
+        devs: array
+              Paths to the devices
+        pool: CommandPool
+              Pool to run smartctl in, defaults to the shared pool
+
+        Returns: dictionary of device path => hash of SMART info
+        '''
+        if pool is None:
+            pool = CommandPool.shared()
+
+        futures = [(dev, pool.submit([smartctl_cmd, '-a', dev])) for dev in devs]
+
+        info = {}
+        for (dev, future) in futures:
+            info[dev] = Smart.info_parser.parse(future.result().lines)
+
+        return info
+
     def start_test(self, short = 1):
         '''Start a test of the drive
         
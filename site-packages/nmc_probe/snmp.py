@@ -34,27 +34,553 @@
 #
 # }}}
 
-import os,platform
+import os,platform,socket,select,errno,random,re,string,math
 from nmc_probe.log import Log
-from nmc_probe.command import Command, AsynchronousFileReader
-import subprocess, threading, time, Queue
+from nmc_probe.command import Command, pollWithRetry
+from nmc_probe import ber
+import threading, time, atexit, Queue
 from nmc_probe.bladeutilsconfig import BladeUtilsConfig
+from nmc_probe.reachability import CircuitBreaker
 
-snmpwalk_cmd = None
-snmpset_cmd = None
+# The symbol table built by mib_compiler.py, if it has been run
+try:
+    from nmc_probe import mib_symbols
+except ImportError:
+    mib_symbols = None
+
+snmptranslate_cmd = None
 
 if platform.system() == 'FreeBSD':
-    snmpwalk_cmd = '/usr/local/bin/snmpwalk'
-    snmpset_cmd = '/usr/local/bin/snmpset'
+    snmptranslate_cmd = '/usr/local/bin/snmptranslate'
 else:
-    snmpwalk_cmd = '/usr/bin/snmpwalk'
-    snmpset_cmd = '/usr/bin/snmpset'
+    snmptranslate_cmd = '/usr/bin/snmptranslate'
+
+# error-status values of a response PDU
+ERROR_STATUS = ['noError', 'tooBig', 'noSuchName', 'badValue', 'readOnly', 'genErr',
+                'noAccess', 'wrongType', 'wrongLength', 'wrongEncoding', 'wrongValue',
+                'noCreation', 'inconsistentValue', 'resourceUnavailable', 'commitFailed',
+                'undoFailed', 'authorizationError', 'notWritable', 'inconsistentName']
+
+TOO_BIG = 1
+NO_SUCH_NAME = 2
+
+# The first two varbinds of an SNMPv2 trap
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+
+# genericTrap of an SNMPv1 trap defined by its enterprise
+ENTERPRISE_SPECIFIC = 6
+
+class SNMPError(Exception):
+    """
+    Raised when an agent answers a request with an error
+
+    Attributes
+    ----------
+    status : int
+             The error-status of the response
+    index  : int
+             The error-index of the response, the 1 based varbind at fault
+    """
+    def __init__(self, message, status = None, index = None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.index = index
+
+class SNMPTimeout(SNMPError):
+    """
+    Raised when an agent does not answer a request
+    """
+    pass
+
+class MIBTranslator:
+    """
+    Translates between symbolic names, like BLADE-MIB::bladeMACAddress1Vpd.3,
+    and numeric OIDs, and knows the labels of enumerated INTEGER objects.
+
+    Names are looked up in the symbol table first, which starts out
+    with the MIBs compiled by mib_compiler.py. Anything missing is
+    translated with snmptranslate and remembered, so each symbol costs
+    at most one fork per process.
+    """
+    _shared = {}
+    _sharedLock = threading.Lock()
+
+    def __init__(self, mibs = None):
+        """
+        Constructor
+
+        Params
+        ------
+        mibs : string
+               MIBs for snmptranslate to load, in the format of $MIBS
+        """
+        self.mibs = mibs
+        # Symbol name => OID tuple, and back
+        self.symbols = {}
+        self.names = {}
+        # Symbol name => {integer: label}
+        self.enumerations = {}
+        # Columns snmptranslate has already been asked about
+        self.asked = set()
+        self.lock = threading.Lock()
+        self.compiled = False
+
+        if mib_symbols is not None:
+            self.addCompiled(mib_symbols.SYMBOLS, mib_symbols.ENUMS)
+
+    def addCompiled(self, symbols, enums):
+        """
+        Add a symbol table built by mib_compiler.py
+
+        Params
+        ------
+        symbols : dictionary
+                  MODULE::name => OID tuple
+        enums   : dictionary
+                  MODULE::name => {integer: label}
+        """
+        with self.lock:
+            for (name, oid) in symbols.items():
+                self.symbols[name] = oid
+                # Bare names work too, like snmptranslate -IR
+                self.symbols.setdefault(name.split('::', 1)[-1], oid)
+                self.names.setdefault(oid, name)
+                # Every compiled object's enumeration is known, even if empty
+                self.enumerations[name] = enums.get(name, None)
+            self.compiled = True
+
+    @classmethod
+    def shared(cls, mibs = None):
+        """
+        Returns
+        -------
+        The process wide translator for a set of MIBs
+        """
+        with cls._sharedLock:
+            translator = cls._shared.get(mibs, None)
+            if translator is None:
+                translator = cls._shared[mibs] = cls(mibs)
+        return translator
+
+    def addSymbol(self, name, oid, enums = None):
+        """
+        Add a symbol to the table
+
+        Params
+        ------
+        name  : string
+                The symbol, e.g. BLADE-MIB::bladeMACAddress1Vpd
+        oid   : tuple
+                Its numeric OID
+        enums : dictionary
+                integer => label, for enumerated INTEGER objects
+        """
+        with self.lock:
+            self.symbols[name] = oid
+            self.names[oid] = name
+            if enums is not None:
+                self.enumerations[name] = enums
+
+    def resolve(self, name):
+        """
+        Returns
+        -------
+        The numeric OID of a name, as a tuple. Numeric OIDs are
+        accepted too. Raises SNMPError if the name is unknown
+        """
+        if name[0] == '.' or name[0].isdigit():
+            return ber.parseOid(name)
+
+        (symbol, suffix) = self.splitName(name)
+        oid = self.symbols.get(symbol, None)
+
+        if oid is None:
+            output = self.snmptranslate(['-On', symbol])
+            if not output or not output[0].startswith('.'):
+                raise SNMPError('Unknown OID %s' % name)
+            oid = ber.parseOid(output[0])
+            self.addSymbol(symbol, oid)
+
+        return oid + suffix
+
+    def label(self, oid):
+        """
+        Returns
+        -------
+        The symbolic name of a numeric OID, e.g. BLADE-MIB::fanPackState.2,
+        the way snmpwalk prints it. The numeric OID if it is unknown
+        """
+        (symbol, suffix) = self.lookup(oid)
+
+        # Table cells and scalars are the symbol plus one sub-identifier,
+        # a longer suffix likely means a column that is not known yet,
+        # unless the MIBs were compiled and it is a multi-part index
+        if (symbol is None or (len(suffix) > 1 and not self.compiled)) and oid[:-1] not in self.asked:
+            self.asked.add(oid[:-1])
+            output = self.snmptranslate([ber.formatOid(oid)])
+            if output and '::' in output[0]:
+                (name, index) = self.splitName(output[0])
+                self.addSymbol(name, oid[:len(oid) - len(index)])
+                (symbol, suffix) = self.lookup(oid)
+
+        if symbol is None:
+            return ber.formatOid(oid)
+
+        if suffix:
+            return '%s.%s' % (symbol, '.'.join([str(subid) for subid in suffix]))
+        return symbol
+
+    def lookup(self, oid):
+        """
+        Returns
+        -------
+        A tuple (the longest known symbol that is a prefix of oid, the
+        remaining sub-identifiers), or (None, None) if there is none
+        """
+        for length in xrange(len(oid), 0, -1):
+            name = self.names.get(oid[:length], None)
+            if name is not None:
+                return (name, oid[length:])
+        return (None, None)
+
+    def enums(self, name):
+        """
+        Returns
+        -------
+        A dictionary of integer => label for an enumerated INTEGER
+        object, None if the object is not enumerated
+        """
+        (symbol, suffix) = self.splitName(name)
+
+        if symbol not in self.enumerations:
+            enums = None
+            output = self.snmptranslate(['-Td', symbol])
+            if output:
+                match = re.search('SYNTAX\s+INTEGER\s*\{([^}]*)\}', ' '.join(output))
+                if match:
+                    enums = dict([(int(value), label) for (label, value)
+                                  in re.findall('([A-Za-z][\w-]*)\((-?\d+)\)', match.group(1))])
+            with self.lock:
+                self.enumerations[symbol] = enums
+
+        return self.enumerations[symbol]
+
+    def splitName(self, name):
+        """
+        Returns
+        -------
+        A tuple (symbol, index sub-identifiers) for a symbolic name, e.g.
+        BLADE-MIB::bladeMACAddress1Vpd.3 -> ('BLADE-MIB::bladeMACAddress1Vpd', (3,))
+        """
+        (mib, sep, rest) = name.rpartition('::')
+        parts = rest.split('.', 1)
+        suffix = ()
+        if len(parts) == 2 and parts[1]:
+            suffix = ber.parseOid(parts[1])
+        return (mib + sep + parts[0], suffix)
+
+    def snmptranslate(self, args):
+        """
+        Returns
+        -------
+        Lines of snmptranslate output, None if it failed
+        """
+        if not os.path.exists(snmptranslate_cmd):
+            return None
+
+        cmd = [snmptranslate_cmd]
+        if self.mibs:
+            cmd = cmd + ['-m', self.mibs]
+
+        (output, exitcode) = Command.run(cmd + args)
+        if exitcode != 0:
+            return None
+        return output
+
+class SNMPSession:
+    """
+    A UDP socket for talking SNMPv1 or SNMPv2c to one agent. Requests
+    are retried with the same request-id until the agent answers, and
+    late answers to earlier requests are ignored. The shared
+    CircuitBreaker picks how long to wait for each answer, and skips
+    agents that have stopped answering
+    """
+    def __init__(self, host, version = ber.VERSION_1, port = 161, timeout = 10.0, retries = 3):
+        """
+        Constructor
+
+        Params
+        ------
+        host    : string
+                  The agent's IP address or hostname
+        version : int
+                  ber.VERSION_1 or ber.VERSION_2C
+        port    : int
+                  The agent's UDP port
+        timeout : float
+                  Most seconds to wait for each answer
+        retries : int
+                  Times to resend a request that was not answered
+        """
+        self.host = host
+        self.version = version
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.sock = None
+        self.requestId = random.randint(1, 0x3fffffff)
+        self.breaker = CircuitBreaker.shared()
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.host, self.port))
+        return self.sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def nextRequestId(self):
+        self.requestId = (self.requestId % 0x7fffffff) + 1
+        return self.requestId
+
+    def request(self, community, pduType, varbinds, errorStatus = 0, errorIndex = 0):
+        """
+        Send a request and wait for the answer
+
+        Params
+        ------
+        community   : string
+        pduType     : int
+                      One of the ber request PDU types
+        varbinds    : array
+                      (oid tuple, type, value) tuples
+        errorStatus : int
+                      non-repeaters for GETBULK
+        errorIndex  : int
+                      max-repetitions for GETBULK
+
+        Returns
+        -------
+        The response ber.Message. Raises SNMPTimeout if there is no
+        answer or the agent is being skipped, and SNMPError if the agent
+        answers with an error
+        """
+        if not self.breaker.allow(self.host):
+            raise SNMPTimeout('%s: not answering, skipped' % self.host)
+
+        message = ber.Message(self.version, community, pduType, self.nextRequestId(),
+                              errorStatus, errorIndex, varbinds)
+        packet = message.encode()
+        sock = self.connect()
+
+        for attempt in xrange(self.retries + 1):
+            try:
+                sock.send(packet)
+            except (socket.error) as e:
+                raise SNMPError('%s: %s' % (self.host, e))
+
+            sent = time.time()
+            deadline = sent + self.breaker.timeout(self.host, self.timeout, attempt)
+            while True:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+
+                try:
+                    (readable, writable, errors) = select.select([sock], [], [], wait)
+                except (select.error) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if not readable:
+                    break
+
+                try:
+                    response = ber.Message.decode(sock.recv(65535))
+                except (socket.error) as e:
+                    # ICMP port unreachable shows up as a failed receive
+                    raise SNMPError('%s: %s' % (self.host, e))
+                except (ber.BERError) as e:
+                    Log.debug(10, '%s: %s' % (self.host, e))
+                    continue
+
+                if response.requestId != message.requestId or response.pduType != ber.GET_RESPONSE:
+                    continue
+
+                # Only first answers time the round trip (Karn's algorithm)
+                self.breaker.succeeded(self.host, attempt == 0 and time.time() - sent or None)
+
+                if response.errorStatus != 0:
+                    status = response.errorStatus
+                    name = status < len(ERROR_STATUS) and ERROR_STATUS[status] or str(status)
+                    raise SNMPError('%s: %s at varbind %d' % (self.host, name, response.errorIndex),
+                                    status, response.errorIndex)
+
+                return response
+
+        self.breaker.failed(self.host)
+        raise SNMPTimeout('%s: no response after %d attempts' % (self.host, self.retries + 1))
+
+    def get(self, community, oids):
+        """
+        Returns
+        -------
+        (oid, type, value) tuples for a list of OID tuples
+        """
+        return self.request(community, ber.GET_REQUEST,
+                            [(oid, ber.NULL, None) for oid in oids]).varbinds
+
+    def getNext(self, community, oids):
+        """
+        Returns
+        -------
+        (oid, type, value) tuples for the successor of each OID tuple
+        """
+        return self.request(community, ber.GET_NEXT_REQUEST,
+                            [(oid, ber.NULL, None) for oid in oids]).varbinds
+
+    def getBulk(self, community, oids, nonRepeaters = 0, maxRepetitions = 25):
+        """
+        Returns
+        -------
+        (oid, type, value) tuples: one successor for each of the first
+        nonRepeaters OIDs, then up to maxRepetitions rounds of successors
+        for the rest. SNMPv2c only
+        """
+        return self.request(community, ber.GET_BULK_REQUEST,
+                            [(oid, ber.NULL, None) for oid in oids],
+                            nonRepeaters, maxRepetitions).varbinds
+
+    def set(self, community, varbinds):
+        """
+        Returns
+        -------
+        The (oid, type, value) tuples the agent answered with
+        """
+        return self.request(community, ber.SET_REQUEST, varbinds).varbinds
+
+    def trap(self, community, enterprise, specificTrap, varbinds, uptime = 0,
+             agentAddress = '0.0.0.0'):
+        """
+        Send an enterprise specific trap. Traps are not answered
+
+        Params
+        ------
+        enterprise   : tuple
+                       The enterprise OID of the trap
+        specificTrap : int
+                       The trap number within the enterprise
+        varbinds     : array
+                       (oid tuple, type, value) tuples
+        uptime       : int
+                       sysUpTime in TimeTicks
+        agentAddress : string
+                       The agent-addr of an SNMPv1 trap
+        """
+        if self.version == ber.VERSION_2C:
+            # RFC 3584: the v2 trap OID is enterprise.0.specificTrap
+            message = ber.Message(self.version, community, ber.SNMPV2_TRAP, self.nextRequestId(),
+                                  varbinds = [(SYS_UPTIME, ber.TIMETICKS, uptime),
+                                              (SNMP_TRAP_OID, ber.OID, enterprise + (0, specificTrap))] +
+                                             list(varbinds))
+        else:
+            message = ber.Message(self.version, community, ber.TRAP, 0, varbinds = varbinds,
+                                  trap = ber.V1Trap(enterprise, agentAddress, ENTERPRISE_SPECIFIC,
+                                                    specificTrap, uptime))
+        try:
+            self.connect().send(message.encode())
+        except (socket.error) as e:
+            raise SNMPError('%s: %s' % (self.host, e))
+
+    def walk(self, community, root, maxRepetitions = 25):
+        """
+        Generator of the (oid, type, value) tuples below an OID tuple,
+        with GETBULK for SNMPv2c and GETNEXT for SNMPv1
+        """
+        oid = root
+        while True:
+            if self.version == ber.VERSION_2C:
+                varbinds = self.getBulk(community, [oid], 0, maxRepetitions)
+            else:
+                try:
+                    varbinds = self.getNext(community, [oid])
+                except (SNMPError) as e:
+                    # SNMPv1 agents report the end of the MIB this way
+                    if e.status == NO_SUCH_NAME:
+                        return
+                    raise
+
+            if not varbinds:
+                return
+
+            for varbind in varbinds:
+                (next, type, value) = varbind
+                if type == ber.END_OF_MIB_VIEW or next[:len(root)] != root or next <= oid:
+                    return
+                yield varbind
+                oid = next
+
+    def walkColumns(self, community, roots, maxRepetitions = 16):
+        """
+        Generator of (root position, (oid, type, value)) for the varbinds
+        below several OID tuples, like table columns, walked side by side.
+        Each request asks for the next rows of every column that has not
+        ended yet, with GETBULK for SNMPv2c and GETNEXT for SNMPv1. A
+        tooBig answer halves the number of rows asked for
+        """
+        cursors = list(roots)
+        active = range(len(roots))
+
+        while active:
+            oids = [cursors[position] for position in active]
+
+            try:
+                if self.version == ber.VERSION_2C:
+                    varbinds = self.getBulk(community, oids, 0, maxRepetitions)
+                else:
+                    varbinds = self.getNext(community, oids)
+            except (SNMPError) as e:
+                if e.status == TOO_BIG and self.version == ber.VERSION_2C and maxRepetitions > 1:
+                    maxRepetitions = maxRepetitions / 2
+                    continue
+                if e.status == NO_SUCH_NAME and e.index:
+                    # SNMPv1 end of the MIB for one column, drop it and ask again
+                    del active[e.index - 1]
+                    continue
+                raise
+
+            if not varbinds:
+                return
+
+            ended = set()
+            # Responses repeat the requested columns in order, one row at a time
+            for (i, varbind) in enumerate(varbinds):
+                position = active[i % len(active)]
+                if position in ended:
+                    continue
+
+                (next, type, value) = varbind
+                root = roots[position]
+                if type == ber.END_OF_MIB_VIEW or next[:len(root)] != root or next <= cursors[position]:
+                    ended.add(position)
+                    continue
+
+                yield (position, varbind)
+                cursors[position] = next
+
+            active = [position for position in active if position not in ended]
 
 class SNMP:
     """
     Handle SNMP requests destined for a particular host
     """
-    def __init__(self, host, version, readCommunity, writeCommunity = None):
+    def __init__(self, host, version, readCommunity, writeCommunity = None,
+                 mibs = None, port = 161, timeout = 10.0, retries = 3):
         """
         Constructor
         
@@ -63,16 +589,26 @@ class SNMP:
         host      : string
                     The IP address or hostname to which requests will be made
         version   : int
-                    SNMP version to use
+                    SNMP version to use, 1 or 2 (v2c)
         community : string
                     The read-only community
+        writeCommunity : string
+                    The read-write community, for set()
+        mibs      : string
+                    MIBs to translate symbolic names with, in the format of $MIBS
+        port      : int
+                    The agent's UDP port
+        timeout   : float
+                    Seconds to wait for each answer
+        retries   : int
+                    Times to resend a request that was not answered
         """
         self.host = host
         self.version = version
         self.readCommunity = readCommunity
-
-        if writeCommunity:
-            self.writeCommunity = writeCommunity
+        self.writeCommunity = writeCommunity
+        self.session = SNMPSession(host, SNMP.berVersion(version), port, timeout, retries)
+        self.translator = MIBTranslator.shared(mibs)
 
     @classmethod
     def withConfigFile(cls, host, file = None):
@@ -83,13 +619,26 @@ class SNMP:
         else:
             config = BladeUtilsConfig()
 
-        os.environ['MIBS'] = config.options['snmp']['mibs']
+        options = config.options['snmp']
 
         return cls(host,
-                   config.options['snmp']['version'],
-                   config.options['snmp']['get'],
-                   config.options['snmp']['set'])
-        
+                   options['version'],
+                   options['get'],
+                   options['set'],
+                   mibs = options.get('mibs', None),
+                   timeout = float(options.get('timeout', 10)),
+                   retries = int(options.get('retries', 3)))
+
+    @classmethod
+    def berVersion(cls, version):
+        """
+        Returns
+        -------
+        The message version for a configured SNMP version, 1 or 2
+        """
+        if str(version).lower() in ('2', '2c', 'v2c'):
+            return ber.VERSION_2C
+        return ber.VERSION_1
 
     def parseSNMPLine(self, line):
         """
@@ -190,41 +739,638 @@ class SNMP:
         -----
         oid : string
               The starting OID
+
+        Returns
+        -------
+        A list of (oid, value) tuples, or None if the walk failed
         """
-        version = '-v1'
-        if self.version == 2:
-            version = '-v2'
+        try:
+            root = self.translator.resolve(oid)
+            varbinds = list(self.session.walk(self.readCommunity, root))
 
-        args = [snmpwalk_cmd, '-t', '120', version, '-c', self.readCommunity, self.host, oid]
-        Log.debug(100, ' '.join(args))
-        (output, exitcode) = Command.run(args)
+            # Like snmpwalk, walking an instance returns that instance
+            if not varbinds:
+                varbinds = [varbind for varbind in self.getInstance(root)
+                            if varbind[1] not in (ber.NO_SUCH_OBJECT, ber.NO_SUCH_INSTANCE)]
+        except (SNMPError) as e:
+            Log.error('%s (%s)' % (e, oid))
+            return None
 
-        values = None
-        if exitcode == 0 and output:
-            values = []
-            for line in output:
-                line.rstrip('\n')
-                if len(line) > 0:
-                    values.append(self.parseSNMPLine(line))
+        if not varbinds:
+            return None
 
+        return [self.varbindValue(varbind) for varbind in varbinds]
+
+    def getInstance(self, oid):
+        """
+        Returns
+        -------
+        The varbinds of a GET of one OID tuple, an empty list if an
+        SNMPv1 agent does not have it
+        """
+        try:
+            return self.session.get(self.readCommunity, [oid])
+        except (SNMPError) as e:
+            if e.status == NO_SUCH_NAME:
+                return []
+            raise
+
+    def walkMany(self, oids):
+        """
+        Perform several SNMP walks
+
+        Params
+        -----
+        oids : array
+               The starting OIDs
+
+        Returns
+        -------
+        A dictionary of starting OID => list of (oid, value) tuples, the
+        same values walk() returns
+        """
+        values = {}
+        for oid in oids:
+            values[oid] = self.walk(oid)
         return values
 
+    def get(self, oids):
+        """
+        Get several objects in one request
+
+        Params
+        -----
+        oids : array
+               The OIDs to get
+
+        Returns
+        -------
+        A list of (oid, value) tuples, or None if the request failed
+        """
+        try:
+            varbinds = self.session.get(self.readCommunity,
+                                        [self.translator.resolve(oid) for oid in oids])
+        except (SNMPError) as e:
+            Log.error(str(e))
+            return None
+
+        return [self.varbindValue(varbind) for varbind in varbinds]
+
+    def scalars(self, oids):
+        """
+        Get several scalar instances, like BLADE-MIB::bistBladesInstalled.0,
+        in one request
+
+        Params
+        -----
+        oids : array
+               The instance OIDs
+
+        Returns
+        -------
+        A dictionary of OID, as given, => value for the instances the
+        agent has, or None if the request failed
+        """
+        try:
+            remaining = [(oid, self.translator.resolve(oid)) for oid in oids]
+            values = {}
+
+            while remaining:
+                try:
+                    varbinds = self.session.get(self.readCommunity,
+                                                [numeric for (oid, numeric) in remaining])
+                except (SNMPError) as e:
+                    # SNMPv1 fails the whole request for one missing instance
+                    if e.status == NO_SUCH_NAME and e.index:
+                        del remaining[e.index - 1]
+                        continue
+                    raise
+
+                for ((oid, numeric), varbind) in zip(remaining, varbinds):
+                    if varbind[1] not in (ber.NO_SUCH_OBJECT, ber.NO_SUCH_INSTANCE):
+                        values[oid] = self.varbindValue(varbind)[1]
+                break
+        except (SNMPError) as e:
+            Log.error(str(e))
+            return None
+
+        return values
+
+    def table(self, columns, maxRepetitions = 16):
+        """
+        Fetch several columns of a table at once, each request asks for
+        the next rows of every column
+
+        Params
+        -----
+        columns        : array
+                         The column OIDs, e.g. BLADE-MIB::bladeBiosVpdName
+        maxRepetitions : int
+                         Rows to ask for in each SNMPv2c request
+
+        Returns
+        -------
+        A dictionary of row index => dictionary of column, as given,
+        => value, or None if the walk failed. Indexes are the OID
+        sub-identifiers after the column, e.g. '3'
+        """
+        rows = {}
+
+        try:
+            roots = [self.translator.resolve(column) for column in columns]
+            for (position, varbind) in self.session.walkColumns(self.readCommunity, roots,
+                                                                maxRepetitions):
+                index = '.'.join([str(subid) for subid in varbind[0][len(roots[position]):]])
+                row = rows.setdefault(index, {})
+                row[columns[position]] = self.varbindValue(varbind)[1]
+        except (SNMPError) as e:
+            Log.error('%s (%s)' % (e, ', '.join(columns)))
+            return None
+
+        return rows
+
     def set(self, oid, oidType, value):
         """
         Perform an SNMP set
+
+        Params
+        -----
+        oid     : string
+                  The OID to set
+        oidType : string
+                  The type, as a snmpset type letter: i, u, t, a, o, s or x
+        value   : string
+                  The value
+
+        Returns
+        -------
+        A tuple: (array of "oid = value" lines, 0) on success, (None, 1)
+        on failure, the same shape as running snmpset
+        """
+        try:
+            varbind = (self.translator.resolve(oid),) + self.setValue(oidType, value)
+            varbinds = self.session.set(self.writeCommunity, [varbind])
+        except (SNMPError, ValueError) as e:
+            Log.error('%s (%s)' % (e, oid))
+            return (None, 1)
+
+        return (['%s = %s' % self.varbindValue(varbind) for varbind in varbinds], 0)
+
+    def setMany(self, varbinds):
+        """
+        Set several objects with one SET request
+
+        Agents apply a SET all or nothing. When the agent rejects one
+        varbind, that varbind is marked failed and the rest are sent
+        again, so each OID's success is known
+
+        Params
+        -----
+        varbinds : array
+                   (oid, type, value) tuples, types are snmpset type letters
+
+        Returns
+        -------
+        A dictionary of OID, as given, => True if it was set
+        """
+        results = dict([(oid, False) for (oid, oidType, value) in varbinds])
+        remaining = []
+
+        for (oid, oidType, value) in varbinds:
+            try:
+                remaining.append((oid, (self.translator.resolve(oid),) + self.setValue(oidType, value)))
+            except (SNMPError, ValueError) as e:
+                Log.error('%s (%s)' % (e, oid))
+
+        while remaining:
+            try:
+                self.session.set(self.writeCommunity, [varbind for (oid, varbind) in remaining])
+            except (SNMPError) as e:
+                if e.index and e.index <= len(remaining):
+                    Log.error('%s (%s)' % (e, remaining[e.index - 1][0]))
+                    del remaining[e.index - 1]
+                    continue
+                Log.error('%s (%s)' % (e, ', '.join([oid for (oid, varbind) in remaining])))
+                break
+
+            for (oid, varbind) in remaining:
+                results[oid] = True
+            break
+
+        return results
+
+    def setValue(self, oidType, value):
+        """
+        Returns
+        -------
+        A tuple (type, value) for a snmpset type letter and value
+        """
+        if oidType == 'i':
+            return (ber.INTEGER, int(value))
+        if oidType == 'u':
+            return (ber.GAUGE32, int(value))
+        if oidType == 't':
+            return (ber.TIMETICKS, int(value))
+        if oidType == 'a':
+            return (ber.IP_ADDRESS, value)
+        if oidType == 'o':
+            return (ber.OID, self.translator.resolve(value))
+        if oidType == 's':
+            return (ber.OCTET_STRING, value)
+        if oidType == 'x':
+            return (ber.OCTET_STRING, value.replace(' ', '').decode('hex'))
+        raise ValueError('Unsupported SNMP type %s' % oidType)
+
+    def varbindValue(self, varbind):
+        """
+        Returns
+        -------
+        A varbind as an (oid, value) tuple, with the oid and value
+        written the way parseSNMPLine() reads them from snmpwalk output
+        """
+        (oid, type, value) = varbind
+        name = self.translator.label(oid)
+
+        if type == ber.INTEGER:
+            enums = self.translator.enums(name)
+            if enums and value in enums:
+                return (name, '%s(%d)' % (enums[value], value))
+            return (name, str(value))
+
+        if type in ber.UNSIGNED_TYPES:
+            if type == ber.TIMETICKS:
+                return (name, self.formatTimeticks(value))
+            return (name, str(value))
+
+        if type == ber.OCTET_STRING:
+            if all([char in string.printable for char in value]):
+                return (name, value)
+            return (name, ' '.join(['%02X' % ord(char) for char in value]))
+
+        if type == ber.OID:
+            return (name, self.translator.label(value))
+
+        if type == ber.IP_ADDRESS:
+            return (name, value)
+
+        if type == ber.NO_SUCH_OBJECT:
+            return (name, 'No Such Object available on this agent at this OID')
+
+        if type == ber.NO_SUCH_INSTANCE:
+            return (name, 'No Such Instance currently exists at this OID')
+
+        if type == ber.NULL:
+            return (name, '')
+
+        return (name, ' '.join(['%02X' % ord(char) for char in value]))
+
+    def formatTimeticks(self, ticks):
+        """
+        Returns
+        -------
+        Timeticks written like snmpwalk: (8640123) 1 day, 0:00:01.23
         """
-        version = '-v1'
-        if self.version == 2:
-            version = '-v2'
+        (seconds, hundredths) = divmod(ticks, 100)
+        (minutes, seconds) = divmod(seconds, 60)
+        (hours, minutes) = divmod(minutes, 60)
+        (days, hours) = divmod(hours, 24)
 
-        args = [snmpset_cmd, '-t', '120', version, '-c', self.writeCommunity, self.host, oid, oidType, value]
-        return  Command.run(args)
+        text = '%d:%02d:%02d.%02d' % (hours, minutes, seconds, hundredths)
+        if days == 1:
+            text = '1 day, ' + text
+        elif days > 1:
+            text = '%d days, ' % days + text
 
-class SNMPWalk(threading.Thread):
+        return '(%d) %s' % (ticks, text)
+
+class SNMPProbe:
     """
-    Handle SNMP requests destined for a particular host
+    Checks which of many agents answer, by sending each one a GET of
+    sysUpTime.0 from one socket at the same time. Every answer and
+    every silence is recorded in the shared CircuitBreaker
+
+    Example
+    -------
+    uptimes = SNMPProbe.withConfigFile().probe(hosts)
+    reachable = [host for host in hosts if uptimes[host] is not None]
+    """
+    def __init__(self, version, community, port = 161, timeout = 1.0, retries = 1):
+        """
+        Constructor
+
+        Params
+        ------
+        version   : int
+                    SNMP version to use, 1 or 2 (v2c)
+        community : string
+                    The read-only community
+        port      : int
+                    The agents' UDP port
+        timeout   : float
+                    Seconds to wait for each answer, kept short so dead
+                    agents are found quickly
+        retries   : int
+                    Times to resend to an agent that has not answered
+        """
+        self.version = SNMP.berVersion(version)
+        self.community = community
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker.shared()
+
+    @classmethod
+    def withConfigFile(cls, file = None):
+        config = None
+
+        if file:
+            config = BladeUtilsConfig(file)
+        else:
+            config = BladeUtilsConfig()
+
+        options = config.options['snmp']
+
+        return cls(options['version'],
+                   options['get'],
+                   timeout = float(options.get('probe_timeout', 1)),
+                   retries = int(options.get('probe_retries', 1)))
+
+    def probe(self, hosts):
+        """
+        Params
+        ------
+        hosts : array
+                Agent IP addresses or hostnames
+
+        Returns
+        -------
+        A dictionary of host => sysUpTime in TimeTicks, or None for the
+        hosts that did not answer or are being skipped
+        """
+        uptimes = dict([(host, None) for host in hosts])
+
+        # request-id => host, for the hosts still waiting for an answer
+        waiting = {}
+        packets = {}
+        addresses = {}
+        requestId = random.randint(1, 0x3fffffff)
+
+        for host in hosts:
+            if not self.breaker.allow(host):
+                continue
+            try:
+                addresses[host] = (socket.gethostbyname(host), self.port)
+            except (socket.error) as e:
+                Log.error('%s: %s' % (host, e))
+                continue
+
+            requestId = requestId + 1
+            waiting[requestId] = host
+            packets[requestId] = ber.Message(self.version, self.community, ber.GET_REQUEST, requestId,
+                                             varbinds = [(SYS_UPTIME, ber.NULL, None)]).encode()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+
+        try:
+            for attempt in xrange(self.retries + 1):
+                if not waiting:
+                    break
+
+                sent = time.time()
+                for (requestId, host) in waiting.items():
+                    try:
+                        sock.sendto(packets[requestId], addresses[host])
+                    except (socket.error) as e:
+                        Log.debug(10, '%s: %s' % (host, e))
+
+                deadline = sent + self.timeout
+                while waiting:
+                    wait = deadline - time.time()
+                    if wait <= 0 or not pollWithRetry(poller, int(math.ceil(wait * 1000))):
+                        break
+
+                    self.receive(sock, waiting, addresses, uptimes, attempt == 0 and sent or None)
+        finally:
+            sock.close()
+
+        for host in waiting.values():
+            self.breaker.failed(host)
+
+        return uptimes
+
+    def receive(self, sock, waiting, addresses, uptimes, sent):
+        """
+        Record every answer waiting on the socket
+        """
+        while True:
+            try:
+                (packet, address) = sock.recvfrom(65535)
+            except (socket.error) as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # ICMP port unreachable from an earlier send
+                continue
+
+            try:
+                response = ber.Message.decode(packet)
+            except (ber.BERError) as e:
+                Log.debug(10, '%s: %s' % (address[0], e))
+                continue
+
+            host = waiting.get(response.requestId, None)
+            if host is None or addresses[host] != address or response.pduType != ber.GET_RESPONSE:
+                continue
+
+            del waiting[response.requestId]
+            # An agent that answers with an error is still up
+            uptimes[host] = 0
+            for (oid, type, value) in response.varbinds:
+                if oid == SYS_UPTIME and type == ber.TIMETICKS:
+                    uptimes[host] = value
+
+            self.breaker.succeeded(host, sent and time.time() - sent or None)
+
+class SNMPWalkLoop:
+    """
+    Drives any number of SNMPWalks from one background thread. All
+    walks share one UDP socket, answers are matched to walks by
+    request-id, and the thread sleeps in poll() until an answer
+    arrives or a request is due to be resent.
+    """
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self):
+        self.sock = None
+        self.wakeup = None
+        self.thread = None
+        self.queue = Queue.Queue()
+        # request-id => walk waiting for that answer
+        self.waiting = {}
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns
+        -------
+        The process wide walk loop, stopped when the process exits
+        """
+        with cls._sharedLock:
+            if cls._shared is None:
+                cls._shared = cls()
+                atexit.register(cls._shared.shutdown)
+        return cls._shared
+
+    def submit(self, walk):
+        """
+        Start a walk. It runs on the loop thread
+        """
+        self.startLoop()
+        self.queue.put(walk)
+        os.write(self.wakeup[1], 'x')
+
+    def startLoop(self):
+        """
+        Start the loop thread the first time a walk is submitted
+        """
+        with self.lock:
+            if self.thread is None:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.sock.setblocking(0)
+                self.wakeup = os.pipe()
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def send(self, walk):
+        """
+        Called on the loop thread: send walk's current request
+        """
+        self.waiting[walk.requestId] = walk
+        try:
+            self.sock.sendto(walk.packet, walk.address)
+        except (socket.error) as e:
+            del self.waiting[walk.requestId]
+            walk.finish('%s: %s' % (walk.host, e))
+
+    def forget(self, walk):
+        self.waiting.pop(walk.requestId, None)
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN)
+        poller.register(self.wakeup[0], select.POLLIN)
+
+        while not self.stopped:
+            wait = None
+            if self.waiting:
+                deadline = min([walk.deadline for walk in self.waiting.values()])
+                wait = int(math.ceil(max(0.0, deadline - time.time()) * 1000))
+
+            for (fd, event) in pollWithRetry(poller, wait):
+                if fd == self.wakeup[0]:
+                    self.drain()
+                else:
+                    self.receive()
+
+            now = time.time()
+            for walk in [walk for walk in self.waiting.values() if walk.deadline <= now]:
+                self.forget(walk)
+                walk.expired(self)
+
+        # Don't leave readers blocked on walks that will never end
+        for walk in self.waiting.values():
+            walk.finish('%s: walk stopped (%s)' % (walk.host, walk.oid))
+        self.waiting = {}
+
+    def drain(self):
+        """
+        Start the walks that have been submitted
+        """
+        os.read(self.wakeup[0], 4096)
+        while True:
+            try:
+                walk = self.queue.get_nowait()
+            except (Queue.Empty):
+                break
+
+            if walk is None:
+                self.stopped = True
+                break
+
+            walk.begin(self)
+
+    def shutdown(self):
+        """
+        Stop the loop thread. Walks still running end without an answer
+        """
+        with self.lock:
+            if self.thread is None:
+                return
+
+            self.queue.put(None)
+            os.write(self.wakeup[1], 'x')
+            self.thread.join()
+
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+            self.sock.close()
+            self.thread = None
+            self.wakeup = None
+            self.sock = None
+            self.stopped = False
+
+    def receive(self):
+        """
+        Hand every answer waiting on the socket to its walk
+        """
+        while True:
+            try:
+                (packet, address) = self.sock.recvfrom(65535)
+            except (socket.error) as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # ICMP errors from earlier sends, the walk will time out
+                Log.debug(10, 'SNMP socket: %s' % e)
+                continue
+
+            try:
+                response = ber.Message.decode(packet)
+            except (ber.BERError) as e:
+                Log.debug(10, '%s: %s' % (address[0], e))
+                continue
+
+            walk = self.waiting.get(response.requestId, None)
+            if walk is None or walk.address != address or response.pduType != ber.GET_RESPONSE:
+                continue
+
+            self.forget(walk)
+            walk.answered(self, response)
+
+class SNMPWalk:
+    """
+    An SNMP walk that runs on the shared SNMPWalkLoop. Iterating
+    over it blocks until the next (oid, value) tuple arrives, the same
+    tuples SNMP.walk() returns, so many walks can be started at once
+    and read one after another.
+
+    Example
+    -------
+    walks = [SNMPWalk.withConfigFile(host, 'BLADE-MIB::fanPack') for host in hosts]
+    for walk in walks:
+        for (oid, value) in walk:
+            print oid, value
     """
-    def __init__(self, host, version, readCommunity, oid):
+    # Marks the end of the varbinds
+    END = None
+
+    def __init__(self, host, version, readCommunity, oid, mibs = None,
+                 port = 161, timeout = 10.0, retries = 3, loop = None):
         """
         Constructor
         
@@ -236,14 +1382,42 @@ class SNMPWalk(threading.Thread):
                     SNMP version to use
         community : string
                     The read-only community
+        oid       : string
+                    The starting OID
+        mibs      : string
+                    MIBs to translate symbolic names with, in the format of $MIBS
+        loop      : SNMPWalkLoop
+                    The loop to run on, the shared loop by default
         """
         self.host = host
         self.version = version
         self.readCommunity = readCommunity
         self.oid = oid
-        self.queue = Queue.Queue()
-        threading.Thread.__init__(self)
-        self.start()
+        self.snmp = SNMP(host, version, readCommunity, mibs = mibs,
+                         port = port, timeout = timeout, retries = retries)
+        self.varbinds = Queue.Queue()
+        self.finished = threading.Event()
+        self.error = None
+        self.count = 0
+        self.requestId = None
+        self.packet = None
+        self.sent = None
+        self.deadline = None
+        self.attempts = 0
+
+        try:
+            self.root = self.snmp.translator.resolve(oid)
+            self.address = (socket.gethostbyname(host), port)
+        except (SNMPError, socket.error) as e:
+            self.finish('%s (%s)' % (e, oid))
+            return
+
+        if not self.snmp.session.breaker.allow(host):
+            self.finish('%s: not answering, skipped (%s)' % (host, oid))
+            return
+
+        self.cursor = self.root
+        (loop or SNMPWalkLoop.shared()).submit(self)
 
     @classmethod
     def withConfigFile(cls, host, oid, file = None):
@@ -254,97 +1428,142 @@ class SNMPWalk(threading.Thread):
         else:
             config = BladeUtilsConfig()
 
+        options = config.options['snmp']
+
         return cls(host,
-                   config.options['snmp']['version'],
-                   config.options['snmp']['get'],
-                   oid)
+                   options['version'],
+                   options['get'],
+                   oid,
+                   options.get('mibs', None),
+                   timeout = float(options.get('timeout', 10)),
+                   retries = int(options.get('retries', 3)))
 
-    def run(self):
+    def __iter__(self):
         """
-        Perform an SNMP walk
+        Yields (oid, value) tuples as they arrive, until the walk ends
         """
-        version = '-v1'
-        if self.version == 2:
-            version = '-v2'
-
-        command = [snmpwalk_cmd, '-t', '120', version, '-c', self.readCommunity, self.host, self.oid]
-        Log.debug(100, ' '.join(command))
-
-        # Launch the command as subprocess.
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
- 
-        # Launch the asynchronous readers of the process' stdout and stderr.
-        stdoutQueue = Queue.Queue()
-        stdoutReader = AsynchronousFileReader(process.stdout, stdoutQueue)
-        stdoutReader.start()
-        stderrQueue = Queue.Queue()
-        stderrReader = AsynchronousFileReader(process.stderr, stderrQueue)
-        stderrReader.start()
-
-        # Check the queues if we received some output (until there is nothing more to get).
-        while not stdoutReader.eof() or not stderrReader.eof():
-            # Show what we received from standard output.
-            while not stdoutQueue.empty():
-                line = stdoutQueue.get()
-                self.queue.put(self.split(line))
- 
-            # Show what we received from standard error.
-            while not stderrQueue.empty():
-                line = stderrQueue.get()
-                print 'Received line on standard error: ' + repr(line)
- 
-            # Sleep a bit before asking the readers again.
-            time.sleep(.1)
- 
-        # Let's be tidy and join the threads we've started.
-        stdoutReader.join()
-        stderrReader.join()
- 
-        # Close subprocess' file descriptors.
-        process.stdout.close()
-        process.stderr.close()
+        while True:
+            varbind = self.varbinds.get()
+            if varbind is SNMPWalk.END:
+                self.varbinds.put(SNMPWalk.END)
+                return
+            yield self.snmp.varbindValue(varbind)
 
     @property
     def eof(self):
-        '''Check whether there is no more content to expect.'''
-        return not self.is_alive() and self.queue.empty()
+        """
+        True once the walk has ended and every value has been read
+        """
+        return self.finished.is_set() and self.varbinds.qsize() <= 1
 
-    def split(self, line):
+    def join(self, timeout = None):
         """
-        Private member, splits a line of snmpwalk output into the oid and value
+        Wait for the walk to end
+        """
+        self.finished.wait(timeout)
 
-        Returns
-        -------
-        A tuple (oid, value)
+    def begin(self, loop):
         """
-        oid = None
-        value = None
+        Called on the loop thread: send the first request
+        """
+        self.next(loop)
 
-        # Split the line on the first '=' character
-        parts = line.split('=', 1)
-        if len(parts) == 2:
-            oid = parts[0].rstrip().lstrip()
-            value = parts[1].rstrip().lstrip().rstrip('"').lstrip('"')
-            #print('oid:value %s:%s' % (oid, value))
+    def next(self, loop):
+        """
+        Send the request for the varbinds after the cursor, or for the
+        root itself when walking an instance
+        """
+        session = self.snmp.session
+        if self.cursor is None:
+            message = ber.Message(session.version, self.readCommunity, ber.GET_REQUEST,
+                                  session.nextRequestId(), 0, 0, [(self.root, ber.NULL, None)])
+        elif session.version == ber.VERSION_2C:
+            message = ber.Message(session.version, self.readCommunity, ber.GET_BULK_REQUEST,
+                                  session.nextRequestId(), 0, 25, [(self.cursor, ber.NULL, None)])
+        else:
+            message = ber.Message(session.version, self.readCommunity, ber.GET_NEXT_REQUEST,
+                                  session.nextRequestId(), 0, 0, [(self.cursor, ber.NULL, None)])
 
-# start
-            valueParts = value.split(':', 1)
+        self.requestId = message.requestId
+        self.packet = message.encode()
+        self.attempts = 0
+        self.send(loop)
 
-            if len(valueParts) == 2:
-                type = valueParts[0].rstrip().lstrip()
-                value = valueParts[1].rstrip().lstrip()
+    def send(self, loop):
+        session = self.snmp.session
+        self.sent = time.time()
+        self.deadline = self.sent + session.breaker.timeout(self.host, session.timeout, self.attempts)
+        self.attempts = self.attempts + 1
+        loop.send(self)
 
-                if type == 'STRING':
-                    value = value.rstrip('"').lstrip('"')
-                else:
-                    print ('type: %s' % type)
+    def expired(self, loop):
+        """
+        Called on the loop thread when no answer came in time
+        """
+        if self.attempts <= self.snmp.session.retries:
+            self.send(loop)
+        else:
+            self.snmp.session.breaker.failed(self.host)
+            self.finish('%s: no response after %d attempts (%s)' % (self.host, self.attempts, self.oid))
+
+    def answered(self, loop, response):
+        """
+        Called on the loop thread with the answer to the last request
+        """
+        # Only first answers time the round trip (Karn's algorithm)
+        self.snmp.session.breaker.succeeded(self.host, self.attempts == 1 and time.time() - self.sent or None)
+
+        if response.errorStatus != 0:
+            # SNMPv1 agents report the end of the MIB this way
+            if response.errorStatus == NO_SUCH_NAME:
+                self.walked(loop)
             else:
-                Log.error('Cannot parse SNMP value: "%s"' % (valueType))
-# end
+                status = response.errorStatus
+                name = status < len(ERROR_STATUS) and ERROR_STATUS[status] or str(status)
+                self.finish('%s: %s at varbind %d (%s)' % (self.host, name, response.errorIndex, self.oid))
+            return
+
+        if self.cursor is None:
+            for varbind in response.varbinds:
+                if varbind[1] not in (ber.NO_SUCH_OBJECT, ber.NO_SUCH_INSTANCE):
+                    self.put(varbind)
+            self.finish()
+            return
+
+        for varbind in response.varbinds:
+            (next, type, value) = varbind
+            if type == ber.END_OF_MIB_VIEW or next[:len(self.root)] != self.root or next <= self.cursor:
+                self.walked(loop)
+                return
+            self.put(varbind)
+            self.cursor = next
+
+        if not response.varbinds:
+            self.walked(loop)
         else:
-            Log.error('Cannot parse SNMP key/value pair: "%s"' % (line))
+            self.next(loop)
 
-        return (oid, value)
+    def walked(self, loop):
+        """
+        The subtree has ended. Like snmpwalk, walking an instance
+        returns that instance
+        """
+        if self.count == 0 and self.cursor is not None:
+            self.cursor = None
+            self.next(loop)
+        else:
+            self.finish()
+
+    def put(self, varbind):
+        self.count = self.count + 1
+        self.varbinds.put(varbind)
+
+    def finish(self, error = None):
+        if error is not None:
+            self.error = error
+            Log.error(error)
+        self.varbinds.put(SNMPWalk.END)
+        self.finished.set()
 
     def extractLastOctet(self, oid):
         """
@@ -406,3 +1625,210 @@ class SNMPWalk(threading.Thread):
             
         return (mibName, oidBase, lastOctet)
 
+class SNMPTrap:
+    """
+    A trap or inform received by an SNMPTrapListener. SNMPv2 traps are
+    described the way RFC 3584 maps them onto SNMPv1 traps, so both
+    versions have an enterprise and a specificTrap
+
+    Attributes
+    ----------
+    host         : string
+                   The IP address the trap came from
+    version      : int
+                   ber.VERSION_1 or ber.VERSION_2C
+    community    : string
+    enterprise   : tuple
+                   The enterprise OID
+    genericTrap  : int
+                   coldStart(0) through enterpriseSpecific(6)
+    specificTrap : int
+                   The trap number within the enterprise
+    uptime       : int
+                   The agent's sysUpTime in TimeTicks
+    varbinds     : array
+                   (oid, type, value) tuples, without the sysUpTime and
+                   snmpTrapOID varbinds of an SNMPv2 trap
+    received     : float
+                   When the trap arrived, seconds since the epoch
+    """
+    def __init__(self, host, message):
+        self.host = host
+        self.version = message.version
+        self.community = message.community
+        self.received = time.time()
+
+        if message.trap is not None:
+            self.enterprise = message.trap.enterprise
+            self.genericTrap = message.trap.genericTrap
+            self.specificTrap = message.trap.specificTrap
+            self.uptime = message.trap.timestamp
+            self.varbinds = message.varbinds
+            return
+
+        self.enterprise = ()
+        self.genericTrap = ENTERPRISE_SPECIFIC
+        self.specificTrap = 0
+        self.uptime = 0
+        self.varbinds = []
+
+        for (oid, type, value) in message.varbinds:
+            if oid == SYS_UPTIME:
+                self.uptime = value
+            elif oid == SNMP_TRAP_OID:
+                if len(value) > 2 and value[-2] == 0:
+                    (self.enterprise, self.specificTrap) = (value[:-2], value[-1])
+                else:
+                    self.enterprise = value
+            else:
+                self.varbinds.append((oid, type, value))
+
+class SNMPTrapListener:
+    """
+    Receives SNMPv1 and SNMPv2c traps and informs on a UDP port.
+    Informs are acknowledged as they arrive
+
+    Example
+    -------
+    listener = SNMPTrapListener(port = 162)
+    listener.serve(lambda traps: [listener.values(trap) for trap in traps])
+    """
+    def __init__(self, port = 162, address = '0.0.0.0', community = None, mibs = None):
+        """
+        Constructor
+
+        Params
+        ------
+        port      : int
+                    The UDP port to listen on, 0 for any free port
+        address   : string
+                    The local address to listen on
+        community : string
+                    Drop traps from other communities, None accepts any
+        mibs      : string
+                    MIBs to translate symbolic names with, in the format of $MIBS
+        """
+        self.port = port
+        self.address = address
+        self.community = community
+        self.snmp = SNMP(address, ber.VERSION_2C, community, mibs = mibs)
+        self.sock = None
+        self.stopped = False
+
+    def open(self):
+        """
+        Bind the socket
+
+        Returns
+        -------
+        The port the listener is bound to
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((self.address, self.port))
+            self.sock.setblocking(0)
+            self.port = self.sock.getsockname()[1]
+        return self.port
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def receive(self, timeout = None):
+        """
+        Wait for traps
+
+        Params
+        ------
+        timeout : float
+                  Seconds to wait for the first trap, None waits forever
+
+        Returns
+        -------
+        An array of every SNMPTrap waiting on the socket, empty if none
+        arrived in time
+        """
+        self.open()
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN)
+
+        wait = None
+        if timeout is not None:
+            wait = int(timeout * 1000)
+
+        traps = []
+        if not pollWithRetry(poller, wait):
+            return traps
+
+        while True:
+            try:
+                (packet, address) = self.sock.recvfrom(65535)
+            except (socket.error) as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            try:
+                message = ber.Message.decode(packet)
+            except (ber.BERError) as e:
+                Log.debug(10, '%s: %s' % (address[0], e))
+                continue
+
+            if message.pduType not in (ber.TRAP, ber.SNMPV2_TRAP, ber.INFORM_REQUEST):
+                continue
+
+            if self.community is not None and message.community != self.community:
+                Log.debug(10, '%s: trap with the wrong community dropped' % address[0])
+                continue
+
+            if message.pduType == ber.INFORM_REQUEST:
+                self.acknowledge(message, address)
+
+            traps.append(SNMPTrap(address[0], message))
+
+        return traps
+
+    def acknowledge(self, message, address):
+        """
+        Answer an inform with its own varbinds
+        """
+        response = ber.Message(message.version, message.community, ber.GET_RESPONSE,
+                               message.requestId, 0, 0, message.varbinds)
+        try:
+            self.sock.sendto(response.encode(), address)
+        except (socket.error) as e:
+            Log.error('%s: %s' % (address[0], e))
+
+    def serve(self, callback, interval = 1.0):
+        """
+        Receive traps until stop() is called
+
+        Params
+        ------
+        callback : function
+                   Called with the array of traps that arrived together,
+                   and with an empty array every interval seconds that
+                   pass without a trap
+        interval : float
+                   Seconds between calls when no traps arrive
+        """
+        self.stopped = False
+        while not self.stopped:
+            callback(self.receive(interval))
+
+    def stop(self):
+        """
+        Make serve() return, safe to call from a signal handler
+        """
+        self.stopped = True
+
+    def values(self, trap):
+        """
+        Returns
+        -------
+        A trap's varbinds as (oid, value) tuples, written the way
+        SNMP.walk() returns them
+        """
+        return [self.snmp.varbindValue(varbind) for varbind in trap.varbinds]
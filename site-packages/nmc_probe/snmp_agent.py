@@ -0,0 +1,313 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+#
+# A stand-in SNMP agent, for exercising the native SNMP code without a
+# chassis. It answers GET, GETNEXT, GETBULK and SET from a table of
+# OIDs, which can be loaded from numeric snmpwalk output:
+#
+#   snmpwalk -v2c -c public -On 10.56.100.12 .1.3.6.1.4.1.2.3.51.2 > amm.walk
+#   snmp_agent.py -p 1161 amm.walk
+#
+#   snmpwalk -v2c -c public -p 1161 127.0.0.1 BLADE-MIB::fanPack
+
+import os, sys, socket, threading, getopt, bisect
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nmc_probe import ber
+from nmc_probe.log import Log
+
+# snmpwalk value type => ber type
+WALK_TYPES = {
+    'INTEGER':    ber.INTEGER,
+    'STRING':     ber.OCTET_STRING,
+    'Hex-STRING': ber.OCTET_STRING,
+    'OID':        ber.OID,
+    'IpAddress':  ber.IP_ADDRESS,
+    'Counter32':  ber.COUNTER32,
+    'Gauge32':    ber.GAUGE32,
+    'Timeticks':  ber.TIMETICKS,
+    'Counter64':  ber.COUNTER64,
+}
+
+class SNMPAgent(threading.Thread):
+    """
+    Answers SNMP requests on a UDP port from a dictionary of
+    OID tuple => (type, value), in a background thread
+    """
+    def __init__(self, objects = None, port = 0, community = 'public', host = '127.0.0.1'):
+        """
+        Constructor
+
+        Params
+        ------
+        objects   : dictionary
+                    OID tuple => (ber type, value)
+        port      : int
+                    UDP port to listen on, 0 picks a free one
+        community : string
+                    The community requests must use, None accepts any
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.objects = {}
+        self.oids = []
+        self.community = community
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.host = host
+        self.port = self.sock.getsockname()[1]
+
+        for (oid, (type, value)) in (objects or {}).items():
+            self.setObject(oid, type, value)
+
+    @classmethod
+    def withWalkFile(cls, path, port = 0, community = 'public'):
+        """
+        Returns
+        -------
+        An agent serving the objects in numeric (-On) snmpwalk output
+        """
+        agent = cls(port = port, community = community)
+        with open(path) as file:
+            for line in file:
+                varbind = parseWalkLine(line)
+                if varbind:
+                    agent.setObject(*varbind)
+        return agent
+
+    def setObject(self, oid, type, value):
+        with self.lock:
+            if oid not in self.objects:
+                bisect.insort(self.oids, oid)
+            self.objects[oid] = (type, value)
+
+    def successor(self, oid):
+        """
+        Returns
+        -------
+        The first OID after oid, None at the end of the MIB
+        """
+        index = bisect.bisect_right(self.oids, oid)
+        if index < len(self.oids):
+            return self.oids[index]
+        return None
+
+    def answer(self, request):
+        """
+        Returns
+        -------
+        The response Message for a request Message
+        """
+        response = ber.Message(request.version, request.community, ber.GET_RESPONSE,
+                               request.requestId)
+        v1 = request.version == ber.VERSION_1
+
+        with self.lock:
+            if request.pduType == ber.GET_REQUEST:
+                for (oid, type, value) in request.varbinds:
+                    if oid in self.objects:
+                        response.varbinds.append((oid,) + self.objects[oid])
+                    elif v1:
+                        return self.error(request, 2, len(response.varbinds) + 1)
+                    else:
+                        response.varbinds.append((oid, ber.NO_SUCH_OBJECT, None))
+
+            elif request.pduType == ber.GET_NEXT_REQUEST:
+                for (oid, type, value) in request.varbinds:
+                    next = self.successor(oid)
+                    if next is not None:
+                        response.varbinds.append((next,) + self.objects[next])
+                    elif v1:
+                        return self.error(request, 2, len(response.varbinds) + 1)
+                    else:
+                        response.varbinds.append((oid, ber.END_OF_MIB_VIEW, None))
+
+            elif request.pduType == ber.GET_BULK_REQUEST and not v1:
+                nonRepeaters = request.errorStatus
+                repeaters = [oid for (oid, type, value) in request.varbinds[nonRepeaters:]]
+
+                for (oid, type, value) in request.varbinds[:nonRepeaters]:
+                    next = self.successor(oid)
+                    if next is not None:
+                        response.varbinds.append((next,) + self.objects[next])
+                    else:
+                        response.varbinds.append((oid, ber.END_OF_MIB_VIEW, None))
+
+                ended = set()
+                for repetition in xrange(request.errorIndex):
+                    if not repeaters or len(ended) == len(repeaters):
+                        break
+                    for (i, oid) in enumerate(repeaters):
+                        next = i not in ended and self.successor(oid) or None
+                        if next is not None:
+                            response.varbinds.append((next,) + self.objects[next])
+                            repeaters[i] = next
+                        else:
+                            response.varbinds.append((oid, ber.END_OF_MIB_VIEW, None))
+                            ended.add(i)
+
+            elif request.pduType == ber.SET_REQUEST:
+                for (index, (oid, type, value)) in enumerate(request.varbinds):
+                    if oid not in self.objects:
+                        # noSuchName for v1, notWritable for v2c
+                        return self.error(request, v1 and 2 or 17, index + 1)
+                for (oid, type, value) in request.varbinds:
+                    self.objects[oid] = (type, value)
+                    response.varbinds.append((oid, type, value))
+
+            else:
+                # genErr
+                return self.error(request, 5, 0)
+
+        return response
+
+    def error(self, request, status, index):
+        return ber.Message(request.version, request.community, ber.GET_RESPONSE,
+                           request.requestId, status, index, request.varbinds)
+
+    def run(self):
+        while True:
+            try:
+                (packet, address) = self.sock.recvfrom(65535)
+            except (socket.error):
+                return
+
+            try:
+                request = ber.Message.decode(packet)
+            except (ber.BERError) as e:
+                Log.debug(10, 'Ignoring request from %s: %s' % (address[0], e))
+                continue
+
+            if self.community is not None and request.community != self.community:
+                continue
+
+            self.requests += 1
+            self.sock.sendto(self.answer(request).encode(), address)
+
+    def stop(self):
+        self.sock.close()
+
+def parseWalkLine(line):
+    """
+    Parse a line of numeric snmpwalk output, like
+    .1.3.6.1.2.1.1.3.0 = Timeticks: (8640123) 1 day, 0:00:01.23
+
+    Returns
+    -------
+    A tuple (oid tuple, ber type, value), None for lines that are not
+    an object, like continuations of multi-line strings
+    """
+    parts = line.rstrip('\n').split(' = ', 1)
+    if len(parts) != 2 or not parts[0].startswith('.'):
+        return None
+
+    oid = ber.parseOid(parts[0])
+    (typeName, sep, value) = parts[1].partition(': ')
+
+    if not sep:
+        # STRING: "" prints as ""
+        return (oid, ber.OCTET_STRING, parts[1].strip('"'))
+
+    type = WALK_TYPES.get(typeName, None)
+    if type is None:
+        return None
+
+    if typeName == 'Hex-STRING':
+        return (oid, type, value.replace(' ', '').decode('hex'))
+    if type == ber.OCTET_STRING:
+        return (oid, type, value.strip('"'))
+    if type == ber.OID:
+        return (oid, type, ber.parseOid(value))
+    if type == ber.IP_ADDRESS:
+        return (oid, type, value)
+    if type == ber.TIMETICKS:
+        return (oid, type, int(value.split(')')[0].lstrip('(')))
+
+    # INTEGER: on(1)
+    if '(' in value:
+        value = value.rsplit('(', 1)[1].rstrip(')')
+    return (oid, type, int(value))
+
+def usage(progName):
+    print ('Usage: %s [-p port] [-c community] WALKFILE' % progName)
+
+def main(argv):
+    """
+    Program entry point
+
+    Returns
+    -------
+    The exit code
+    """
+    progName = os.path.basename(sys.argv[0])
+
+    try:
+        optlist, args = getopt.getopt(argv, 'c:hp:', ['community=', 'help', 'port='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage(progName)
+        return 1
+
+    port = 1161
+    community = 'public'
+
+    for (opt, value) in optlist:
+        if opt == '--community' or opt == '-c':
+            community = value
+
+        if opt == '--port' or opt == '-p':
+            port = int(value)
+
+        if opt == '--help' or opt == '-h':
+            usage(progName)
+            return 0
+
+    if len(args) != 1:
+        usage(progName)
+        return 1
+
+    agent = SNMPAgent.withWalkFile(args[0], port, community)
+    print ('Serving %d objects on %s:%d' % (len(agent.oids), agent.host, agent.port))
+    agent.run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,283 @@
+# Copyright (c) 2015 The New Mexico Consortium
+# 
+# {{{NMC-LICENSE
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+# }}}
+
+import os, re, json, time, random, signal, atexit, threading
+from contextlib import contextmanager
+from nmc_probe.log import Log
+
+class ToolStats:
+    """
+    Latency and output volume for every run of one tool
+
+    Attributes
+    ----------
+    count    : int
+               Number of runs
+    cached   : int
+               Number of runs answered from the command cache
+    failures : int
+               Number of runs that exited non-zero or could not start
+    exitcodes: dictionary
+               exit code => number of runs
+    elapsed  : float
+               Total wall clock seconds
+    lines    : int
+               Total lines of standard output
+    bytes    : int
+               Total bytes of standard output
+    samples  : array
+               Wall clock seconds of a uniform random sample of the runs
+    """
+    # Runs kept for the latency histogram, so long running daemons
+    # don't grow without bound
+    maxSamples = 2048
+
+    def __init__(self):
+        self.count = 0
+        self.cached = 0
+        self.failures = 0
+        self.exitcodes = {}
+        self.elapsed = 0.0
+        self.maxElapsed = 0.0
+        self.lines = 0
+        self.bytes = 0
+        self.samples = []
+
+    def add(self, elapsed, exitcode, lines, nbytes):
+        self.count = self.count + 1
+        self.elapsed = self.elapsed + elapsed
+        self.maxElapsed = max(self.maxElapsed, elapsed)
+        self.lines = self.lines + lines
+        self.bytes = self.bytes + nbytes
+        self.exitcodes[exitcode] = self.exitcodes.get(exitcode, 0) + 1
+
+        if exitcode != 0:
+            self.failures = self.failures + 1
+
+        # Reservoir sampling
+        if len(self.samples) < ToolStats.maxSamples:
+            self.samples.append(elapsed)
+        else:
+            slot = random.randint(0, self.count - 1)
+            if slot < ToolStats.maxSamples:
+                self.samples[slot] = elapsed
+
+    def percentile(self, sortedSamples, percent):
+        """
+        Returns
+        -------
+        The nearest rank percentile of sorted samples, None if there are none
+        """
+        if not sortedSamples:
+            return None
+        rank = int(round(percent / 100.0 * len(sortedSamples) + 0.5)) - 1
+        return sortedSamples[max(0, min(rank, len(sortedSamples) - 1))]
+
+    def summary(self):
+        """
+        Returns
+        -------
+        A dictionary suitable for JSON
+        """
+        samples = sorted(self.samples)
+        return {'count':     self.count,
+                'cached':    self.cached,
+                'failures':  self.failures,
+                'exitcodes': dict([('%s' % code, num) for (code, num) in self.exitcodes.iteritems()]),
+                'lines':     self.lines,
+                'bytes':     self.bytes,
+                'seconds':   {'total': self.elapsed,
+                              'max':   self.maxElapsed,
+                              'p50':   self.percentile(samples, 50),
+                              'p95':   self.percentile(samples, 95),
+                              'p99':   self.percentile(samples, 99)}}
+
+class CommandStats:
+    """
+    Process wide registry of how long each external tool takes and how
+    much it outputs. Every command run through nmc_probe.command is
+    recorded. Sections of Python, like rtslib calls, can be recorded
+    with timer().
+
+    Set NMC_PROBE_STATS to a file name to have the registry written
+    there as JSON when the process exits and whenever it receives SIGUSR1.
+    All methods are class methods
+    """
+    tools = {}
+    # Reentrant, the SIGUSR1 handler may run while the lock is held
+    lock = threading.RLock()
+    dumpPath = None
+
+    # Arguments that name a subcommand, like clone in zfs clone
+    subcommandPattern = re.compile('^[a-z][a-z0-9_-]*$')
+
+    @classmethod
+    def toolName(cls, args):
+        """
+        Returns
+        -------
+        The name statistics are kept under for a command: the program
+        name, followed by its subcommand if it has one
+        """
+        name = os.path.basename(str(args[0]))
+        for arg in args[1:3]:
+            if CommandStats.subcommandPattern.match(str(arg)):
+                return '%s %s' % (name, arg)
+        return name
+
+    @classmethod
+    def get(cls, tool):
+        stats = CommandStats.tools.get(tool, None)
+        if stats is None:
+            stats = CommandStats.tools[tool] = ToolStats()
+        return stats
+
+    @classmethod
+    def record(cls, args, elapsed, exitcode, stdout = ''):
+        """
+        Record one run of a command
+
+        Params
+        ------
+        args     : array
+                   The command and its arguments
+        elapsed  : float
+                   Wall clock seconds the command ran
+        exitcode : int
+                   The exit code, None if the command could not start
+        stdout   : string
+                   Everything the command wrote to standard output
+        """
+        tool = CommandStats.toolName(args)
+        lines = stdout.count('\n')
+        if stdout and not stdout.endswith('\n'):
+            lines = lines + 1
+
+        with CommandStats.lock:
+            CommandStats.get(tool).add(elapsed, exitcode, lines, len(stdout))
+
+    @classmethod
+    def recordCached(cls, args):
+        """
+        Record a command answered from the command cache
+        """
+        tool = CommandStats.toolName(args)
+        with CommandStats.lock:
+            stats = CommandStats.get(tool)
+            stats.cached = stats.cached + 1
+
+    @classmethod
+    @contextmanager
+    def timer(cls, tool):
+        """
+        Record the wall clock time of a block of code under a tool name
+
+        Example
+        -------
+        with CommandStats.timer('rtslib save'):
+            mgr.save()
+        """
+        start = time.time()
+        exitcode = 1
+        try:
+            yield
+            exitcode = 0
+        finally:
+            with CommandStats.lock:
+                CommandStats.get(tool).add(time.time() - start, exitcode, 0, 0)
+
+    @classmethod
+    def summary(cls):
+        """
+        Returns
+        -------
+        A dictionary of tool name => statistics
+        """
+        with CommandStats.lock:
+            return dict([(tool, stats.summary()) for (tool, stats) in CommandStats.tools.iteritems()])
+
+    @classmethod
+    def reset(cls):
+        with CommandStats.lock:
+            CommandStats.tools = {}
+
+    @classmethod
+    def dump(cls, path = None):
+        """
+        Write the statistics as JSON
+
+        Params
+        ------
+        path : string
+               File to write, defaults to the file given to enableDump()
+        """
+        if path is None:
+            path = CommandStats.dumpPath
+
+        report = {'pid':   os.getpid(),
+                  'time':  time.time(),
+                  'tools': CommandStats.summary()}
+
+        try:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=1, sort_keys=True)
+        except (IOError) as e:
+            Log.error('Unable to write command statistics to %s: %s' % (path, e))
+
+    @classmethod
+    def enableDump(cls, path):
+        """
+        Write the statistics to a file when the process exits and when
+        it receives SIGUSR1
+
+        Params
+        ------
+        path : string
+               The file to write
+        """
+        if CommandStats.dumpPath is None:
+            atexit.register(CommandStats.dump)
+
+            try:
+                signal.signal(signal.SIGUSR1, lambda signum, frame: CommandStats.dump())
+            except (ValueError) as e:
+                # Signal handlers can only be installed from the main thread
+                Log.debug(10, 'Not dumping command statistics on SIGUSR1: %s' % e)
+
+        CommandStats.dumpPath = path
+
+if os.environ.get('NMC_PROBE_STATS'):
+    CommandStats.enableDump(os.environ['NMC_PROBE_STATS'])
@@ -36,6 +36,7 @@
 
 import re, subprocess
 from nmc_probe.log import Log
+from nmc_probe.command import Command, CommandPool
 
 class Assert:
     @classmethod
@@ -66,8 +67,10 @@ class CommandError(Exception):
         return repr(self.output)
 
 class ZFS:
-    def __init__(self):
+    def __init__(self, timeout = None):
+        '''timeout -- wall clock seconds any single zfs command may run'''
         self.zfs = '/sbin/zfs'
+        self.timeout = timeout
 
     def getCount(self):
         if getattr(self, '_count', None) is None:
@@ -137,12 +140,39 @@ class ZFS:
         '''Run a zfs command'''
         cmd = args
         cmd.insert(0, self.zfs)
-        output = ''
-        try:
+        Log.info(' '.join(cmd))
+        return self.output(Command.execute(cmd, self.timeout))
+
+    def run_batch(self, argsList, pool = None):
+        '''Run several zfs commands at the same time
+
+        argsList -- array of argument arrays, as passed to run()
+        pool     -- CommandPool to run zfs in, defaults to the shared pool
+
+        Returns an array of outputs in the same order as argsList. If
+        any command fails, ValueError is raised once all have finished
+        '''
+        if pool is None:
+            pool = CommandPool.shared()
+
+        futures = []
+        for args in argsList:
+            cmd = [self.zfs] + args
             Log.info(' '.join(cmd))
-            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).split('\n')
-        except subprocess.CalledProcessError, e:
-            raise ValueError(str(e.output))
+            futures.append(pool.submit(cmd, self.timeout))
+
+        results = [future.result() for future in futures]
+        return [self.output(result) for result in results]
+
+    def output(self, result):
+        '''Convert a CommandResult from zfs into an array of lines,
+        raising ValueError if the command failed'''
+        if result.exitcode != 0:
+            if result.timedOut:
+                raise ValueError('%s timed out' % ' '.join(result.args))
+            raise ValueError(str((result.stdout or '') + (result.stderr or '')))
+
+        output = result.lines
 
         # Remove the first list of output
         output.pop(0)
@@ -155,7 +185,9 @@ class ZFS:
     def udevd_settle_down(self):
         '''Wait for udevd to create /dev/zvol devices'''
         udevadm_cmd = '/usr/sbin/udevadm'
-        subprocess.check_call([udevadm_cmd, 'settle'])
+        result = Command.execute([udevadm_cmd, 'settle'], self.timeout)
+        if result.exitcode != 0:
+            raise ValueError('%s settle failed: %s' % (udevadm_cmd, result.stderr))
 
     def create(self, params):
         '''zfs create